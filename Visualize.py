@@ -1,19 +1,23 @@
 from __future__ import division
 
-import scipy.misc
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style("whitegrid")
-import pandas as pd
-import imageio
 import os
-from skimage import img_as_ubyte
+
+# matplotlib, seaborn, pandas, imageio and skimage are imported by the
+# functions that use them, so that importing this module stays cheap.
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style("whitegrid")
+    return plt
 
 def plot_embedding(X, y, d, save_path, title=None):
     """Plot an embedding X with the class label y colored by the domain d."""
+    plt = _pyplot()
     x_min, x_max = np.min(X, 0), np.max(X, 0)
     X = (X - x_min) / (x_max - x_min)
     num_color = np.max(d) + 1
@@ -40,6 +44,7 @@ def plot_embedding(X, y, d, save_path, title=None):
     plt.close('all')
 
 def save_translated_target_img(translated_img, whole_img, whole_label, sourced, targetd, offset):
+    import imageio
     sourceTotargetPath = 'data/{}2{}'.format(sourced, targetd)
     if not os.path.exists(sourceTotargetPath):
         os.makedirs(sourceTotargetPath)
@@ -54,6 +59,9 @@ def save_translated_target_img(translated_img, whole_img, whole_label, sourced,
             print('saving {}-th image'.format(i))
 
 def save_projected_Qz(Qz_source, Qz_target, Pz, image_path, seaborn=False):
+    import pandas as pd
+    import seaborn as sns
+    plt = _pyplot()
     df = pd.DataFrame(columns=['distribution', 'x', 'y'])
     data = [Qz_source, Qz_target, Pz]
     for i, d in enumerate(data):
@@ -83,10 +91,12 @@ def save_reconstruction(images, size, image_path):
 
 
 def recover(images):
+    from skimage import img_as_ubyte
     return img_as_ubyte(0.5 * (images + 1.))
 
 
 def imsave(images, size, path):
+  import imageio
   image = np.squeeze(merge(images, size))
   print(path)
   return imageio.imwrite(path, image)
@@ -0,0 +1,262 @@
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import yaml
+from utils.config import load_config, merge_config
+from utils.runtime import apply_runtime, numa_nodes
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Tune threads, workers, CPU affinity and batch size "
+                                                 "on short trial runs of Solver._train_step")
+    parser.add_argument("--yaml", type=str, default='config.yaml',
+                        help="yaml pathway")
+    parser.add_argument("--overlay", type=str, default=None,
+                        help="start from this overlay on top of the yaml")
+    parser.add_argument("--output", type=str, default=None,
+                        help="overlay yaml with the best settings, for main.py --overlay")
+    parser.add_argument("--task", type=str, default=None,
+                        help="")
+    parser.add_argument("--target", type=str, default=None,
+                        help="")
+    parser.add_argument("--device", type=str, default='cpu',
+                        help="cpu or cuda:0")
+    parser.add_argument("--data_root", type=str, default='.',
+                        help="root of data/ as for main.py")
+    parser.add_argument("--synthetic", default=False, action='store_true',
+                        help="trial on synthetic domains instead of the real datasets")
+    parser.add_argument("--num_images", type=int, default=64,
+                        help="synthetic images per domain")
+    parser.add_argument("--steps", type=int, default=5,
+                        help="timed _train_step iterations per trial")
+    parser.add_argument("--warmup", type=int, default=2,
+                        help="untimed _train_step iterations per trial")
+    parser.add_argument("--threads", type=int, nargs='+', default=None,
+                        help="intra-op thread counts to try (default: main-process CPUs / 1, 2, 4)")
+    parser.add_argument("--interop_threads", type=int, nargs='+', default=[1, 2, 4],
+                        help="inter-op thread counts to try")
+    parser.add_argument("--workers", type=int, nargs='+', default=[0, 1, 2, 4],
+                        help="DataLoader workers per domain to try")
+    parser.add_argument("--per_domain", default=False, action='store_true',
+                        help="then refine the worker count of each domain separately")
+    parser.add_argument("--batch_size", type=int, nargs='+', default=None,
+                        help="per-domain batch sizes to try (not tuned by default: changes the SVD spectra)")
+    parser.add_argument("--numa_node", type=int, default=None,
+                        help="restrict to the CPUs of this NUMA node (default: the largest node)")
+    parser.add_argument("--no_MCD", default=True, action='store_false',
+                        help="")
+    parser.add_argument("--trial", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def run_trial(spec):
+    """Time spec['steps'] Solver._train_step iterations in this process."""
+    from solver import Solver
+    from utils.builder import build_models, build_optimizers, build_loader
+
+    config = spec['config']
+    task = config['data']['task']
+    device = spec['device']
+    apply_runtime(config['exp_setting']['runtime'])
+    if spec['synthetic']:
+        from benchmark.synthetic import register_synthetic_domains
+        batch_size = config['train']['batch_size'][task]
+        domains = register_synthetic_domains(config, spec['data_root'],
+                                             num_images=max(spec['num_images'], 2 * batch_size))
+        config['data']['domain'][task] = domains
+        config['data']['target'] = domains[-1]
+
+    log_dir = tempfile.mkdtemp(prefix='mian_tune_')
+    config['exp_setting']['log_dir'] = log_dir
+    config['exp_setting']['snapshot_dir'] = log_dir
+    loader = build_loader(config, rootdir=spec['data_root'])
+    num_domain = len(loader.dataset)
+    # Weights do not change the step time
+    basemodel, C1, C2, netDFeat = build_models(config, num_domain=num_domain, pretrained=False)
+    for m in [basemodel, C1, C2, netDFeat]:
+        m.to(device)
+    optBase, optC1, optC2, optDFeat = build_optimizers(config, basemodel, C1, C2, netDFeat)
+    gpu_map = {'basemodel': device, 'C': device, 'netDFeat': device, 'all_order': [0]}
+    args = argparse.Namespace(gpu=[0], exp_name='trial')
+    os.makedirs(os.path.join(log_dir, 'trial'))
+    solver = Solver(basemodel, C1, C2, netDFeat, loader, loader.TargetLoader,
+                    config['train']['base_model'][task]['lr'], config['train']['netD'][task]['lr'],
+                    task, num_domain, spec['MCD'], optBase, optC1, optC2, optDFeat, config, args, gpu_map)
+    for m in [basemodel, C1, C2, netDFeat]:
+        m.train()
+
+    times = []
+    for i in range(spec['warmup'] + spec['steps']):
+        start = time.perf_counter()
+        solver._train_step(i)
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        if i >= spec['warmup']:
+            times.append(time.perf_counter() - start)
+    median = float(np.median(times))
+    return {'median_ms': median * 1000., 'images_per_sec': num_domain * config['train']['batch_size'][task] / median}
+
+
+class Tuner(object):
+    """Greedy search, one setting at a time, each trial in a fresh process."""
+    def __init__(self, config, args):
+        self.config = config
+        self.args = args
+        self.task = config['data']['task']
+        self.num_domain = len(config['data']['domain'][self.task])
+        self.best = None
+        self.best_config = None
+        self.trials = []
+
+    def trial(self, config, name):
+        spec = {'config': config, 'device': self.args.device, 'data_root': self.args.data_root,
+                'synthetic': self.args.synthetic, 'num_images': self.args.num_images,
+                'steps': self.args.steps, 'warmup': self.args.warmup, 'MCD': self.args.no_MCD}
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(spec, f)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--trial', path],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        os.remove(path)
+        if proc.returncode != 0:
+            # e.g. out of memory at a large batch size
+            error = proc.stderr.decode().strip().splitlines()
+            print('{:50s} failed with exit code {}: {}'.format(name, proc.returncode, error[-1] if error else ''))
+            return None
+        result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        print('{:50s} {:10.1f} ms {:10.1f} images/s'.format(name, result['median_ms'], result['images_per_sec']))
+        self.trials.append(dict(result, name=name))
+        if self.best is None or result['images_per_sec'] > self.best['images_per_sec']:
+            self.best = result
+            self.best_config = config
+        return result
+
+    def search(self, name, candidates, update):
+        """Trial update(copy of the best config, candidate) for every candidate."""
+        base = self.best_config
+        for candidate in candidates:
+            config = copy.deepcopy(base)
+            update(config, candidate)
+            self.trial(config, '{} = {}'.format(name, candidate))
+
+    def run(self, cpus, threads, interop_threads, workers, per_domain, batch_sizes):
+        self.trial(self.config, 'baseline')
+        if self.best is None:
+            raise RuntimeError('the baseline trial failed; check that main.py runs with this config')
+
+        def set_workers(config, n):
+            config['data']['num_workers'] = n
+        self.search('num_workers', workers, set_workers)
+
+        def set_split(config, n_main):
+            runtime = config['exp_setting']['runtime']
+            runtime['main_cpus'] = cpus[:n_main]
+            runtime['worker_cpus'] = cpus[n_main:] or None
+            runtime['num_threads'] = n_main
+        num_workers = self.best_config['data']['num_workers']
+        total_workers = sum(num_workers) if isinstance(num_workers, list) else num_workers * self.num_domain
+        if len(cpus) > 1:
+            splits = [len(cpus)]
+            if total_workers > 0:
+                splits += [len(cpus) - min(total_workers, len(cpus) // 2), len(cpus) * 3 // 4, len(cpus) // 2]
+            splits = sorted(set(n for n in splits if n >= 1), reverse=True)
+            self.search('main/worker CPUs', splits, set_split)
+
+        main_cpus = self.best_config['exp_setting']['runtime']['main_cpus'] or cpus
+        if threads is None:
+            threads = sorted(set(max(len(main_cpus) // d, 1) for d in [1, 2, 4]), reverse=True)
+
+        def set_threads(config, n):
+            config['exp_setting']['runtime']['num_threads'] = n
+        self.search('num_threads', threads, set_threads)
+
+        def set_interop(config, n):
+            config['exp_setting']['runtime']['interop_threads'] = n
+        self.search('interop_threads', interop_threads, set_interop)
+
+        if per_domain:
+            for d in range(self.num_domain):
+                num_workers = self.best_config['data']['num_workers']
+                if not isinstance(num_workers, list):
+                    num_workers = [num_workers] * self.num_domain
+
+                def set_domain_workers(config, n, d=d, num_workers=num_workers):
+                    config['data']['num_workers'] = num_workers[:d] + [n] + num_workers[d+1:]
+                candidates = [n for n in [num_workers[d] - 1, num_workers[d] + 1] if n >= 0]
+                self.search('num_workers[{}]'.format(d), candidates, set_domain_workers)
+
+        if batch_sizes:
+            print('batch size changes the per-domain SVD spectra; check accuracy before adopting it')
+
+            def set_batch_size(config, n):
+                config['train']['batch_size'][self.task] = n
+            self.search('batch_size', batch_sizes, set_batch_size)
+
+    def overlay(self):
+        """The tuned entries of the best config, as an overlay for main.py --overlay."""
+        config = self.best_config
+        overlay = {
+            'exp_setting': {'runtime': config['exp_setting']['runtime']},
+            'data': {'num_workers': config['data']['num_workers']},
+        }
+        if config['train']['batch_size'][self.task] != self.config['train']['batch_size'][self.task]:
+            overlay['train'] = {'batch_size': {self.task: config['train']['batch_size'][self.task]}}
+        return overlay
+
+
+def main(args):
+    if args.trial is not None:
+        with open(args.trial, 'r') as f:
+            spec = json.load(f)
+        print(json.dumps(run_trial(spec)))
+        return
+
+    config = load_config(args.yaml)
+    if args.overlay is not None:
+        merge_config(config, load_config(args.overlay))
+    if args.task is not None:
+        config['data']['task'] = args.task
+    if args.target is not None:
+        config['data']['target'] = args.target
+    config['exp_setting'].setdefault('runtime', {})
+    for key in ['num_threads', 'interop_threads', 'main_cpus', 'worker_cpus']:
+        config['exp_setting']['runtime'].setdefault(key, None)
+
+    nodes = numa_nodes()
+    if args.numa_node is not None:
+        cpus = nodes[args.numa_node]
+    else:
+        cpus = max(nodes, key=len)
+    print('{} NUMA node(s) {}, tuning on CPUs {}'.format(len(nodes), [len(n) for n in nodes], cpus))
+    if len(nodes) > 1:
+        # Keep the trials on one node: cross-node memory traffic dominates otherwise
+        config['exp_setting']['runtime']['main_cpus'] = cpus
+
+    tuner = Tuner(config, args)
+    tuner.run(cpus, args.threads, args.interop_threads, args.workers, args.per_domain, args.batch_size)
+
+    overlay = tuner.overlay()
+    print('best: {:.1f} images/s ({:.1f} images/s baseline)'.format(
+        tuner.best['images_per_sec'], tuner.trials[0]['images_per_sec']))
+    print(yaml.safe_dump(overlay, default_flow_style=None))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            yaml.safe_dump(overlay, f, default_flow_style=None)
+        print('saved {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
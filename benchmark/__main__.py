@@ -0,0 +1,620 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+import yaml
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="MIAN performance benchmarks on synthetic domains")
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    run = sub.add_parser('run', help="time components and full training steps")
+    run.add_argument("--yaml", type=str, default='config.yaml',
+                     help="yaml pathway")
+    run.add_argument("--task", type=str, nargs='+', default=None,
+                     help="task presets to run (default: every task of the yaml)")
+    run.add_argument("--output", type=str, required=True,
+                     help="result json")
+    run.add_argument("--device", type=str, default='cpu',
+                     help="cpu or cuda:0")
+    run.add_argument("--iters", type=int, default=10,
+                     help="timed iterations per measurement")
+    run.add_argument("--steps", type=int, default=5,
+                     help="timed _train_step iterations per task")
+    run.add_argument("--batch_size", type=int, default=None,
+                     help="override the per-domain batch size of every task")
+    run.add_argument("--input_size", type=int, default=None,
+                     help="override input_size of every task")
+    run.add_argument("--crop_size", type=int, default=None,
+                     help="override crop_size of every task")
+    run.add_argument("--num_images", type=int, default=64,
+                     help="synthetic images per domain")
+    run.add_argument("--data_root", type=str, default=None,
+                     help="where synthetic data is written and reused (default: a temp dir)")
+    run.add_argument("--no_MCD", default=True, action='store_false',
+                     help="")
+    run.add_argument("--seed", type=int, default=0,
+                     help="")
+
+    allocs = sub.add_parser('allocs', help="allocator requests per training step, legacy vs static hot path")
+    allocs.add_argument("--yaml", type=str, default='config.yaml',
+                        help="yaml pathway")
+    allocs.add_argument("--task", type=str, nargs='+', default=None,
+                        help="task presets to run (default: every task of the yaml)")
+    allocs.add_argument("--device", type=str, default='cpu',
+                        help="cpu or cuda:0")
+    allocs.add_argument("--steps", type=int, default=5,
+                        help="profiled _train_step iterations per mode")
+    allocs.add_argument("--batch_size", type=int, default=None,
+                        help="override the per-domain batch size of every task")
+    allocs.add_argument("--num_images", type=int, default=64,
+                        help="synthetic images per domain")
+    allocs.add_argument("--data_root", type=str, default=None,
+                        help="where synthetic data is written and reused (default: a temp dir)")
+    allocs.add_argument("--mode", type=str, default='both', choices=['both', 'legacy', 'static'],
+                        help="train.static_step off, on, or both (one process each)")
+    allocs.add_argument("--seed", type=int, default=0,
+                        help="")
+
+    memory = sub.add_parser('memory', help="peak memory vs throughput over batch sizes, with/without checkpointing")
+    memory.add_argument("--yaml", type=str, default='config.yaml',
+                        help="yaml pathway")
+    memory.add_argument("--task", type=str, default='office',
+                        help="task preset")
+    memory.add_argument("--device", type=str, default='cpu',
+                        help="cpu or cuda:0")
+    memory.add_argument("--steps", type=int, default=3,
+                        help="timed _train_step iterations per point")
+    memory.add_argument("--batch_size", type=int, nargs='+', default=[16, 32, 64],
+                        help="per-domain batch sizes")
+    memory.add_argument("--checkpoint", type=str, default='both', choices=['both', 'off', 'on'],
+                        help="train.checkpoint off, on, or both")
+    memory.add_argument("--num_images", type=int, default=64,
+                        help="synthetic images per domain")
+    memory.add_argument("--data_root", type=str, default=None,
+                        help="where synthetic data is written and reused (default: a temp dir)")
+    memory.add_argument("--output", type=str, default=None,
+                        help="result json")
+    memory.add_argument("--point", default=False, action='store_true',
+                        help=argparse.SUPPRESS)
+
+    importtime = sub.add_parser('importtime', help="import time of the CLI entry modules (python -X importtime)")
+    importtime.add_argument("--modules", type=str, nargs='+', default=['main', 'solver', 'inference', 'autotune'],
+                            help="modules imported in a fresh interpreter each")
+    importtime.add_argument("--budget_ms", type=float, default=3000.,
+                            help="fail when importing a module takes longer")
+    importtime.add_argument("--forbid", type=str, nargs='+',
+                            default=['sklearn', 'matplotlib', 'seaborn', 'pandas', 'cv2', 'scipy', 'imageio', 'skimage'],
+                            help="fail when one of these packages is imported")
+    importtime.add_argument("--repeat", type=int, default=3,
+                            help="best of this many runs per module")
+    importtime.add_argument("--top", type=int, default=8,
+                            help="heaviest packages listed per module")
+
+    decode = sub.add_parser('decode', help="image loading time and output difference, full vs draft JPEG decoding")
+    decode.add_argument("--yaml", type=str, default='config.yaml',
+                        help="yaml pathway")
+    decode.add_argument("--task", type=str, default='office',
+                        help="folder-image task")
+    decode.add_argument("--domain", type=str, default=None,
+                        help="domain of data_root/data/{task}/ to read (default: synthetic JPEGs)")
+    decode.add_argument("--data_root", type=str, default=None,
+                        help="root of data/ as for main.py, or where synthetic data is written")
+    decode.add_argument("--image_size", type=int, default=1000,
+                        help="synthetic image size, e.g. ~1000 for Office DSLR")
+    decode.add_argument("--num_images", type=int, default=32,
+                        help="synthetic images, or at most this many real ones")
+    decode.add_argument("--split", type=str, default='val', choices=['train', 'val'],
+                        help="train: decode for Resize(resize) + RandomCrop, val: Resize(cropsize)")
+    decode.add_argument("--repeat", type=int, default=3,
+                        help="best of this many passes")
+
+    lowrank = sub.add_parser('lowrank', help="DigitMulti with dense vs rank-r factorized compress layers")
+    lowrank.add_argument("--yaml", type=str, default='config.yaml',
+                         help="yaml pathway")
+    lowrank.add_argument("--rank", type=int, nargs='+', default=[0, 1024, 512, 256, 128],
+                         help="ranks of compress1/compress2, 0 for the dense layers")
+    lowrank.add_argument("--device", type=str, default='cpu',
+                         help="")
+    lowrank.add_argument("--iters", type=int, default=10,
+                         help="timed iterations per component")
+    lowrank.add_argument("--steps", type=int, default=5,
+                         help="timed _train_step iterations")
+    lowrank.add_argument("--batch_size", type=int, default=None,
+                         help="per-domain batch size (default: config)")
+    lowrank.add_argument("--num_images", type=int, default=64,
+                         help="synthetic images per domain")
+    lowrank.add_argument("--data_root", type=str, default=None,
+                         help="where synthetic data is written (default: a temp dir)")
+    lowrank.add_argument("--seed", type=int, default=0,
+                         help="")
+    lowrank.add_argument("--output", type=str, default=None,
+                         help="result json")
+
+    replay = sub.add_parser('replay', help="discriminator loss per training step with extra replayed D updates")
+    replay.add_argument("--yaml", type=str, default='config.yaml',
+                        help="yaml pathway")
+    replay.add_argument("--task", type=str, default='digits',
+                        help="")
+    replay.add_argument("--updates", type=int, nargs='+', default=[0, 1, 4],
+                        help="extra D updates per step on replayed features, 0 for no replay")
+    replay.add_argument("--steps", type=int, default=50,
+                        help="training steps per setting")
+    replay.add_argument("--max_staleness", type=int, default=None,
+                        help="default: config")
+    replay.add_argument("--device", type=str, default='cpu',
+                        help="")
+    replay.add_argument("--batch_size", type=int, default=None,
+                        help="per-domain batch size (default: config)")
+    replay.add_argument("--num_images", type=int, default=256,
+                        help="synthetic images per domain")
+    replay.add_argument("--data_root", type=str, default=None,
+                        help="where synthetic data is written (default: a temp dir)")
+    replay.add_argument("--seed", type=int, default=0,
+                        help="")
+
+    concurrent = sub.add_parser('concurrent', help="training step time, sequential vs concurrent D update")
+    concurrent.add_argument("--yaml", type=str, default='config.yaml',
+                            help="yaml pathway")
+    concurrent.add_argument("--task", type=str, default='digits',
+                            help="")
+    concurrent.add_argument("--steps", type=int, default=20,
+                            help="timed training steps per schedule")
+    concurrent.add_argument("--warmup", type=int, default=2,
+                            help="")
+    concurrent.add_argument("--device", type=str, default='cpu',
+                            help="")
+    concurrent.add_argument("--batch_size", type=int, default=None,
+                            help="per-domain batch size (default: config)")
+    concurrent.add_argument("--num_images", type=int, default=256,
+                            help="synthetic images per domain")
+    concurrent.add_argument("--data_root", type=str, default=None,
+                            help="where synthetic data is written (default: a temp dir)")
+    concurrent.add_argument("--seed", type=int, default=0,
+                            help="")
+
+    timetoacc = sub.add_parser('timetoacc', help="wall-clock time to target accuracy of training runs")
+    timetoacc.add_argument("logs", type=str, nargs='+',
+                           help="log directories (log/{exp_name}) or val_result.txt files")
+    timetoacc.add_argument("--target", type=float, nargs='+', default=[],
+                           help="acc_ensemble thresholds (%%) to report the first time of")
+
+    compare = sub.add_parser('compare', help="flag regressions between two result files")
+    compare.add_argument("base", type=str, help="baseline result json")
+    compare.add_argument("new", type=str, help="new result json")
+    compare.add_argument("--threshold", type=float, default=0.1,
+                         help="relative slowdown of the median reported as regression")
+    return parser.parse_args()
+
+
+def _meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'num_threads': torch.get_num_threads(),
+    }
+
+
+def run(args):
+    from benchmark.components import Bench
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    tasks = args.task or list(config['data']['domain'].keys())
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    log_dir = tempfile.mkdtemp(prefix='mian_bench_log_')
+    meta = _meta()
+    meta.update({'device': args.device, 'iters': args.iters, 'steps': args.steps,
+                 'batch_size': args.batch_size, 'input_size': args.input_size, 'crop_size': args.crop_size,
+                 'MCD': args.no_MCD})
+    results = {}
+
+    for task in tasks:
+        torch.manual_seed(args.seed)
+        print('==> {}'.format(task))
+        bench = Bench(config, task, data_root, log_dir, device=args.device, batch_size=args.batch_size,
+                      input_size=args.input_size, crop_size=args.crop_size,
+                      num_images=args.num_images, MCD=args.no_MCD)
+        for name, result in bench.components(args.iters).items():
+            results['{}/{}'.format(task, name)] = result
+        results['{}/train_step'.format(task)] = bench.train_step(args.steps)
+        for name in sorted(k for k in results if k.startswith(task + '/')):
+            print('{:40s} {:10.2f} ms'.format(name, results[name]['median_ms']))
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print('saved {}'.format(args.output))
+
+
+def allocs(args):
+    if args.mode == 'both':
+        # Fresh process per mode: profiler memory buffers are not returned to
+        # the OS and two profiled runs in one process can exhaust host memory
+        argv = [a for a in sys.argv[1:] if a not in ('--mode', 'both')]
+        for mode in ['legacy', 'static']:
+            subprocess.check_call([sys.executable, '-m', 'benchmark'] + argv + ['--mode', mode])
+        return
+
+    from benchmark.components import Bench
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    config['train']['static_step'] = args.mode == 'static'
+    tasks = args.task or list(config['data']['domain'].keys())
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    log_dir = tempfile.mkdtemp(prefix='mian_bench_log_')
+
+    rows = []
+    for task in tasks:
+        torch.manual_seed(args.seed)
+        bench = Bench(config, task, data_root, log_dir, device=args.device, batch_size=args.batch_size,
+                      num_images=args.num_images)
+        for device, counts in sorted(bench.allocations(args.steps).items()):
+            rows.append((task, args.mode, device, counts['allocs_per_step'], counts['MB_per_step']))
+        del bench
+
+    print('{:24s} {:8s} {:>8s} {:>14s} {:>12s}'.format('task', 'mode', 'device', 'allocs/step', 'MB/step'))
+    for row in rows:
+        print('{:24s} {:8s} {:>8s} {:14.1f} {:12.2f}'.format(*row))
+
+
+def memory(args):
+    if args.point:
+        # One point per process: the CPU peak is the peak RSS of the process
+        from benchmark.components import Bench
+
+        config = yaml.safe_load(open(args.yaml, 'r'))
+        config['train']['checkpoint'] = args.checkpoint == 'on'
+        bench = Bench(config, args.task, args.data_root, tempfile.mkdtemp(prefix='mian_bench_log_'),
+                      device=args.device, batch_size=args.batch_size[0], num_images=args.num_images)
+        print(json.dumps(bench.peak_memory(args.steps)))
+        return
+
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    modes = ['off', 'on'] if args.checkpoint == 'both' else [args.checkpoint]
+    results = []
+    for batch_size in args.batch_size:
+        for mode in modes:
+            cmd = [sys.executable, '-m', 'benchmark', 'memory', '--point', '--yaml', args.yaml, '--task', args.task,
+                   '--device', args.device, '--steps', str(args.steps), '--batch_size', str(batch_size),
+                   '--checkpoint', mode, '--num_images', str(args.num_images), '--data_root', data_root]
+            try:
+                output = subprocess.check_output(cmd).decode()
+            except subprocess.CalledProcessError as e:
+                # Typically out of memory: the point is reported as failed
+                print('batch_size {} checkpoint {}: failed with exit code {}'.format(batch_size, mode, e.returncode))
+                results.append({'batch_size': batch_size, 'checkpoint': mode, 'failed': True})
+                continue
+            result = json.loads(output.strip().splitlines()[-1])
+            result.update({'batch_size': batch_size, 'checkpoint': mode})
+            results.append(result)
+
+    print('{:>10s} {:>10s} {:>10s} {:>12s} {:>12s}'.format('batch', 'checkpoint', 'peak MB', 'step ms', 'images/s'))
+    for r in results:
+        if r.get('failed'):
+            print('{:10d} {:>10s} {:>10s}'.format(r['batch_size'], r['checkpoint'], 'failed'))
+        else:
+            print('{:10d} {:>10s} {:10.0f} {:12.1f} {:12.1f}'.format(r['batch_size'], r['checkpoint'], r['peak_MB'],
+                                                                     r['median_ms'], r['items_per_sec']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': _meta(), 'task': args.task, 'results': results}, f, indent=2)
+        print('saved {}'.format(args.output))
+
+
+def _importtime(module):
+    """(cumulative ms of `import module`, self ms per imported top-level package) from -X importtime."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        errors = [l for l in proc.stderr.decode().splitlines() if l.strip() and not l.startswith('import time:')]
+        raise ImportError(errors[-1] if errors else 'exit code {}'.format(proc.returncode))
+    total = None
+    packages = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if name.strip() == module and not name[1:].startswith(' '):
+            total = int(cumulative_us) / 1000.
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.) + int(self_us) / 1000.
+    return total, packages
+
+
+def importtime(args):
+    failed = []
+    for module in args.modules:
+        try:
+            runs = [_importtime(module) for _ in range(args.repeat)]
+        except ImportError as e:
+            print('{}: import failed: {}'.format(module, e))
+            failed.append(module)
+            continue
+        total, packages = min(runs, key=lambda r: r[0])
+        forbidden = sorted(p for p in packages if p in args.forbid)
+        flag = ''
+        if total > args.budget_ms or forbidden:
+            flag = 'OVER BUDGET' if total > args.budget_ms else 'FORBIDDEN IMPORTS'
+            failed.append(module)
+        print('{:20s} {:9.1f} ms {}'.format(module, total, flag))
+        if forbidden:
+            print('  imports {}'.format(', '.join(forbidden)))
+        heaviest = sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]
+        print('  ' + ', '.join('{} {:.0f} ms'.format(name, ms) for name, ms in heaviest))
+    if failed:
+        print('{} module(s) failed the import budget of {:.0f} ms'.format(len(failed), args.budget_ms))
+        sys.exit(1)
+
+
+def decode(args):
+    import importlib
+    import numpy as np
+    import torchvision
+    from benchmark.synthetic import register_synthetic_domains
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    config['data']['task'] = args.task
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_decode_')
+    domain = args.domain
+    if domain is None:
+        domain = register_synthetic_domains(config, data_root, num_domain=1, num_images=args.num_images,
+                                            image_size=args.image_size)[0]
+    module = importlib.import_module('dataset.{}_dataset'.format(args.task))
+    # Without Normalize, so that the difference is in [0, 1] pixel units
+    datasets = {draft: getattr(module, '{}DataSet'.format(domain))(
+        '{}/data/{}/{}'.format(data_root, args.task, domain.lower()),
+        resize=config['data']['input_size'][args.task], cropsize=config['data']['crop_size'][args.task],
+        base_transform=[torchvision.transforms.ToTensor()], split=args.split, draft=draft)
+        for draft in [False, True]}
+    num_images = min(args.num_images, len(datasets[False]))
+    print('{} {} images of {}, decode size {}'.format(num_images, args.split, domain, datasets[True].decode_size))
+
+    outputs = {}
+    times = {}
+    for draft, dataset in datasets.items():
+        best = None
+        for _ in range(args.repeat):
+            # Same random crops for both decoders in the train split
+            torch.manual_seed(0)
+            start = time.perf_counter()
+            images = [dataset[i][0] for i in range(num_images)]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        outputs[draft] = images
+        times[draft] = 1000. * best / num_images
+    diff = [(a - b).abs() for a, b in zip(outputs[False], outputs[True])]
+    mse = float(np.mean([d.pow(2).mean().item() for d in diff]))
+    print('{:12s} {:9.2f} ms/image'.format('full decode', times[False]))
+    print('{:12s} {:9.2f} ms/image ({:.1f}x)'.format('draft', times[True], times[False] / times[True]))
+    print('draft vs full: mean abs {:.4f}, max abs {:.4f}, PSNR {:.1f} dB'.format(
+        float(np.mean([d.mean().item() for d in diff])), max(d.max().item() for d in diff),
+        10. * np.log10(1. / max(mse, 1e-12))))
+
+
+def lowrank(args):
+    import numpy as np
+    from benchmark.components import Bench, time_fn, summarize
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    log_dir = tempfile.mkdtemp(prefix='mian_bench_log_')
+    results = []
+    for rank in args.rank:
+        config['train']['rank'] = rank or None
+        torch.manual_seed(args.seed)
+        bench = Bench(config, 'digits', data_root, log_dir, device=args.device, batch_size=args.batch_size,
+                      num_images=args.num_images)
+        model = bench.basemodel
+        images, _ = bench.batch()
+        result = {'rank': rank, 'params': sum(p.numel() for p in model.parameters())}
+
+        def fwd_bwd():
+            model.zero_grad()
+            h, _ = model(images)
+            h.sum().backward()
+        bench.train()
+        result['fwd_bwd'] = summarize(time_fn(fwd_bwd, args.iters, device=args.device), images.size(0))
+        bench.eval()
+        with torch.no_grad():
+            result['forward'] = summarize(time_fn(lambda: model(images), args.iters, device=args.device),
+                                          images.size(0))
+            # The SVD regularizer acts on the spectrum of these per-domain features:
+            # singular values holding 90% of the energy around the domain mean
+            h, _ = model(images)
+            effective = []
+            for d in range(bench.num_domain):
+                d_feature = h[d*bench.batch_size: (d+1)*bench.batch_size]
+                S = torch.linalg.svdvals(d_feature - d_feature.mean(0))
+                energy = torch.cumsum(S ** 2, 0) / (S ** 2).sum()
+                effective.append(int((energy < 0.9).sum().item()) + 1)
+        result['feature_rank90'] = float(np.mean(effective))
+        result['train_step'] = bench.train_step(args.steps)
+        results.append(result)
+        del bench
+
+    print('{:>6s} {:>12s} {:>12s} {:>12s} {:>12s} {:>10s}'.format(
+        'rank', 'params', 'fwd ms', 'fwd+bwd ms', 'step ms', 'feat r90'))
+    for r in results:
+        print('{:>6s} {:12d} {:12.2f} {:12.2f} {:12.1f} {:10.1f}'.format(
+            str(r['rank'] or 'dense'), r['params'], r['forward']['median_ms'], r['fwd_bwd']['median_ms'],
+            r['train_step']['median_ms'], r['feature_rank90']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': _meta(), 'results': results}, f, indent=2)
+        print('saved {}'.format(args.output))
+
+
+def replay(args):
+    import numpy as np
+    from benchmark.components import Bench
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    log_dir = tempfile.mkdtemp(prefix='mian_bench_log_')
+    rows = []
+    for updates in args.updates:
+        config['train']['replay']['enabled'] = updates > 0
+        config['train']['replay']['updates'] = updates
+        if args.max_staleness is not None:
+            config['train']['replay']['max_staleness'] = args.max_staleness
+        torch.manual_seed(args.seed)
+        np.random.seed(args.seed)
+        bench = Bench(config, args.task, data_root, log_dir, device=args.device, batch_size=args.batch_size,
+                      num_images=args.num_images)
+        # D loss on each step's fresh features, before the D update: every step
+        # costs the same backbone forwards whatever the number of replayed updates
+        bench.solver.log_step = 1
+        bench.train()
+        start = time.time()
+        for i in range(args.steps):
+            bench.solver._train_step(i)
+        elapsed = (time.time() - start) / args.steps
+        D_loss = np.array(bench.solver.log_loss['D_loss'])
+        quarter = max(len(D_loss) // 4, 1)
+        staleness = np.mean(bench.solver.log_loss['D_replay_staleness']) if updates > 0 else 0.
+        rows.append((updates, D_loss[:quarter].mean(), D_loss[-quarter:].mean(), staleness, 1000. * elapsed))
+        del bench
+
+    print('{:>8s} {:>14s} {:>14s} {:>10s} {:>10s}'.format('updates', 'D loss first', 'D loss last', 'staleness',
+                                                          'step ms'))
+    for row in rows:
+        print('{:8d} {:14.4f} {:14.4f} {:10.1f} {:10.1f}'.format(*row))
+
+
+def concurrent(args):
+    import numpy as np
+    from benchmark.components import Bench
+
+    config = yaml.safe_load(open(args.yaml, 'r'))
+    data_root = args.data_root or tempfile.mkdtemp(prefix='mian_bench_')
+    log_dir = tempfile.mkdtemp(prefix='mian_bench_log_')
+    rows = []
+    for enabled in [False, True]:
+        config['train']['concurrent_D'] = enabled
+        torch.manual_seed(args.seed)
+        np.random.seed(args.seed)
+        bench = Bench(config, args.task, data_root, log_dir, device=args.device, batch_size=args.batch_size,
+                      num_images=args.num_images)
+        bench.solver.log_step = 1
+        bench.train()
+        for i in range(args.warmup):
+            bench.solver._train_step(i)
+        times = []
+        for i in range(args.warmup, args.warmup + args.steps):
+            start = time.time()
+            bench.solver._train_step(i)
+            times.append(time.time() - start)
+        if bench.solver.concurrent_D is not None:
+            bench.solver.concurrent_D.close()
+        D_loss = np.array(bench.solver.log_loss['D_loss'])
+        rows.append(('concurrent' if enabled else 'sequential', 1000. * np.median(times),
+                     D_loss[-max(len(D_loss) // 4, 1):].mean()))
+        del bench
+
+    print('device {}, {} CPUs, torch threads {}, interop threads {}'.format(
+        args.device, os.cpu_count(), torch.get_num_threads(), torch.get_num_interop_threads()))
+    print('{:>12s} {:>10s} {:>10s} {:>14s}'.format('D update', 'step ms', 'speedup', 'D loss last'))
+    for name, step_ms, D_loss in rows:
+        print('{:>12s} {:10.1f} {:9.2f}x {:14.4f}'.format(name, step_ms, rows[0][1] / step_ms, D_loss))
+
+
+def _val_results(path):
+    """(step, acc_ensemble, elapsed seconds) of every validation line of a val_result.txt."""
+    import re
+    if os.path.isdir(path):
+        path = os.path.join(path, 'val_result.txt')
+    pattern = re.compile(r'Iteration (\d+): .*acc_ensemble:([\d.]+) elapsed:(\d+)s')
+    results = []
+    with open(path, 'r') as f:
+        for line in f:
+            match = pattern.match(line)
+            if match:
+                results.append((int(match.group(1)), float(match.group(2)), float(match.group(3))))
+    # The async evaluator may finish snapshots out of submission order
+    return sorted(results)
+
+
+def timetoacc(args):
+    header = '{:32s} {:>8s} {:>8s} {:>10s}'.format('run', 'best acc', 'at step', 'at time')
+    for target in args.target:
+        header += ' {:>12s}'.format('t(>={:g})'.format(target))
+    print(header)
+    for path in args.logs:
+        results = _val_results(path)
+        name = os.path.basename(os.path.normpath(path))
+        if not results:
+            print('{:32s} no validation lines with elapsed time'.format(name))
+            continue
+        step, acc, elapsed = max(results, key=lambda r: r[1])
+        row = '{:32s} {:8.2f} {:8d} {:9.0f}s'.format(name, acc, step, elapsed)
+        for target in args.target:
+            reached = [r[2] for r in results if r[1] >= target]
+            row += ' {:>12s}'.format('{:.0f}s'.format(reached[0]) if reached else '-')
+        print(row)
+
+
+def compare(args):
+    base = json.load(open(args.base, 'r'))['results']
+    new = json.load(open(args.new, 'r'))['results']
+    regressions = []
+    print('{:40s} {:>12s} {:>12s} {:>8s}'.format('benchmark', 'base ms', 'new ms', 'ratio'))
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            print('{:40s} only in {}'.format(name, args.base if name in base else args.new))
+            continue
+        ratio = new[name]['median_ms'] / base[name]['median_ms']
+        flag = ''
+        if ratio > 1. + args.threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1. - args.threshold:
+            flag = 'faster'
+        print('{:40s} {:12.2f} {:12.2f} {:8.2f} {}'.format(name, base[name]['median_ms'],
+                                                        new[name]['median_ms'], ratio, flag))
+    if regressions:
+        print('{} regression(s) above {:.0f}%'.format(len(regressions), 100 * args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'allocs':
+        allocs(args)
+    elif args.command == 'memory':
+        memory(args)
+    elif args.command == 'importtime':
+        importtime(args)
+    elif args.command == 'decode':
+        decode(args)
+    elif args.command == 'lowrank':
+        lowrank(args)
+    elif args.command == 'replay':
+        replay(args)
+    elif args.command == 'concurrent':
+        concurrent(args)
+    elif args.command == 'timetoacc':
+        timetoacc(args)
+    elif args.command == 'compare':
+        compare(args)
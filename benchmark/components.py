@@ -0,0 +1,217 @@
+import argparse
+import copy
+import os
+import resource
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from benchmark.synthetic import register_synthetic_domains
+from model.SVD import SVD_entropy, SVD_norm
+from solver import Solver
+from utils.builder import build_models, build_optimizers, build_loader
+
+
+def _sync(device):
+    if str(device).startswith('cuda'):
+        torch.cuda.synchronize()
+
+
+def time_fn(fn, iters, warmup=2, device='cpu'):
+    """Wall time (s) of each of `iters` calls of fn after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    _sync(device)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        _sync(device)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times, items=None):
+    """Summary of a list of wall times, in ms; items per call gives a throughput."""
+    times = np.array(times) * 1000.
+    result = {
+        'median_ms': float(np.median(times)),
+        'mean_ms': float(np.mean(times)),
+        'std_ms': float(np.std(times)),
+        'min_ms': float(np.min(times)),
+        'n': len(times),
+    }
+    if items is not None:
+        result['items_per_sec'] = items / result['median_ms'] * 1000.
+    return result
+
+
+class Bench(object):
+    """
+    Solver, models and loader of one task preset of config.yaml, trained on
+    synthetic domains so that no real dataset is needed.
+    """
+    def __init__(self, config, task, rootdir, log_dir, device='cpu', batch_size=None,
+                 input_size=None, crop_size=None, num_images=64, MCD=True):
+        config = copy.deepcopy(config)
+        config['data']['task'] = task
+        if batch_size is not None:
+            config['train']['batch_size'][task] = batch_size
+        if input_size is not None:
+            config['data']['input_size'][task] = input_size
+        if crop_size is not None:
+            config['data']['crop_size'][task] = crop_size
+        self.batch_size = config['train']['batch_size'][task]
+
+        # drop_last loaders need at least one full batch per domain
+        num_images = max(num_images, 2 * self.batch_size)
+        domains = register_synthetic_domains(config, rootdir, num_images=num_images)
+        config['data']['domain'][task] = domains
+        config['data']['num_domain'][task] = len(domains)
+        config['data']['target'] = domains[-1]
+        config['exp_setting']['log_dir'] = log_dir
+        config['exp_setting']['snapshot_dir'] = log_dir
+        self.config = config
+        self.task = task
+        self.device = device
+        self.num_domain = len(domains)
+
+        self.loader = build_loader(config, rootdir=rootdir)
+        self.basemodel, self.C1, self.C2, self.netDFeat = build_models(config, pretrained=False)
+        for m in [self.basemodel, self.C1, self.C2, self.netDFeat]:
+            m.to(device)
+        optBase, optC1, optC2, optDFeat = build_optimizers(config, self.basemodel, self.C1, self.C2, self.netDFeat)
+
+        gpu_map = {
+            'basemodel': device,
+            'C': device,
+            'netDFeat': device,
+            'all_order': [0],
+        }
+        args = argparse.Namespace(gpu=[0], exp_name=task)
+        if not os.path.exists(os.path.join(log_dir, task)):
+            os.makedirs(os.path.join(log_dir, task))
+        self.solver = Solver(self.basemodel, self.C1, self.C2, self.netDFeat, self.loader, self.loader.TargetLoader,
+                             config['train']['base_model'][task]['lr'], config['train']['netD'][task]['lr'],
+                             task, self.num_domain, MCD, optBase, optC1, optC2, optDFeat, config, args, gpu_map)
+
+    def batch(self):
+        images, labels = next(self.loader)
+        return images.to(torch.float).to(self.device), labels.long().to(self.device)
+
+    def components(self, iters):
+        """Time every isolated component of a training step."""
+        solver = self.solver
+        device = self.device
+        images, labels = self.batch()
+        num_images = images.size(0)
+        results = {}
+
+        dataset = self.loader.source_dataset[0]
+        indices = iter(np.random.randint(0, len(dataset), size=100 * iters))
+        results['dataset_getitem'] = summarize(time_fn(lambda: dataset[next(indices)], iters * 10), 1)
+        results['loader_batch'] = summarize(time_fn(lambda: next(self.loader), iters), num_images)
+
+        def basemodel_fwd_bwd():
+            solver._zero_grad()
+            h, _ = self.basemodel(images)
+            h.sum().backward()
+        results['basemodel_fwd_bwd'] = summarize(time_fn(basemodel_fwd_bwd, iters, device=device), num_images)
+
+        with torch.no_grad():
+            features, _ = self.basemodel(images)
+
+        def discriminator_step():
+            solver.optDFeat.zero_grad()
+            logit = self.netDFeat(features)
+            F.mse_loss(logit, solver._real_domain_label(logit, 'Feat')).backward()
+            solver.optDFeat.step()
+        results['discriminator_step'] = summarize(time_fn(discriminator_step, iters, device=device))
+
+        leaf = features.clone().requires_grad_(True)
+
+        def svd_regularizer():
+            loss = 0.
+            for d in range(self.num_domain):
+                d_feature = leaf[d*self.batch_size: (d+1)*self.batch_size]
+                if solver.SVD_norm:
+                    norm, _ = SVD_norm(d_feature, solver.SVD_k)
+                    loss = loss + norm
+                else:
+                    en_transfer, en_discrim, _ = SVD_entropy(d_feature, solver.SVD_k)
+                    loss = loss - en_transfer - en_discrim
+            loss.backward()
+        results['svd_regularizer'] = summarize(time_fn(svd_regularizer, iters, device=device))
+
+        def mcd_phase():
+            solver._zero_grad()
+            loss_s, loss_dis = solver._maximum_classifier_discrepancy(images, labels)
+            (loss_s - loss_dis).backward()
+        results['mcd_phase'] = summarize(time_fn(mcd_phase, iters, device=device), num_images)
+
+        self.eval()
+        results['validation'] = summarize(time_fn(lambda: solver._validation(0), max(iters // 5, 1),
+                                                  warmup=1, device=device),
+                                          len(self.loader.TargetLoader))
+        self.train()
+        return results
+
+    def train_step(self, iters):
+        """Time full Solver._train_step iterations."""
+        step = [0]
+
+        def train_step():
+            self.solver._train_step(step[0])
+            step[0] += 1
+        self.train()
+        return summarize(time_fn(train_step, iters, device=self.device), self.num_domain * self.batch_size)
+
+    def peak_memory(self, steps):
+        """
+        Throughput of _train_step iterations and the peak memory in MB: the
+        allocator peak on CUDA, the process peak RSS on CPU (so one
+        measurement per process).
+        """
+        cuda = str(self.device).startswith('cuda')
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        result = self.train_step(steps)
+        if cuda:
+            result['peak_MB'] = torch.cuda.max_memory_allocated(self.device) / 2. ** 20
+        else:
+            result['peak_MB'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        return result
+
+    def allocations(self, steps, warmup=2):
+        """
+        Allocator requests per steady-state Solver._train_step, from the
+        torch.profiler memory events: count and bytes per device type.
+        """
+        self.train()
+        for i in range(warmup):
+            self.solver._train_step(i)
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if str(self.device).startswith('cuda'):
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, profile_memory=True) as prof:
+            for i in range(warmup, warmup + steps):
+                self.solver._train_step(i)
+        _sync(self.device)
+
+        result = {}
+        for event in prof.profiler.kineto_results.events():
+            if event.name() != '[memory]' or event.nbytes() <= 0:
+                continue
+            device = str(event.device_type()).split('.')[-1].lower()
+            counts = result.setdefault(device, {'allocs_per_step': 0., 'MB_per_step': 0.})
+            counts['allocs_per_step'] += 1. / steps
+            counts['MB_per_step'] += event.nbytes() / 2. ** 20 / steps
+        return result
+
+    def train(self):
+        for m in [self.basemodel, self.C1, self.C2, self.netDFeat]:
+            m.train()
+
+    def eval(self):
+        for m in [self.basemodel, self.C1, self.C2, self.netDFeat]:
+            m.eval()
@@ -0,0 +1,67 @@
+import os
+import importlib
+import pickle as pkl
+import numpy as np
+from PIL import Image
+
+
+def _write_folder_domain(root, num_classes, num_images, image_size):
+    # Random JPEGs in data/{task}/{domain}/{class}/, the layout of the Office datasets
+    rng = np.random.RandomState(0)
+    for i in range(num_images):
+        folder = os.path.join(root, 'class{:03d}'.format(i % num_classes))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        h, w = image_size, image_size + rng.randint(0, image_size // 4 + 1)
+        image = (rng.rand(h, w, 3) * 255).astype(np.uint8)
+        Image.fromarray(image).save(os.path.join(folder, '{:05d}.jpg'.format(i)), quality=90)
+
+
+def _write_pkl_domain(root, num_classes, num_images, image_size):
+    # data/digits/{domain}/{train,val}.pkl as read by dataset/digits_dataset.py
+    rng = np.random.RandomState(0)
+    os.makedirs(root)
+    for split in ['train', 'val']:
+        files = {
+            'img': (rng.rand(num_images, 3, image_size, image_size) * 255).astype(np.uint8),
+            'label': rng.randint(0, num_classes, size=num_images),
+        }
+        with open(os.path.join(root, '{}.pkl'.format(split)), 'wb') as f:
+            pkl.dump(files, f)
+
+
+def register_synthetic_domains(config, rootdir, num_domain=None, num_images=64, image_size=None):
+    """
+    Register Synth{i}DataSet classes in dataset.{task}_dataset, where
+    MultiDomainLoader looks them up, and write their data below rootdir/data.
+    Every class derives from the task's real dataset class, so the folder-image
+    tasks decode real JPEGs and the digits task goes through the pkl path.
+    Data already present in rootdir is reused.
+
+    Returns:
+      list of registered domain names, to be used as config['data']['domain'][task]
+    """
+    task = config['data']['task']
+    module = importlib.import_module('dataset.{}_dataset'.format(task))
+    base = getattr(module, '{}DataSet'.format(config['data']['domain'][task][0]))
+    if num_domain is None:
+        num_domain = len(config['data']['domain'][task])
+    num_classes = config['data']['num_classes'][task]
+    if image_size is None:
+        image_size = 32 if task == 'digits' else 300
+
+    names = []
+    for i in range(num_domain):
+        name = 'Synth{}'.format(i)
+        cls_name = '{}DataSet'.format(name)
+        setattr(module, cls_name, type(cls_name, (base,), {'__module__': module.__name__}))
+        names.append(name)
+
+        root = os.path.join(rootdir, 'data', task, name.lower())
+        if os.path.exists(root):
+            continue
+        if task == 'digits':
+            _write_pkl_domain(root, num_classes, num_images, image_size)
+        else:
+            _write_folder_domain(root, num_classes, num_images, image_size)
+    return names
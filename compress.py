@@ -0,0 +1,88 @@
+import argparse
+import copy
+import json
+import os
+import torch
+from model.ensemble import EnsemblePredictor
+from model.lowrank import truncation_error
+from utils.builder import build_models, build_target_valid_dataset, load_snapshot
+from utils.config import load_config
+from utils.evaluate import evaluate_accuracy, measure_latency, model_size_bytes
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Low-rank (truncated SVD) compress layers of a DigitMulti snapshot")
+    parser.add_argument("--snapshot", type=str, required=True,
+                        help="snapshot .pth written by Solver")
+    parser.add_argument("--config", type=str, required=True,
+                        help="config.json of the run (log/{exp_name}/config.json) or a yaml")
+    parser.add_argument("--rank", type=int, nargs='+', required=True,
+                        help="ranks to evaluate; each is used for both compress1 and compress2")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="write rank{r}.pth and rank{r}.json (config with train.rank) for every rank")
+    parser.add_argument("--rootdir", type=str, default='.',
+                        help="directory holding data/")
+    parser.add_argument("--batch_size", type=int, default=64,
+                        help="")
+    parser.add_argument("--latency_batch", type=int, default=32,
+                        help="batch size of the latency report")
+    return parser.parse_args()
+
+
+def count_parameters(module):
+    return sum(p.numel() for p in module.parameters())
+
+
+def main(args):
+    config = load_config(args.config)
+    task = config['data']['task']
+    assert task == 'digits', 'only the DigitMulti compress layers can be factorized, task is {}'.format(task)
+    assert config['train'].get('rank') is None, 'the snapshot is already factorized (train.rank {})'.format(
+        config['train']['rank'])
+    cropsize = config['data']['crop_size'][task]
+
+    basemodel, C1, C2, netDFeat = build_models(config, pretrained=False)
+    checkpoint = load_snapshot(args.snapshot, basemodel, C1, C2)
+    if 'netDFeat' in checkpoint:
+        netDFeat.load_state_dict(checkpoint['netDFeat'])
+    basemodel.eval()
+    dataset = build_target_valid_dataset(config, args.rootdir)
+    sample = torch.randn(args.latency_batch, 3, cropsize, cropsize)
+
+    def report(name, model):
+        ensemble = EnsemblePredictor(model, C1, C2).eval()
+        acc = evaluate_accuracy(ensemble, dataset, batch_size=args.batch_size)
+        latency = measure_latency(ensemble, sample)
+        print('{:8s} params {:10d} size {:6.1f}MB latency {:7.1f}ms target {} val acc {:.2f}'.format(
+            name, count_parameters(model), model_size_bytes(model) / 2**20, latency, config['data']['target'], acc))
+        return acc
+
+    acc_dense = report('dense', basemodel)
+    for rank in args.rank:
+        errors = [truncation_error(block[0], rank) for block in [basemodel.compress1, basemodel.compress2]]
+        print('rank {}: relative truncation error compress1 {:.4f} compress2 {:.4f}'.format(rank, *errors))
+        model = copy.deepcopy(basemodel).factorize(rank).eval()
+        acc = report('rank {}'.format(rank), model)
+        print('rank {}: acc delta {:+.2f}'.format(rank, acc - acc_dense))
+
+        if args.output_dir is not None:
+            if not os.path.exists(args.output_dir):
+                os.makedirs(args.output_dir)
+            snapshot = {'basemodel': model.state_dict(), 'C1': C1.state_dict(), 'C2': C2.state_dict()}
+            if 'netDFeat' in checkpoint:
+                snapshot['netDFeat'] = netDFeat.state_dict()
+            torch.save(snapshot, os.path.join(args.output_dir, 'rank{}.pth'.format(rank)))
+            rank_config = copy.deepcopy(config)
+            rank_config['train']['rank'] = rank
+            with open(os.path.join(args.output_dir, 'rank{}.json'.format(rank)), 'w') as f:
+                json.dump(rank_config, f)
+            print('saved {}'.format(os.path.join(args.output_dir, 'rank{}.pth'.format(rank))))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
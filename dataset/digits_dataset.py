@@ -3,7 +3,6 @@ import os.path as osp
 import numpy as np
 import random
 from glob import glob
-import matplotlib.pyplot as plt
 import collections
 import torch
 import torchvision
@@ -11,9 +10,9 @@ from torch.utils import data
 from PIL import Image
 from dataset.transforms import to_tensor_raw
 import pickle as pkl
-import cv2
 
 def resize_img(data, size=32, expand=False):
+    import cv2
     tmp = []
     for img in data:
         tmp.append(cv2.resize(img.transpose(1,2,0), dsize=(size,size),
@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import random
+import numpy as np
+import torch
+import torchvision
+from torch.utils import data
+from PIL import Image
+from dataset.transforms import load_image
+
+
+class _TransformView(data.Dataset):
+    """Folder-image dataset read through an arbitrary image transform."""
+
+    def __init__(self, dataset, transform):
+        self.dataset = dataset
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.dataset.files)
+
+    def __getitem__(self, index):
+        datafiles = self.dataset.files[index]
+        draft_size = self.dataset.decode_size if getattr(self.dataset, 'draft', False) else None
+        image = load_image(datafiles["img"], draft_size)
+        return self.transform(image)
+
+
+class CachedFeatureDataSet(data.Dataset):
+    """
+    Frozen-stage activations stored as a (num_views, N, C, H, W) .npy memmap.
+    View 0 holds the val transform, views 1..num_views fixed augmented views.
+    The train split samples one augmented view per __getitem__.
+    """
+
+    def __init__(self, path, labels, num_views, split='train'):
+        self.path = path
+        self.labels = labels
+        self.num_views = num_views
+        self.split = split
+        # Opened lazily so that DataLoader workers map the file themselves
+        # instead of receiving a pickled copy of it.
+        self.features = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['features'] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self.features is None:
+            self.features = np.load(self.path, mmap_mode='r')
+
+        if self.split == 'train' and self.num_views > 0:
+            view = random.randint(1, self.num_views)
+        else:
+            view = 0
+        feature = torch.from_numpy(np.array(self.features[view, index], np.float32))
+        label = torch.from_numpy(np.array(self.labels[index], np.int32))
+        return feature, label
+
+
+def _cache_dataset(basemodel, dataset, transforms, path, meta, fp16, device, batch_size, num_workers):
+    meta_path = path + '.json'
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            if json.load(f) == meta:
+                print('reuse feature cache {}'.format(path))
+                return
+        print('feature cache {} is stale (files, transforms or frozen weights changed), rebuilding'.format(path))
+
+    features = None
+    for v, transform in enumerate(transforms):
+        loader = torch.utils.data.DataLoader(_TransformView(dataset, transform),
+                batch_size=batch_size, num_workers=num_workers, shuffle=False)
+        offset = 0
+        for images in loader:
+            h = basemodel.frozen_features(images.to(device)).cpu().numpy()
+            if features is None:
+                shape = (len(transforms), len(dataset.files)) + h.shape[1:]
+                features = np.lib.format.open_memmap(path, mode='w+', shape=shape,
+                                                     dtype=np.float16 if fp16 else np.float32)
+            features[v, offset:offset+h.shape[0]] = h
+            offset += h.shape[0]
+        print('cached view {}/{} of {}'.format(v+1, len(transforms), path))
+
+    if features is None:
+        print('no images for {}, nothing cached'.format(path))
+        return
+    features.flush()
+    del features
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+def _frozen_fingerprint(basemodel):
+    """md5 over the parameters and buffers of the frozen stages, i.e. the weights the cached activations depend on."""
+    md5 = hashlib.md5()
+    for stage in basemodel.stages()[:basemodel.freeze_stages]:
+        for name, tensor in stage.state_dict().items():
+            md5.update(name.encode())
+            md5.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return md5.hexdigest()
+
+
+def build_feature_cache(loader, basemodel, cache_dir, num_views=4, fp16=True,
+                        device='cpu', batch_size=32, num_workers=1):
+    """
+    Precompute the activations of basemodel's frozen stages for every dataset
+    of a MultiDomainLoader and switch the loader over to the cached features.
+    Caches are keyed by domain, split, frozen stage and resolution, and are
+    reused across runs as long as the file list, the transforms and the
+    frozen-stage weights match.
+    """
+    assert basemodel.freeze_stages > 0, 'feature cache needs frozen stages'
+    assert all(hasattr(d, 'files') for d in loader.source_dataset + [loader.target_dataset]), \
+        'feature cache supports folder-image datasets only'
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    val_transform = torchvision.transforms.Compose(
+        [torchvision.transforms.Resize((loader.cropsize, loader.cropsize), interpolation=Image.BICUBIC)] +
+        loader.base_transform)
+
+    was_training = basemodel.training
+    basemodel.eval()
+    weights = _frozen_fingerprint(basemodel)
+    cached = []
+    datasets = [(d, name, 'train') for d, name in zip(loader.source_dataset, loader.dataset[:-1])] + \
+        [(loader.target_dataset, loader.dataset[-1], 'train'),
+         (loader.target_valid_dataset, loader.dataset[-1], 'val')]
+    for dataset, name, split in datasets:
+        if split == 'train':
+            transforms = [val_transform] + [dataset.image_transform] * num_views
+        else:
+            transforms = [dataset.image_transform]
+        path = os.path.join(cache_dir, '{}_{}_{}_conv{}_{}.npy'.format(
+            loader.task, name.lower(), split, basemodel.freeze_stages, loader.cropsize))
+        files = '\n'.join(f['img'] for f in dataset.files)
+        meta = {
+            'files': hashlib.md5(files.encode()).hexdigest(),
+            'num_files': len(dataset.files),
+            'num_views': len(transforms) - 1,
+            'resize': loader.resize,
+            'cropsize': loader.cropsize,
+            'fp16': fp16,
+            'draft': getattr(dataset, 'draft', False),
+            'transforms': hashlib.md5('\n'.join(repr(t) for t in transforms).encode()).hexdigest(),
+            'weights': weights,
+        }
+        _cache_dataset(basemodel, dataset, transforms, path, meta, fp16, device, batch_size, num_workers)
+        labels = [f['label'] for f in dataset.files]
+        cached.append(CachedFeatureDataSet(path, labels, len(transforms) - 1, split=split))
+    basemodel.train(was_training)
+
+    loader.replace_datasets(cached[:-2], cached[-2], cached[-1])
+    basemodel.input_stage = basemodel.freeze_stages
@@ -0,0 +1,48 @@
+import os
+import torchvision
+from torch.utils import data
+from PIL import Image
+from dataset.transforms import load_image
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+def list_images(path):
+    """
+    Images to label: every image below a directory (sorted), or the paths
+    listed one per line in a text file.
+    """
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files += [os.path.join(root, n) for n in names if n.lower().endswith(IMG_EXTENSIONS)]
+        return sorted(files)
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def val_transform(task, cropsize):
+    """Same preprocessing as the val split of the training datasets."""
+    # Digits pkl files are resized with bilinear interpolation (dataset/digits_dataset.py)
+    interpolation = Image.BILINEAR if task == 'digits' else Image.BICUBIC
+    return torchvision.transforms.Compose([
+        torchvision.transforms.Resize((cropsize, cropsize), interpolation=interpolation),
+        torchvision.transforms.ToTensor(),
+        torchvision.transforms.Normalize(
+            mean=[0.485, 0.456, 0.406],
+            std=[0.229, 0.224, 0.225]),
+        ])
+
+
+class ImageListDataSet(data.Dataset):
+    def __init__(self, files, transform, draft_size=None):
+        self.files = files
+        self.transform = transform
+        self.draft_size = draft_size
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, index):
+        image = load_image(self.files[index], self.draft_size)
+        return self.transform(image), index
@@ -1,4 +1,5 @@
 import os.path
+import functools
 
 from PIL import Image
 import torch.utils.data
@@ -6,12 +7,44 @@ import torchvision
 import importlib
 import numpy as np
 
-from dataset.transforms import augment_collate
+from dataset.transforms import augment_collate, batch_augment_collate
+from utils.runtime import set_worker_affinity
+
+def default_base_transform():
+    return [
+        torchvision.transforms.ToTensor(),
+        torchvision.transforms.Normalize(
+            mean=[0.485, 0.456, 0.406],
+            std=[0.229, 0.224, 0.225]),
+        ]
+
+
+def dataset_kwargs(task, draft=False):
+    # Only the folder-image datasets decode JPEGs
+    return {'draft': True} if draft and task not in ('digits', 'segmentation') else {}
+
+
+def target_valid_dataset(task, target, rootdir, resize, cropsize, base_transform=None, draft=False):
+    """Val split of the target domain, as MultiDomainLoader builds it."""
+    if base_transform is None:
+        base_transform = default_base_transform()
+    module = importlib.import_module('dataset.{}_dataset'.format(task))
+    datadir = os.path.join(rootdir, 'data')
+    txtdir = os.path.join(rootdir, 'dataset')
+    datadir_ = os.path.join(datadir, target) if task == 'segmentation' else '{}/{}/{}'.format(datadir, task, target.lower())
+    txtdir_ = os.path.join(txtdir, '{}_list'.format(target))
+    return getattr(module, '{}DataSet'.format(target))(datadir_, txtdir_,
+                                                       split='val',
+                                                       resize=resize,
+                                                       cropsize=cropsize,
+                                                       base_transform=base_transform,
+                                                       **dataset_kwargs(task, draft))
+
 
 class MultiDomainLoader(object):
     def __init__(self, dataset, rootdir, resize, cropsize,
                  batch_size=1, shuffle=True, num_workers=2, half_crop=None,
-                 task='segmentation'):
+                 task='segmentation', worker_cpus=None, joint_augment=False, draft=False):
         """
         dataset: list of domains, ['Cityscapes', 'GTA5', ...]
         rootdir: root for data folders
@@ -22,25 +55,32 @@ class MultiDomainLoader(object):
         resize: new (w, h)
         crop_size: randomly crop data for augmentation
         batch_size: per domain
+        num_workers: for every domain, or a list with one count per domain
+        worker_cpus: CPU ids the DataLoader workers are pinned to
+        joint_augment: segmentation only, random crop to cropsize (half crop
+                       with half_crop) and flip of image and label batches
+        draft: folder datasets, decode JPEGs at a reduced DCT scale (PIL draft)
         """
-        self.base_transform = [
-            torchvision.transforms.ToTensor(),
-            torchvision.transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225]),
-            ]
+        self.base_transform = default_base_transform()
         self.dataset = dataset
         self.resize = resize
         self.cropsize = cropsize
         self.half_crop = half_crop
         self.batch_size = batch_size
         self.shuffle = shuffle
+        if isinstance(num_workers, int):
+            num_workers = [num_workers] * len(dataset)
+        assert len(num_workers) == len(dataset), \
+            'num_workers needs one count per domain, got {} for {}'.format(num_workers, dataset)
         self.num_workers = num_workers
+        self.worker_cpus = worker_cpus
+        self.joint_augment = joint_augment and task == 'segmentation'
         self.task = task
 
         datadir = os.path.join(rootdir, 'data')
         txtdir = os.path.join(rootdir, 'dataset')
         module = importlib.import_module('dataset.{}_dataset'.format(task))
+        domain_kwargs = dataset_kwargs(task, draft)
 
         self.source_dataset = []
 
@@ -51,7 +91,8 @@ class MultiDomainLoader(object):
             source_ = getattr(module, '{}DataSet'.format(source))(datadir_, txtdir_,
                                                                   resize=self.resize,
                                                                   cropsize=self.cropsize,
-                                                                  base_transform=self.base_transform)
+                                                                  base_transform=self.base_transform,
+                                                                  **domain_kwargs)
             self.source_dataset.append(source_)
 
         target = self.dataset[-1]
@@ -60,15 +101,12 @@ class MultiDomainLoader(object):
         target_ = getattr(module, '{}DataSet'.format(target))(datadir_, txtdir_,
                                                               resize=self.resize,
                                                               cropsize=self.cropsize,
-                                                              base_transform=self.base_transform)
+                                                              base_transform=self.base_transform,
+                                                              **domain_kwargs)
         self.target_dataset = target_
 
-        target_val = getattr(module, '{}DataSet'.format(target))(datadir_, txtdir_,
-                                                            split='val',
-                                                            resize=self.resize,
-                                                            cropsize=self.cropsize,
-                                                            base_transform=self.base_transform)
-        self.target_valid_dataset = target_val
+        self.target_valid_dataset = target_valid_dataset(task, target, rootdir, self.resize, self.cropsize,
+                                                         self.base_transform, draft)
 
         for i,d in enumerate(self.source_dataset):
             print('{}-th source / {}: length={}'.format(i+1, d, len(self.source_dataset[i])))
@@ -106,6 +144,33 @@ class MultiDomainLoader(object):
         self.num += 1
         return img, label
 
+    def replace_datasets(self, source_dataset, target_dataset, target_valid_dataset):
+        """
+        Swap in new per-domain datasets (e.g. cached features) and rebuild
+        the loaders and iterators on top of them.
+        """
+        self.source_dataset = source_dataset
+        self.target_dataset = target_dataset
+        self.target_valid_dataset = target_valid_dataset
+        self.set_loader()
+        self.iter_list = [iter(l) for l in self.loader_list]
+        self.TargetLoader = TargetDomainLoader(self.target_valid_dataset, self.set_loader(target=True))
+
+    def set_resolution(self, resize, cropsize):
+        """
+        Train on resize/cropsize images from the next batch on. The source and
+        target datasets rebuild their transforms (and draft decode size) in
+        place and the iterators restart, since the loader workers hold copies
+        of the datasets; the DataLoaders themselves are kept. The target val
+        set stays at the resolution it was built with.
+        """
+        assert not self.joint_augment, 'joint_augment crops in the collate function at a fixed cropsize'
+        self.resize = resize
+        self.cropsize = cropsize
+        for d in self.source_dataset + [self.target_dataset]:
+            d.set_resolution(resize, cropsize)
+        self.iter_list = [iter(l) for l in self.loader_list]
+
     def next_target_test(self):
         return self.next(return_target_label=True)
 
@@ -118,21 +183,27 @@ class MultiDomainLoader(object):
 
         batch_size = self.batch_size
         shuffle = self.shuffle
-        num_workers = self.num_workers
-        assert num_workers == 1
+        worker_init_fn = None
+        if self.worker_cpus:
+            worker_init_fn = functools.partial(set_worker_affinity, self.worker_cpus)
 
         #collate_fn = lambda batch: augment_collate(batch, crop=None, halfcrop=None, flip=True)
         collate_fn=torch.utils.data.dataloader.default_collate
         if target:
             loader_tgt = torch.utils.data.DataLoader(self.target_valid_dataset,
-                    batch_size=batch_size, num_workers=num_workers, drop_last=False,
-                    collate_fn=collate_fn, pin_memory=True, shuffle=True)
+                    batch_size=batch_size, num_workers=self.num_workers[-1], drop_last=False,
+                    collate_fn=collate_fn, pin_memory=True, shuffle=True, worker_init_fn=worker_init_fn)
             return loader_tgt
 
-        for s in self.dataset_list:
+        if self.joint_augment:
+            # One gather per batch in the workers instead of per-sample transforms
+            collate_fn = functools.partial(batch_augment_collate, crop=self.cropsize,
+                                           halfcrop=bool(self.half_crop), flip=True)
+
+        for s, num_workers in zip(self.dataset_list, self.num_workers):
             loader_src = torch.utils.data.DataLoader(s,
                     batch_size=batch_size, num_workers=num_workers, drop_last=True,
-                    collate_fn=collate_fn, pin_memory=True, shuffle=True)
+                    collate_fn=collate_fn, pin_memory=True, shuffle=True, worker_init_fn=worker_init_fn)
             loader_list.append((loader_src))
         self.loader_list = loader_list
 
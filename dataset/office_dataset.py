@@ -3,24 +3,23 @@ import os.path as osp
 import numpy as np
 import random
 from glob import glob
-import matplotlib.pyplot as plt
 import collections
 import torch
 import torchvision
 from torch.utils import data
 from PIL import Image
-from dataset.transforms import to_tensor_raw
+from dataset.transforms import to_tensor_raw, load_image
 
 
 class AmazonDataSet(data.Dataset):
-    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train'):
+    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train', draft=False):
         self.root = root
         self.list_path = list_path
-        self.resize = resize
-        self.cropsize = cropsize
+        self.base_transform = base_transform
         self.img_folders = sorted(glob(self.root + '/*'))
         self.files = []
         self.split = split
+        self.draft = draft
 
         for i, folder in enumerate(self.img_folders):
             for img in glob(folder + '/*'):
@@ -30,16 +29,25 @@ class AmazonDataSet(data.Dataset):
                     "label": i,
                 })
 
-        if split == 'train':
+        self.set_resolution(resize, cropsize)
+
+    def set_resolution(self, resize, cropsize):
+        """Rebuild the transforms for another resize/cropsize, e.g. at a progressive-resolution phase."""
+        self.resize = resize
+        self.cropsize = cropsize
+        # JPEGs are decoded at a reduced DCT scale still covering the first resize
+        self.decode_size = self.resize if self.split == 'train' and resize > cropsize else self.cropsize
+
+        if self.split == 'train':
             assert resize >= cropsize
             if resize > cropsize:
                 image_transform = [torchvision.transforms.Resize(self.resize, interpolation=Image.BICUBIC),
-                                   torchvision.transforms.RandomCrop(self.cropsize)] + base_transform
+                                   torchvision.transforms.RandomCrop(self.cropsize)] + self.base_transform
             else:
-                image_transform = [torchvision.transforms.Resize((self.cropsize,self.cropsize), interpolation=Image.BICUBIC)] + base_transform
+                image_transform = [torchvision.transforms.Resize((self.cropsize,self.cropsize), interpolation=Image.BICUBIC)] + self.base_transform
 
-        elif split == 'val':
-            image_transform = [torchvision.transforms.Resize((self.cropsize,self.cropsize), interpolation=Image.BICUBIC)] + base_transform
+        elif self.split == 'val':
+            image_transform = [torchvision.transforms.Resize((self.cropsize,self.cropsize), interpolation=Image.BICUBIC)] + self.base_transform
 
         self.image_transform = torchvision.transforms.Compose(image_transform)
 
@@ -49,7 +57,7 @@ class AmazonDataSet(data.Dataset):
     def __getitem__(self, index):
         datafiles = self.files[index]
 
-        image = Image.open(datafiles["img"]).convert('RGB')
+        image = load_image(datafiles["img"], self.decode_size if self.draft else None)
         label = datafiles["label"]
         image = self.image_transform(image)
         label = torch.from_numpy(np.array(label, np.int32, copy=False))
@@ -57,10 +65,10 @@ class AmazonDataSet(data.Dataset):
 
 
 class DSLRDataSet(AmazonDataSet):
-    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train'):
-        super(DSLRDataSet, self).__init__(root, list_path, base_transform, resize, cropsize, split)
+    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train', draft=False):
+        super(DSLRDataSet, self).__init__(root, list_path, base_transform, resize, cropsize, split, draft)
 
 
 class WebcamDataSet(AmazonDataSet):
-    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train'):
-        super(WebcamDataSet, self).__init__(root, list_path, base_transform, resize, cropsize, split)
+    def __init__(self, root, list_path=None, base_transform=None, resize=300, cropsize=256, split='train', draft=False):
+        super(WebcamDataSet, self).__init__(root, list_path, base_transform, resize, cropsize, split, draft)
@@ -2,19 +2,23 @@ import os
 import os.path as osp
 import numpy as np
 import random
-import matplotlib.pyplot as plt
 import collections
 import torch
 import torchvision
 from torch.utils import data
 from PIL import Image
+from dataset.transforms import to_tensor_raw
 
 
 class GTADataSet(data.Dataset):
-    def __init__(self, root, list_path, base_transform=None, resize=(1024, 512), ignore_label=255):
+    def __init__(self, root, list_path, base_transform=None, resize=(1024, 512), ignore_label=255,
+                 cropsize=None, split='train'):
+        # cropsize: crops are taken per batch (MultiDomainLoader joint_augment)
         self.root = root
         self.list_path = list_path
         self.resize = resize
+        self.cropsize = cropsize
+        self.split = split
         self.ignore_label = ignore_label
         self.img_ids = sorted([i_id.strip() for i_id in open(os.path.join(list_path, 'train_img.txt'))])
         self.files = []
@@ -62,8 +66,9 @@ class GTADataSet(data.Dataset):
         return image, label
 
 class CityscapesDataSet(GTADataSet):
-    def __init__(self, root, list_path, base_transform=None, resize=(1024, 512), ignore_label=255, split='train'):
-        super(CityscapesDataSet, self).__init__(root, list_path, base_transform, resize, ignore_label)
+    def __init__(self, root, list_path, base_transform=None, resize=(1024, 512), ignore_label=255,
+                 cropsize=None, split='train'):
+        super(CityscapesDataSet, self).__init__(root, list_path, base_transform, resize, ignore_label, cropsize)
         self.files = []
         self.split = split
         self.img_ids = sorted([i_id.strip() for i_id in open(os.path.join(list_path, '{}_img.txt'.format(split)))])
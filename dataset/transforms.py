@@ -4,6 +4,7 @@ import random
 
 import torch
 import torchvision
+from PIL import Image
 
 
 class RandomCrop(object):
@@ -36,32 +37,35 @@ class RandomCrop(object):
         return output
 
 class HalfCrop(object):
-    """Crops halt the given PIL.Image randomly takes left or right to have a region of
-    the given size. size can be a tuple (target_height, target_width)
-    or an integer, in which case the target will be of a square shape (size, size)
+    """Crops the left or the right half (chosen at random) of the given tensors.
+    size, when given, is the (target_height, target_width) the tensors were
+    cropped to before; otherwise the width of the tensors is halved.
     """
 
+    def __init__(self, size=None):
+        if isinstance(size, numbers.Number):
+            self.size = (int(size), int(size))
+        else:
+            self.size = size
+
     def __call__(self, tensors):
         output = []
-        th, tw = self.size
+        tw = self.size[1] if self.size is not None else tensors[0].size(-1)
         tw_half = tw // 2
         left_side = random.randint(0, 1)
         x1 = 0 + left_side * tw_half  #random.randint(0, w - tw)
         for tensor in tensors:
-            output.append(tensor[..., ..., x1:x1 + tw_half].contiguous())
+            output.append(tensor[..., x1:x1 + tw_half].contiguous())
         return output
 
 class RandomHorizontalFlip(object):
-    """Randomly horizontally flips the given PIL.Image with a probability of 0.5
+    """Randomly horizontally flips the given tensors (image and label together)
+    with a probability of 0.5
     """
 
     def __call__(self, tensors):
         if random.random() < 0.5:
-            output = []
-            indices = torch.arange(tensors[0].size(-1) - 1, -1, -1).long()
-            output.append(tensors[0].index_select(-1, indices))
-            output.append(tensors[1])
-            return output
+            return [tensor.flip(-1) for tensor in tensors]
 
         return tensors
 
@@ -71,12 +75,97 @@ def augment_collate(batch, crop=None, halfcrop=None, flip=True):
     if crop is not None:
         transforms.append(RandomCrop(crop))
     if halfcrop is not None:
-        transforms.append(HalfCrop())
+        transforms.append(HalfCrop(crop))
     if flip:
         transforms.append(RandomHorizontalFlip())
     transform = torchvision.transforms.Compose(transforms)
     batch = [transform(x) for x in batch]
     return torch.utils.data.dataloader.default_collate(batch)
 
+
+class BatchJointTransform(object):
+    """
+    Per-sample random crop, half crop and horizontal flip of a batch, applied
+    to images (n, c, h, w) and labels (n, h, w) together. Crop windows and
+    flips of all samples are drawn at once; flips are one gather along the
+    width for the whole batch. Labels are only ever indexed, never
+    interpolated (nearest neighbor).
+    """
+
+    def __init__(self, crop=None, halfcrop=False, flip=True):
+        if isinstance(crop, numbers.Number):
+            crop = (int(crop), int(crop))
+        self.crop = crop
+        self.halfcrop = halfcrop
+        self.flip = flip
+
+    def windows(self, n, h, w):
+        """Top-left corners (y1, x1) of shape (n,), crop size (th, tw) and (n,) flip flags."""
+        th, tw = self.crop if self.crop is not None else (h, w)
+        if th > h or tw > w:
+            raise ValueError('crop {} is larger than the images {}'.format((th, tw), (h, w)))
+        y1 = torch.randint(0, h - th + 1, (n,))
+        x1 = torch.randint(0, w - tw + 1, (n,))
+        if self.halfcrop:
+            tw = tw // 2
+            x1 = x1 + torch.randint(0, 2, (n,)) * tw
+        flip = torch.rand(n) < 0.5 if self.flip else torch.zeros(n, dtype=torch.bool)
+        return y1, x1, (th, tw), flip
+
+    def _flip(self, images, labels, flip):
+        if not flip.any():
+            return images, labels
+        n, c, th, tw = images.shape
+        cols = torch.arange(tw)
+        cols = torch.where(flip[:, None], cols.flip(0)[None, :], cols[None, :]).to(images.device)
+        images = images.gather(3, cols[:, None, None, :].expand(n, c, th, tw))
+        labels = labels.gather(2, cols[:, None, :].expand(n, th, tw).to(labels.device))
+        return images, labels
+
+    def __call__(self, images, labels):
+        """Augment a collated batch, e.g. already on the GPU."""
+        n, c, h, w = images.shape
+        y1, x1, (th, tw), flip = self.windows(n, h, w)
+        rows = (y1[:, None] + torch.arange(th)[None, :]).to(images.device)
+        cols = (x1[:, None] + torch.arange(tw)[None, :]).to(images.device)
+        index = (rows[:, :, None] * w + cols[:, None, :]).view(n, 1, -1)
+        images = images.flatten(2).gather(2, index.expand(n, c, -1)).view(n, c, th, tw)
+        labels = labels.flatten(1).gather(1, index[:, 0].to(labels.device)).view(n, th, tw)
+        return self._flip(images, labels, flip)
+
+    def collate(self, batch):
+        """
+        Collate (image, label) samples into the augmented batch. The windows
+        are stacked as views, so only the cropped pixels are copied.
+        """
+        _, h, w = batch[0][0].shape
+        y1, x1, (th, tw), flip = self.windows(len(batch), h, w)
+        y1, x1 = y1.tolist(), x1.tolist()
+        images = torch.stack([image[:, y: y + th, x: x + tw] for (image, _), y, x in zip(batch, y1, x1)])
+        labels = torch.stack([torch.as_tensor(label)[y: y + th, x: x + tw]
+                              for (_, label), y, x in zip(batch, y1, x1)])
+        return self._flip(images, labels, flip)
+
+
+def batch_augment_collate(batch, crop=None, halfcrop=False, flip=True):
+    """DataLoader collate_fn returning batches augmented by BatchJointTransform."""
+    return BatchJointTransform(crop, halfcrop, flip).collate(batch)
+
+
+def load_image(path, draft_size=None):
+    """
+    RGB PIL.Image of path. With draft_size (an int or (w, h)), JPEGs are
+    decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still gives at
+    least draft_size in both dimensions; the caller's Resize does the rest.
+    Other formats are decoded in full.
+    """
+    image = Image.open(path)
+    if draft_size is not None:
+        if isinstance(draft_size, numbers.Number):
+            draft_size = (int(draft_size), int(draft_size))
+        image.draft('RGB', tuple(draft_size))
+    return image.convert('RGB')
+
+
 def to_tensor_raw(im):
     return torch.from_numpy(np.array(im, np.int32, copy=False))
@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+import torch
+import torch.optim as optim
+from model.ensemble import EnsemblePredictor
+from model.student import Student, STUDENT_ARCHS
+from model.weights import weight_path
+from utils.builder import build_models, build_loader, load_snapshot
+from utils.config import load_config
+from utils.evaluate import evaluate_accuracy, measure_latency, model_size_bytes
+from utils.loss import distillation_loss, lr_poly
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Distill a MIAN snapshot into a compact student on target images")
+    parser.add_argument("--snapshot", type=str, required=True,
+                        help="teacher snapshot .pth written by Solver")
+    parser.add_argument("--config", type=str, required=True,
+                        help="config.json of the run (log/{exp_name}/config.json) or a yaml")
+    parser.add_argument("--output", type=str, required=True,
+                        help="path of the student .pth")
+    parser.add_argument("--arch", type=str, default='resnet18', choices=STUDENT_ARCHS,
+                        help="torchvision student backbone")
+    parser.add_argument("--pretrained", default=False, action='store_true',
+                        help="start from the ImageNet weights of the local store (python -m model.weights fetch --arch)")
+    parser.add_argument("--rootdir", type=str, default='.',
+                        help="directory holding data/")
+    parser.add_argument("--device", type=str, default=None,
+                        help="cuda:0 or cpu (default: cuda:0 if available)")
+    parser.add_argument("--num_steps", type=int, default=5000,
+                        help="")
+    parser.add_argument("--batch_size", type=int, default=64,
+                        help="")
+    parser.add_argument("--num_workers", type=int, default=4,
+                        help="")
+    parser.add_argument("--lr", type=float, default=0.01,
+                        help="SGD lr, decayed with lr_poly")
+    parser.add_argument("--temperature", type=float, default=4.,
+                        help="softmax temperature of teacher and student logits")
+    parser.add_argument("--val_step", type=int, default=500,
+                        help="report the student target val accuracy every val_step steps (labels are not trained on)")
+    parser.add_argument("--latency_batch", type=int, nargs='+', default=[1, 32],
+                        help="batch sizes for the latency report")
+    return parser.parse_args()
+
+
+def main(args):
+    config = load_config(args.config)
+    task = config['data']['task']
+    cropsize = config['data']['crop_size'][task]
+    num_classes = config['data']['num_classes'][task]
+    device = args.device or ('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+    basemodel, C1, C2, _ = build_models(config, pretrained=False)
+    load_snapshot(args.snapshot, basemodel, C1, C2)
+    teacher = EnsemblePredictor(basemodel, C1, C2).to(device).eval()
+    weights = weight_path(config, args.arch) if args.pretrained else None
+    student = Student(args.arch, num_classes, weights=weights).to(device)
+
+    # Unlabeled target-domain training images, with the training augmentation
+    loader = build_loader(config, rootdir=args.rootdir, batch_size=args.batch_size, num_workers=0)
+    target_loader = torch.utils.data.DataLoader(loader.target_dataset, batch_size=args.batch_size, shuffle=True,
+                                                num_workers=args.num_workers, drop_last=True,
+                                                pin_memory=device != 'cpu')
+    print('distill {} into {} on {} {} images'.format(args.snapshot, args.arch, len(loader.target_dataset),
+                                                      config['data']['target']))
+
+    optimizer = optim.SGD(student.parameters(), lr=args.lr, momentum=0.9, weight_decay=config['train']['weight_decay'])
+    iterator = iter(target_loader)
+    start = time.time()
+    for i_iter in range(args.num_steps):
+        try:
+            images, _ = next(iterator)
+        except StopIteration:
+            iterator = iter(target_loader)
+            images, _ = next(iterator)
+        images = images.to(torch.float).to(device)
+        optimizer.param_groups[0]['lr'] = lr_poly(args.lr, i_iter, args.num_steps, 0.9)
+
+        with torch.no_grad():
+            teacher_logits = teacher(images)
+        loss = distillation_loss(student(images), teacher_logits, args.temperature)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        if i_iter % 50 == 0:
+            print('Iteration {}: kd_loss {:.4f} ({:.2f}s/step)'.format(i_iter, loss.item(),
+                                                                      (time.time() - start) / (i_iter + 1)))
+        if args.val_step and (i_iter + 1) % args.val_step == 0 and i_iter + 1 < args.num_steps:
+            student.eval()
+            acc = evaluate_accuracy(student, loader.target_valid_dataset, batch_size=args.batch_size, device=device)
+            print('Iteration {}: student target val acc {:.2f}'.format(i_iter + 1, acc))
+            student.train()
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    student = student.eval()
+    torch.save(student.snapshot(), args.output)
+    print('saved {}'.format(args.output))
+
+    acc_teacher = evaluate_accuracy(teacher, loader.target_valid_dataset, batch_size=args.batch_size, device=device)
+    acc_student = evaluate_accuracy(student, loader.target_valid_dataset, batch_size=args.batch_size, device=device)
+    size_teacher = model_size_bytes(teacher)
+    size_student = model_size_bytes(student)
+    print('target {} val acc: teacher {:.2f} student {:.2f} (delta {:+.2f})'.format(
+        config['data']['target'], acc_teacher, acc_student, acc_student - acc_teacher))
+    print('model size: teacher {:.1f}MB student {:.1f}MB ({:.1f}x smaller)'.format(
+        size_teacher / 2**20, size_student / 2**20, size_teacher / size_student))
+    # Serving latency: CPU, whatever device was used for training
+    teacher.cpu()
+    student.cpu()
+    for batch in args.latency_batch:
+        sample = torch.randn(batch, 3, cropsize, cropsize)
+        latency_teacher = measure_latency(teacher, sample)
+        latency_student = measure_latency(student, sample)
+        print('CPU latency batch {}: teacher {:.1f}ms student {:.1f}ms ({:.2f}x faster)'.format(
+            batch, latency_teacher, latency_student, latency_teacher / latency_student))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
@@ -0,0 +1,113 @@
+import argparse
+import os
+import copy
+import torch
+from model.ensemble import EnsemblePredictor
+from utils.builder import build_models, load_snapshot
+from utils.config import load_config
+from utils.fuse import fuse_bn
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Export a MIAN snapshot for serving")
+    parser.add_argument("--snapshot", type=str, required=True,
+                        help="snapshot .pth written by Solver")
+    parser.add_argument("--config", type=str, required=True,
+                        help="config.json of the run (log/{exp_name}/config.json) or a yaml")
+    parser.add_argument("--output", type=str, required=True,
+                        help="output path without extension; writes {output}.pt and/or {output}.onnx")
+    parser.add_argument("--format", type=str, nargs='+', default=['torchscript', 'onnx'],
+                        help="torchscript, onnx")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="batch size of the exported graph (and of the verification batch)")
+    parser.add_argument("--dynamic_batch", default=False, action='store_true',
+                        help="export with a dynamic batch dimension")
+    parser.add_argument("--features", default=False, action='store_true',
+                        help="also output the basemodel features")
+    parser.add_argument("--no_fuse", default=False, action='store_true',
+                        help="keep BatchNorm layers")
+    parser.add_argument("--opset", type=int, default=13,
+                        help="ONNX opset")
+    parser.add_argument("--atol", type=float, default=1e-3,
+                        help="max abs difference to the eager model")
+    return parser.parse_args()
+
+
+def _as_tuple(output):
+    return output if isinstance(output, tuple) else (output,)
+
+
+def verify(name, reference, candidate, sample, atol):
+    with torch.no_grad():
+        expected = _as_tuple(reference(sample))
+        actual = _as_tuple(candidate(sample))
+    diff = max((e - a).abs().max().item() for e, a in zip(expected, actual))
+    print('{}: batch {} max abs diff to eager {:.2e}'.format(name, sample.size(0), diff))
+    if diff > atol:
+        raise ValueError('{} output differs from the eager model by {:.2e} (atol {:.0e})'.format(name, diff, atol))
+
+
+def main(args):
+    config = load_config(args.config)
+    task = config['data']['task']
+    cropsize = config['data']['crop_size'][task]
+
+    # netDFeat is only needed for training and is never loaded
+    basemodel, C1, C2, _ = build_models(config, pretrained=False)
+    load_snapshot(args.snapshot, basemodel, C1, C2)
+    eager = EnsemblePredictor(basemodel, C1, C2, return_features=args.features).eval()
+
+    model = copy.deepcopy(eager)
+    if not args.no_fuse:
+        fuse_bn(model)
+    for p in model.parameters():
+        p.requires_grad = False
+
+    sample = torch.randn(args.batch_size, 3, cropsize, cropsize)
+    samples = [sample]
+    if args.dynamic_batch:
+        samples.append(torch.randn(args.batch_size + 1, 3, cropsize, cropsize))
+    for s in samples:
+        verify('fused', eager, model, s, args.atol)
+
+    output_names = ['logits', 'features'] if args.features else ['logits']
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if 'torchscript' in args.format:
+        path = args.output + '.pt'
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(model, sample))
+        scripted.save(path)
+        loaded = torch.jit.load(path)
+        for s in samples:
+            verify('torchscript', eager, loaded, s, args.atol)
+        print('saved {}'.format(path))
+
+    if 'onnx' in args.format:
+        path = args.output + '.onnx'
+        dynamic_axes = None
+        if args.dynamic_batch:
+            dynamic_axes = {name: {0: 'batch'} for name in ['image'] + output_names}
+        torch.onnx.export(model, sample, path, input_names=['image'], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=args.opset)
+        try:
+            import onnxruntime
+        except ImportError:
+            print('onnxruntime is not installed, skip verifying {}'.format(path))
+        else:
+            session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+            run = lambda x: tuple(torch.from_numpy(o) for o in session.run(None, {'image': x.numpy()}))
+            for s in samples:
+                verify('onnx', eager, run, s, args.atol)
+        print('saved {}'.format(path))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
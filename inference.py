@@ -0,0 +1,110 @@
+import argparse
+import os
+import csv
+import time
+from glob import glob
+import numpy as np
+import torch
+import torch.nn.functional as F
+from dataset.image_list_dataset import ImageListDataSet, list_images, val_transform
+from model.ensemble import EnsemblePredictor
+from utils.builder import build_models, load_snapshot, feature_size
+from utils.config import load_config
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="MIAN batch inference")
+    parser.add_argument("--snapshot", type=str, required=True,
+                        help="snapshot .pth written by Solver")
+    parser.add_argument("--config", type=str, required=True,
+                        help="config.json of the run (log/{exp_name}/config.json) or a yaml")
+    parser.add_argument("--input", type=str, required=True,
+                        help="image directory or text file with one image path per line")
+    parser.add_argument("--output_dir", type=str, required=True,
+                        help="")
+    parser.add_argument("--batch_size", type=int, default=256,
+                        help="")
+    parser.add_argument("--num_workers", type=int, default=8,
+                        help="decode processes")
+    parser.add_argument("--device", type=str, default=None,
+                        help="cuda:0 or cpu (default: cuda:0 if available)")
+    parser.add_argument("--save_features", default=False, action='store_true',
+                        help="also write basemodel features to features.npy")
+    parser.add_argument("--class_dir", type=str, default=None,
+                        help="domain folder (data/{task}/{domain}) whose sorted class folders name the labels")
+    return parser.parse_args()
+
+
+def main(args):
+    config = load_config(args.config)
+    task = config['data']['task']
+    cropsize = config['data']['crop_size'][task]
+    device = args.device or ('cuda:0' if torch.cuda.is_available() else 'cpu')
+
+    basemodel, C1, C2, _ = build_models(config, pretrained=False)
+    load_snapshot(args.snapshot, basemodel, C1, C2)
+    model = EnsemblePredictor(basemodel, C1, C2, return_features=True).to(device).eval()
+
+    files = list_images(args.input)
+    print('{} images from {}'.format(len(files), args.input))
+    # Older config.json files have no draft_decode entry
+    draft_size = cropsize if config['data'].get('draft_decode', False) and task != 'digits' else None
+    loader = torch.utils.data.DataLoader(ImageListDataSet(files, val_transform(task, cropsize), draft_size),
+                                         batch_size=args.batch_size, num_workers=args.num_workers,
+                                         shuffle=False, pin_memory=device != 'cpu')
+
+    class_names = None
+    if args.class_dir is not None:
+        class_names = [os.path.basename(f) for f in sorted(glob(args.class_dir + '/*'))]
+        assert len(class_names) == config['data']['num_classes'][task], \
+            '{} has {} class folders'.format(args.class_dir, len(class_names))
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    features = None
+    if args.save_features:
+        features = np.lib.format.open_memmap(os.path.join(args.output_dir, 'features.npy'), mode='w+',
+                                             dtype=np.float32, shape=(len(files), feature_size(task)))
+
+    model_time = 0.
+    start_time = time.time()
+    with open(os.path.join(args.output_dir, 'predictions.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'pred', 'prob'] + (['class'] if class_names is not None else []))
+        with torch.no_grad():
+            for i, (images, index) in enumerate(loader):
+                t = time.time()
+                output, h = model(images.to(device, non_blocking=True))
+                prob, pred = F.softmax(output, dim=1).max(1)
+                pred = pred.cpu().numpy()
+                prob = prob.cpu().numpy()
+                model_time += time.time() - t
+
+                index = index.numpy()
+                for j, k in enumerate(index):
+                    row = [files[k], pred[j], '{:.4f}'.format(prob[j])]
+                    if class_names is not None:
+                        row.append(class_names[pred[j]])
+                    writer.writerow(row)
+                if features is not None:
+                    features[index[0]:index[-1]+1] = h.cpu().numpy()
+
+                if (i+1) % 100 == 0:
+                    done = (i+1) * args.batch_size
+                    print('{}/{} images, {:.1f} images/sec'.format(done, len(files),
+                                                                   done / (time.time() - start_time)))
+
+    elapsed = time.time() - start_time
+    if features is not None:
+        features.flush()
+    print('{} images in {:.1f}s: {:.1f} images/sec end-to-end, {:.1f} images/sec model only'.format(
+        len(files), elapsed, len(files) / elapsed, len(files) / max(model_time, 1e-8)))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
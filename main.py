@@ -3,18 +3,14 @@ import yaml
 import torch
 import torch.backends.cudnn as cudnn
 import torch.nn.functional as F
-import torch.optim as optim
 import os
-import matplotlib.pyplot as plt
 import random
 from shutil import copyfile
 from solver import Solver
-from model.deeplab_res import DeeplabRes
-from model.deeplab_digit import DeepDigits
-from model.discriminator import DigitDiscriminator, OfficeDiscriminator
-from model.classifier import Predictor
-from dataset.multiloader import MultiDomainLoader
-from utils.weight_init import weight_init
+from dataset.feature_cache import build_feature_cache
+from utils.builder import build_models, build_optimizers, build_loader, domain_order
+from utils.config import load_config, merge_config
+from utils.runtime import apply_runtime
 import json
 
 def get_arguments():
@@ -28,6 +24,8 @@ def get_arguments():
                         help="choose gpu device.")
     parser.add_argument("--yaml", type=str, default='config.yaml',
                         help="yaml pathway")
+    parser.add_argument("--overlay", type=str, default=None,
+                        help="yaml merged over --yaml, e.g. written by autotune.py")
     parser.add_argument("--exp_name", type=str, default='', required=True,
                         help="")
     parser.add_argument("--exp_detail", type=str, default=None, required=False,
@@ -56,6 +54,26 @@ def get_arguments():
     parser.add_argument("--batch_size", type=int, default=None, required=False,
                         help="")
     parser.add_argument("--resume", type=str, default=None, required=False, help="")
+    parser.add_argument("--profile", default=False, required=False,
+                        action='store_true', help="per-phase step timing")
+    parser.add_argument("--freeze_stages", type=int, default=None, required=False,
+                        help="freeze conv1..conv{n} of the ResNet backbone")
+    parser.add_argument("--feature_cache", default=False, required=False,
+                        action='store_true', help="train on cached frozen-stage activations")
+    parser.add_argument("--accum_steps", type=int, default=None, required=False,
+                        help="micro-batches per step (gradient accumulation)")
+    parser.add_argument("--pruning", type=str, default=None, required=False,
+                        help="early termination policy: median, halving, plateau")
+    parser.add_argument("--checkpoint", default=False, required=False,
+                        action='store_true', help="activation checkpointing of the backbone")
+    parser.add_argument("--async_eval", default=False, required=False,
+                        action='store_true', help="validate in a separate process")
+    parser.add_argument("--memory", default=False, required=False,
+                        action='store_true', help="memory accounting and leak alerts (memory.jsonl)")
+    parser.add_argument("--concurrent_D", default=False, required=False,
+                        action='store_true', help="experimental: netDFeat update on a thread, one step stale")
+    parser.add_argument("--rank", type=int, nargs='+', default=None, required=False,
+                        help="digits: rank of the factorized compress1/compress2 linears (one, or one per layer)")
 
     return parser.parse_args()
 
@@ -120,12 +138,47 @@ def main(config, args, param_path):
         assert o == 'Momentum' or o == 'Adam'
         assert args.task is not None
         config['train']['optimizer'][args.task] = o
+    if args.profile:
+        print('profile: ', True)
+        config['exp_setting']['profile']['enabled'] = True
+    if args.freeze_stages is not None:
+        fs = args.freeze_stages
+        print('freeze_stages: ', fs)
+        config['train']['freeze']['stages'] = fs
+    if args.feature_cache:
+        print('feature_cache: ', True)
+        config['train']['freeze']['cache'] = True
+    if args.accum_steps is not None:
+        a = args.accum_steps
+        print('accum_steps: ', a)
+        config['train']['accum_steps'] = a
+    if args.pruning is not None:
+        pr = args.pruning
+        print('pruning: ', pr)
+        config['exp_setting']['pruning']['policy'] = pr
+    if args.checkpoint:
+        print('checkpoint: ', True)
+        config['train']['checkpoint'] = True
+    if args.async_eval:
+        print('async_eval: ', True)
+        config['exp_setting']['async_eval']['enabled'] = True
+    if args.memory:
+        print('memory: ', True)
+        config['exp_setting']['memory']['enabled'] = True
+    if args.concurrent_D:
+        print('concurrent_D: ', True)
+        config['train']['concurrent_D'] = True
+    if args.rank is not None:
+        r = args.rank[0] if len(args.rank) == 1 else args.rank
+        print('rank: ', r)
+        config['train']['rank'] = r
 
     with open(os.path.join(param_path, 'config.json'), 'w') as f:
         json.dump(config, f)
 
     # -------------------------------
 
+    apply_runtime(config['exp_setting'].get('runtime'))
     cudnn.enabled = True
     cudnn.benchmark = True
     gpu = args.gpu
@@ -137,49 +190,23 @@ def main(config, args, param_path):
     }
 
     task = config['data']['task']
-    num_classes = config['data']['num_classes'][task]
-    input_size = config['data']['input_size'][task]
-    cropped_size = config['data']['crop_size'][task]
-    dataset = config['data']['domain'][task]
-    dataset.remove(config['data']['target'])
-    dataset = dataset + [config['data']['target']]
+    dataset = domain_order(config)
     print(dataset)
-    num_workers = config['data']['num_workers']
     batch_size = config['train']['batch_size'][task]
     num_domain = len(dataset)
 
     base_lr = config['train']['base_model'][task]['lr']
-    base_momentum = config['train']['base_model'][task]['momentum']
     D_lr = config['train']['netD'][task]['lr']
-    D_momentum = config['train']['netD'][task]['momentum']
-    weight_decay = config['train']['weight_decay']
 
     # ------------------------
     # 1. Create Model
     # ------------------------
-    if task == 'digits':
-        basemodel = DeepDigits(num_classes=num_classes)
-        prev_feature_size = 2048
-        basemodel.apply(weight_init)
-    else:
-        basemodel = DeeplabRes(num_classes=num_classes)
-        prev_feature_size = 256
-
+    basemodel, c1, c2, netDFeat = build_models(config, num_domain=num_domain)
     basemodel.to(gpu_map['basemodel'])
-
-    c1 = Predictor(prev_feature_size=prev_feature_size, num_classes=num_classes).to(gpu_map['C'])
-    c2 = Predictor(prev_feature_size=prev_feature_size, num_classes=num_classes).to(gpu_map['C'])
-
-    if task == 'digits':
-        netDFeat = DigitDiscriminator(channel=prev_feature_size, num_domain=num_domain)
-    else:
-        netDFeat = OfficeDiscriminator(channel=prev_feature_size, num_domain=num_domain)
+    c1.to(gpu_map['C'])
+    c2.to(gpu_map['C'])
     netDFeat.to(gpu_map['netDFeat'])
 
-    c1.apply(weight_init)
-    c2.apply(weight_init)
-    netDFeat.apply(weight_init)
-
     if args.resume is not None:
         checkpoint = torch.load(args.resume)
         basemodel.load_state_dict(checkpoint['basemodel'])
@@ -188,29 +215,20 @@ def main(config, args, param_path):
     # ------------------------
     # 2. Create DataLoader
     # ------------------------
-    loader = MultiDomainLoader(dataset, '.', input_size, cropped_size, batch_size=batch_size,
-                               shuffle=True, num_workers=num_workers, half_crop=None,
-                               task=task)
+    loader = build_loader(config)
+    if config['train']['freeze']['cache']:
+        assert task != 'digits', 'feature cache is only available for the ResNet backbone'
+        freeze_config = config['train']['freeze']
+        build_feature_cache(loader, basemodel, freeze_config['cache_dir'],
+                            num_views=freeze_config['num_views'], fp16=freeze_config['fp16'],
+                            device=gpu_map['basemodel'], batch_size=batch_size)
     TargetLoader = loader.TargetLoader
 
     # ------------------------
     # 3. Create Optimizer and Solver
     # ------------------------
     DFeat_lr = D_lr
-
-    if config['train']['optimizer'][task] == 'Momentum':
-        print('Setting SGD Optimizer')
-        optBase = optim.SGD(basemodel.parameters(), lr=base_lr, momentum=base_momentum, weight_decay=weight_decay)
-        optC1 = optim.SGD(c1.parameters(), lr=10*base_lr, momentum=base_momentum, weight_decay=weight_decay)
-        optC2 = optim.SGD(c2.parameters(), lr=10*base_lr, momentum=base_momentum, weight_decay=weight_decay)
-        optDFeat = optim.SGD(netDFeat.parameters(), lr=DFeat_lr, momentum=D_momentum, weight_decay=weight_decay)
-    elif config['train']['optimizer'][task] == 'Adam':
-        print('Setting Adam Optimizer')
-        optBase = optim.Adam(basemodel.parameters(), lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
-        optC1 = optim.Adam(c1.parameters(), lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
-        optC2 = optim.Adam(c2.parameters(), lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
-        optDFeat = optim.Adam(netDFeat.parameters(), lr=DFeat_lr, betas=(D_momentum, 0.99), weight_decay=weight_decay)
-
+    optBase, optC1, optC2, optDFeat = build_optimizers(config, basemodel, c1, c2, netDFeat)
 
     solver = Solver(basemodel, c1, c2, netDFeat, loader, TargetLoader,
                     base_lr, DFeat_lr, task, num_domain, no_MCD,
@@ -224,7 +242,10 @@ def main(config, args, param_path):
 
 if __name__ == '__main__':
     args = get_arguments()
-    config = yaml.load(open(args.yaml, 'r'))
+    config = load_config(args.yaml)
+    if args.overlay is not None:
+        print('overlay: ', args.overlay)
+        merge_config(config, load_config(args.overlay))
 
     snapshot_dir = config['exp_setting']['snapshot_dir']
     log_dir = config['exp_setting']['log_dir']
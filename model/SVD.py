@@ -21,3 +21,19 @@ def SVD_norm(feature, k):
     _, sigma, _ = torch.svd(feature)
     sigma_squared = torch.pow(sigma[0], 2)
     return sigma_squared, None
+
+def SVD_entropy_from_cov(cov, k):
+    """
+    SVD_entropy of a feature matrix F given only cov = F^T F, whose
+    eigenvalues are the squared singular values of F. Zero eigenvalues
+    (rank < D) add no entropy.
+    """
+    sigma_squared = torch.flip(torch.linalg.eigvalsh(cov), [0]).clamp(min=0)
+    sigma_normalized = sigma_squared / torch.sum(sigma_squared)
+    en_transfer = Entropy(sigma_normalized[ :k])
+    en_discrim = Entropy(sigma_normalized[k: ])
+    return en_transfer, en_discrim, sigma_normalized
+
+def SVD_norm_from_cov(cov, k):
+    sigma_squared = torch.linalg.eigvalsh(cov)[-1]
+    return sigma_squared, None
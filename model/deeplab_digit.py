@@ -1,17 +1,27 @@
 import torch.nn as nn
 import torch.nn.functional as F
 import math
-import torch.utils.model_zoo as model_zoo
 import torch
-import torchvision
-from torchvision import models
-from torchvision.models.resnet import ResNet, Bottleneck, model_urls, load_state_dict_from_url
 import numpy as np
+from model.lowrank import LowRankLinear, linear
+from utils.checkpoint import checkpointed
+
+
+def compress_ranks(rank):
+    """(compress1 rank, compress2 rank) from None, an int or [r1, r2]; None entries stay dense."""
+    if rank is None or isinstance(rank, int):
+        return rank, rank
+    assert len(rank) == 2, 'rank should be an int or [compress1 rank, compress2 rank], got {}'.format(rank)
+    return tuple(rank)
 
 
 class DigitMulti(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, checkpoint=False, rank=None):
         super(DigitMulti, self).__init__()
+        # Recompute enc activations during backward instead of storing them
+        self.checkpoint = checkpoint
+        # compress1/compress2 as rank-r factorized linears (model.lowrank)
+        self.rank = compress_ranks(rank)
 
         self.pool = nn.MaxPool2d(2,2)
         self.enc = nn.Sequential(*[
@@ -29,23 +39,39 @@ class DigitMulti(nn.Module):
             ])
 
         self.compress1 = nn.Sequential(*[
-            nn.Linear(8192, 3072),
+            linear(8192, 3072, self.rank[0]),
             nn.BatchNorm1d(3072, affine=True),
             nn.ReLU(inplace=True),
             nn.Dropout()])
         self.compress2 = nn.Sequential(*[
-            nn.Linear(3072, 2048),
+            linear(3072, 2048, self.rank[1]),
             nn.BatchNorm1d(2048, affine=True),
             nn.ReLU(inplace=True)])
 
     def forward(self, x):
-        h = self.enc(x)
-        h = h.view(h.size(0), -1)
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            h = checkpointed(self.enc, x)
+        else:
+            h = self.enc(x)
+        h = torch.flatten(h, 1)
         h = self.compress1(h)
         adv_feat = self.compress2(h)
 
         return adv_feat.view(adv_feat.size(0), adv_feat.size(1)), h
 
+    def factorize(self, rank):
+        """
+        Replace the dense compress1/compress2 linears by their truncated-SVD
+        LowRankLinear at the given rank(s), in place; layers already
+        factorized or with a None rank are kept.
+        """
+        ranks = compress_ranks(rank)
+        for i, (block, r) in enumerate(zip([self.compress1, self.compress2], ranks)):
+            if r is not None and isinstance(block[0], nn.Linear):
+                block[0] = LowRankLinear.from_linear(block[0], r)
+                self.rank = self.rank[:i] + (r,) + self.rank[i+1:]
+        return self
+
     def get_1x_lr_params_NOscale(self):
         """
         This generator returns all the parameters of the net except for
@@ -69,7 +95,7 @@ class DigitMulti(nn.Module):
     def optim_parameters(self, lr):
         return [{'params': self.get_1x_lr_params_NOscale(), 'lr': lr}]
 
-def DeepDigits(num_classes=21):
-    model = DigitMulti(num_classes)
+def DeepDigits(num_classes=21, checkpoint=False, rank=None):
+    model = DigitMulti(num_classes, checkpoint=checkpoint, rank=rank)
     return model
 
@@ -1,18 +1,30 @@
 import torch.nn as nn
 import math
-import torch.utils.model_zoo as model_zoo
 import torch
 import torchvision
 from torchvision import models
-from torchvision.models.resnet import ResNet, Bottleneck, model_urls, load_state_dict_from_url
 import numpy as np
+from model.weights import load_weights
+from utils.checkpoint import checkpointed
 
 
 class ResNetMulti(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, freeze_stages=0, pretrained=True, checkpoint=False, weights=None):
+        """
+        pretrained: load ImageNet weights into conv1..conv5 from the local
+        store file `weights` (see model/weights.py); the stages are built on
+        the meta device and take the memory-mapped tensors as they are.
+        """
         super(ResNetMulti, self).__init__()
 
-        resnet = models.resnet50(pretrained=True)
+        if pretrained:
+            if weights is None:
+                raise ValueError('pretrained ResNetMulti needs the path of its weights, see model/weights.py')
+            state_dict = load_weights(weights)
+            with torch.device('meta'):
+                resnet = models.resnet50()
+        else:
+            resnet = models.resnet50()
         self.conv1 = nn.Sequential(*list(resnet.children())[:3]) # 64,112,112
         self.conv2 = nn.Sequential(*list(resnet.children())[3:5]) # 256,56,56
         self.conv3 = nn.Sequential(*list(resnet.children())[5]) # 512,28,28
@@ -23,14 +35,65 @@ class ResNetMulti(nn.Module):
             nn.Conv2d(2048, 256, 3, 1, 1)])
         self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
 
+        if pretrained:
+            self._load_stages(state_dict, weights)
+
+        # Index of the first stage run by forward(). Set to freeze_stages when
+        # the loader yields cached frozen-stage activations instead of images.
+        self.input_stage = 0
+        # Recompute conv2..conv5 activations during backward instead of storing them
+        self.checkpoint = checkpoint
+        self.freeze(freeze_stages)
+
+    def _load_stages(self, state_dict, path):
+        stage_keys = set(k for k in self.state_dict() if k.split('.')[0] in ['conv1', 'conv2', 'conv3', 'conv4', 'conv5'])
+        missing = sorted(stage_keys - set(state_dict))
+        unexpected = sorted(set(state_dict) - stage_keys)
+        if missing or unexpected:
+            raise RuntimeError('{} does not match the ResNetMulti stages: missing {}, unexpected {}'.format(
+                path, missing[:5], unexpected[:5]))
+        self.load_state_dict(state_dict, strict=False, assign=True)
+
+    def stages(self):
+        return [self.conv1, self.conv2, self.conv3, self.conv4, self.conv5]
+
+    def freeze(self, num_stages):
+        """
+        Freeze conv1..conv{num_stages} at their current (ImageNet) weights.
+        Frozen stages also keep their BatchNorm statistics, see train().
+        """
+        assert 0 <= num_stages <= len(self.stages())
+        self.freeze_stages = num_stages
+        for stage in self.stages()[:num_stages]:
+            for param in stage.parameters():
+                param.requires_grad = False
+
+    def train(self, mode=True):
+        super(ResNetMulti, self).train(mode)
+        for stage in self.stages()[:self.freeze_stages]:
+            stage.eval()
+        return self
+
+    def frozen_features(self, x):
+        """
+        Activations after the last frozen stage, i.e. what forward() expects
+        as input once input_stage == freeze_stages.
+        """
+        with torch.no_grad():
+            for stage in self.stages()[:self.freeze_stages]:
+                x = stage(x)
+        return x
+
     def forward(self, x):
-        conv1 = self.conv1(x)
-        conv2 = self.conv2(conv1)
-        conv3 = self.conv3(conv2)
-        conv4 = self.conv4(conv3)
-        conv5 = self.conv5(conv4)
+        checkpoint = self.checkpoint and self.training and torch.is_grad_enabled()
+        for i, stage in enumerate(self.stages()[self.input_stage:], self.input_stage):
+            # Frozen stages store no activations for backward anyway
+            if checkpoint and i >= max(1, self.freeze_stages):
+                x = checkpointed(stage, x)
+            else:
+                x = stage(x)
 
-        h = self.bottleneck(conv5)
+        h = self.bottleneck(x)
         h = self.avgpool(h)
         h = torch.flatten(h, 1)
 
@@ -80,8 +143,9 @@ class ResNetMulti(nn.Module):
         return [{'params': self.get_1x_lr_params_NOscale(), 'lr': lr},
                 {'params': self.get_10x_lr_params_NOscale(), 'lr': 10*lr}]
 
-def DeeplabRes(num_classes=21):
-    model = ResNetMulti(num_classes)
+def DeeplabRes(num_classes=21, freeze_stages=0, pretrained=True, checkpoint=False, weights=None):
+    model = ResNetMulti(num_classes, freeze_stages=freeze_stages, pretrained=pretrained, checkpoint=checkpoint,
+                        weights=weights)
     return model
 
 
@@ -8,6 +8,7 @@ import numpy as np
 class OfficeDiscriminator(nn.Module):
     def __init__(self, channel=4096, num_domain=3):
         super(OfficeDiscriminator, self).__init__()
+        self.channel = channel
 
         self.conv_domain_cls_patch = nn.Sequential(*[
             nn.Linear(channel, channel),
@@ -24,6 +25,7 @@ class OfficeDiscriminator(nn.Module):
 class DigitDiscriminator(nn.Module):
     def __init__(self, channel=4096, num_domain=3):
         super(DigitDiscriminator, self).__init__()
+        self.channel = channel
 
         self.conv_domain_cls_patch = nn.Sequential(*[
             nn.Linear(channel, channel//2),
@@ -41,6 +43,7 @@ class DigitDiscriminator(nn.Module):
 class DigitDiscriminator(nn.Module):
     def __init__(self, channel=4096, num_domain=3):
         super(DigitDiscriminator, self).__init__()
+        self.channel = channel
 
         self.conv_domain_cls_patch = nn.Sequential(*[
             nn.Linear(channel, channel//2),
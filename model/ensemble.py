@@ -0,0 +1,21 @@
+import torch.nn as nn
+
+
+class EnsemblePredictor(nn.Module):
+    """
+    Inference path of a trained model: basemodel followed by the C1 + C2
+    ensemble that Solver._validation reports as acc_ensemble.
+    """
+    def __init__(self, basemodel, C1, C2, return_features=False):
+        super(EnsemblePredictor, self).__init__()
+        self.basemodel = basemodel
+        self.C1 = C1
+        self.C2 = C2
+        self.return_features = return_features
+
+    def forward(self, x):
+        h, _ = self.basemodel(x)
+        output = self.C1(h) + self.C2(h)
+        if self.return_features:
+            return output, h
+        return output
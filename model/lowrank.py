@@ -0,0 +1,57 @@
+import torch
+import torch.nn as nn
+
+
+class LowRankLinear(nn.Module):
+    """
+    Linear layer with a rank-r weight, W = up.weight @ down.weight: an
+    in_features -> rank projection without bias followed by a rank ->
+    out_features linear. Parameters and multiply-adds drop from in * out to
+    rank * (in + out).
+    """
+    def __init__(self, in_features, out_features, rank):
+        super(LowRankLinear, self).__init__()
+        assert 0 < rank <= min(in_features, out_features), \
+            'rank {} of a {}x{} linear'.format(rank, out_features, in_features)
+        self.in_features = in_features
+        self.out_features = out_features
+        self.rank = rank
+        self.down = nn.Linear(in_features, rank, bias=False)
+        self.up = nn.Linear(rank, out_features)
+
+    def forward(self, x):
+        return self.up(self.down(x))
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}, rank={}'.format(self.in_features, self.out_features, self.rank)
+
+    @classmethod
+    def from_linear(cls, linear, rank):
+        """
+        Best rank-r approximation (truncated SVD) of a trained nn.Linear. The
+        singular values are split evenly between the two factors.
+        """
+        layer = cls(linear.in_features, linear.out_features, rank)
+        with torch.no_grad():
+            U, S, Vh = torch.linalg.svd(linear.weight.detach().float(), full_matrices=False)
+            root = S[:rank].sqrt()
+            layer.down.weight.copy_(root[:, None] * Vh[:rank])
+            layer.up.weight.copy_(U[:, :rank] * root[None, :])
+            layer.up.bias.copy_(linear.bias.detach())
+        return layer.to(linear.weight.device)
+
+
+def linear(in_features, out_features, rank=None):
+    """nn.Linear, or a LowRankLinear when a rank is given."""
+    if rank is None:
+        return nn.Linear(in_features, out_features)
+    return LowRankLinear(in_features, out_features, rank)
+
+
+def truncation_error(linear, rank):
+    """
+    Relative Frobenius error ||W - W_r|| / ||W|| of the rank-r truncation of
+    an nn.Linear weight, from its singular values.
+    """
+    S = torch.linalg.svdvals(linear.weight.detach().float())
+    return float((S[rank:] ** 2).sum().sqrt() / (S ** 2).sum().sqrt())
@@ -0,0 +1,211 @@
+import copy
+import math
+import torch
+import torch.nn.functional as F
+from torch.func import stack_module_state, functional_call, vmap
+from utils.weight_init import weight_init
+
+
+class StackedModule(object):
+    """
+    num independently initialized copies of a module, with parameters stacked
+    along a leading replica dimension and a forward vmapped over it. The input
+    is shared: x of shape [N, ...] gives outputs of shape [num, N, ...].
+    """
+    def __init__(self, module, num, device):
+        copies = [copy.deepcopy(module).apply(weight_init) for _ in range(num)]
+        params, buffers = stack_module_state(copies)
+        self.params = {k: v.to(device).detach().requires_grad_(True) for k, v in params.items()}
+        self.buffers = {k: v.to(device) for k, v in buffers.items()}
+        # Only the structure is needed, the weights come from self.params
+        self.base = copy.deepcopy(module).to('meta')
+
+        def call(params, buffers, x):
+            return functional_call(self.base, (params, buffers), (x,))
+        self._forward = vmap(call, in_dims=(0, 0, None))
+
+    def __call__(self, x):
+        return self._forward(self.params, self.buffers, x)
+
+    def parameters(self):
+        return list(self.params.values())
+
+    def state_dict(self, index):
+        """state_dict of replica index, loadable into the original module."""
+        state = {k: v[index].detach().cpu() for k, v in self.params.items()}
+        state.update({k: v[index].cpu() for k, v in self.buffers.items()})
+        return state
+
+
+class StackedOptimizer(object):
+    """
+    torch.optim.SGD (momentum, no dampening) or torch.optim.Adam over stacked
+    parameters, with one learning rate per replica.
+    """
+    def __init__(self, params, lrs, algorithm, momentum, weight_decay, betas=None, eps=1e-8):
+        assert algorithm == 'Momentum' or algorithm == 'Adam'
+        self.params = params
+        self.lrs = torch.tensor(lrs, dtype=torch.float, device=params[0].device)
+        self.lr_scale = 1.
+        self.algorithm = algorithm
+        self.momentum = momentum
+        self.weight_decay = weight_decay
+        self.betas = betas
+        self.eps = eps
+        self.state = {}
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self):
+        for p in self.params:
+            if p.grad is None:
+                continue
+            lr = (self.lrs * self.lr_scale).view(-1, *[1] * (p.dim() - 1))
+            grad = p.grad
+            if self.weight_decay:
+                grad = grad.add(p, alpha=self.weight_decay)
+            if self.algorithm == 'Momentum':
+                if p not in self.state:
+                    self.state[p] = grad.clone()
+                else:
+                    self.state[p].mul_(self.momentum).add_(grad)
+                p.sub_(lr * self.state[p])
+            else:
+                if p not in self.state:
+                    self.state[p] = {'step': 0, 'exp_avg': torch.zeros_like(p), 'exp_avg_sq': torch.zeros_like(p)}
+                state = self.state[p]
+                beta1, beta2 = self.betas
+                state['step'] += 1
+                state['exp_avg'].mul_(beta1).add_(grad, alpha=1 - beta1)
+                state['exp_avg_sq'].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+                denom = (state['exp_avg_sq'].sqrt() / math.sqrt(bias_correction2)).add_(self.eps)
+                p.sub_(lr / bias_correction1 * state['exp_avg'] / denom)
+
+
+class HeadReplicas(object):
+    """
+    K extra copies of C1, C2 and netDFeat, each with its own C lr, D lr and
+    featAdv loss from train.replicas, trained on the detached backbone
+    features of the main run: the D update, and MCD steps 1 and 2 (or the
+    classification step). The backbone only sees the main heads, so
+    hyperparameters that act on it through the adversarial loss (advcoeff)
+    cannot differ between replicas.
+    """
+    def __init__(self, replicas, C1, C2, netDFeat, config, device):
+        task = config['data']['task']
+        self.replicas = replicas
+        self.num = len(replicas)
+        self.C1 = StackedModule(C1, self.num, device)
+        self.C2 = StackedModule(C2, self.num, device)
+        self.netDFeat = StackedModule(netDFeat, self.num, device)
+
+        base_lr = config['train']['base_model'][task]['lr']
+        base_momentum = config['train']['base_model'][task]['momentum']
+        D_lr = config['train']['netD'][task]['lr']
+        D_momentum = config['train']['netD'][task]['momentum']
+        weight_decay = config['train']['weight_decay']
+        algorithm = config['train']['optimizer'][task]
+        self.C_lrs = [r.get('C_lr', base_lr) for r in replicas]
+        self.D_lrs = [r.get('D_lr', D_lr) for r in replicas]
+        self.featAdv = [r.get('featAdv', config['train']['GAN']['featAdv']) for r in replicas]
+        for featAdv in self.featAdv:
+            assert featAdv == 'Vanila' or featAdv == 'LS'
+        self.is_LS = torch.tensor([featAdv == 'LS' for featAdv in self.featAdv], device=device)
+
+        # Same lr multipliers as Solver._adjust_lr_opts
+        mult = 1. if task == 'digits' else 10.
+        self.optC = StackedOptimizer(self.C1.parameters() + self.C2.parameters(),
+                                     [mult * lr for lr in self.C_lrs], algorithm, base_momentum, weight_decay,
+                                     betas=(base_momentum, 0.99))
+        self.optDFeat = StackedOptimizer(self.netDFeat.parameters(), [mult * lr for lr in self.D_lrs], algorithm,
+                                         D_momentum, weight_decay, betas=(D_momentum, 0.99))
+
+    def describe(self, k):
+        return 'C_lr {} D_lr {} featAdv {}'.format(self.C_lrs[k], self.D_lrs[k], self.featAdv[k])
+
+    def set_lr_scale(self, scale):
+        self.optC.lr_scale = scale
+        self.optDFeat.lr_scale = scale
+
+    def _adv_loss(self, logit, target):
+        """[K] losses: least squares for the LS replicas, BCE with logits for the others."""
+        target = target.expand_as(logit)
+        ls = F.mse_loss(logit, target, reduction='none').mean((1, 2))
+        vanila = F.binary_cross_entropy_with_logits(logit, target, reduction='none').mean((1, 2))
+        return torch.where(self.is_LS, ls, vanila)
+
+    def _cross_entropy(self, logit, labels):
+        """[K] mean cross-entropies of [K, N, C] logits."""
+        labels = labels.expand(logit.size(0), -1)
+        return F.cross_entropy(logit.transpose(1, 2), labels, reduction='none').mean(1)
+
+    def _discrepancy(self, out1, out2):
+        return torch.mean(torch.abs(F.softmax(out1, dim=2) - F.softmax(out2, dim=2)), dim=(1, 2))
+
+    def _MCD(self, features, labels):
+        num_source_rows = labels.size(0)
+        C1_feat = self.C1(features)
+        C2_feat = self.C2(features)
+        loss_s = self._cross_entropy(C1_feat[:, :num_source_rows], labels) + \
+            self._cross_entropy(C2_feat[:, :num_source_rows], labels)
+        loss_dis = self._discrepancy(C1_feat[:, num_source_rows:], C2_feat[:, num_source_rows:])
+        return loss_s, loss_dis
+
+    def train_step(self, micro, real_domain_label, MCD):
+        """
+        One head-side step on micro = [(detached features, labels)] with the
+        layout of Solver._micro_batches. Replicas do not interact, so the sum
+        of their losses gives each one its own gradients.
+
+        Returns:
+          [K] D losses, [K] source classification losses
+        """
+        accum = float(len(micro))
+        D_loss = 0.
+        for features, _ in micro:
+            logit = self.netDFeat(features)
+            loss = self._adv_loss(logit, real_domain_label(logit[0])) / accum
+            loss.sum().backward()
+            D_loss = D_loss + loss.detach()
+        self.optDFeat.step()
+        self.optDFeat.zero_grad()
+
+        source_loss = 0.
+        for features, labels in micro:
+            if MCD:
+                loss_s, _ = self._MCD(features, labels)
+            else:
+                loss_s = self._cross_entropy(self.C1(features)[:, :labels.size(0)], labels)
+            loss_s = loss_s / accum
+            loss_s.sum().backward()
+            source_loss = source_loss + loss_s.detach()
+        self.optC.step()
+        self.optC.zero_grad()
+
+        if MCD:
+            for features, labels in micro:
+                loss_s, loss_dis = self._MCD(features, labels)
+                ((loss_s - loss_dis) / accum).sum().backward()
+            self.optC.step()
+            self.optC.zero_grad()
+        return D_loss, source_loss
+
+    @torch.no_grad()
+    def predict(self, features):
+        """[K, N, num_classes] outputs of C1, C2 and their ensemble."""
+        output1 = self.C1(features)
+        output2 = self.C2(features)
+        return output1, output2, output1 + output2
+
+    def state_dict(self):
+        return {
+            'replicas': self.replicas,
+            'C1': [self.C1.state_dict(k) for k in range(self.num)],
+            'C2': [self.C2.state_dict(k) for k in range(self.num)],
+            'netDFeat': [self.netDFeat.state_dict(k) for k in range(self.num)],
+        }
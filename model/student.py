@@ -0,0 +1,43 @@
+import torch
+import torch.nn as nn
+from torchvision import models
+from model.weights import load_weights
+
+
+STUDENT_ARCHS = ['resnet18', 'resnet34', 'mobilenet_v2', 'mobilenet_v3_small', 'mobilenet_v3_large']
+
+
+class Student(nn.Module):
+    """
+    Compact torchvision classifier distilled from the basemodel + C1/C2
+    ensemble (distill.py). The ImageNet classifier layer is replaced by a
+    num_classes one; forward returns the logits, as EnsemblePredictor does.
+    """
+    def __init__(self, arch, num_classes, weights=None):
+        super(Student, self).__init__()
+        assert arch in STUDENT_ARCHS, 'student arch should be one of {}, got {}'.format(STUDENT_ARCHS, arch)
+        self.arch = arch
+        self.num_classes = num_classes
+        self.backbone = getattr(models, arch)()
+        if weights is not None:
+            self.backbone.load_state_dict(load_weights(weights))
+
+        if arch.startswith('resnet'):
+            self.backbone.fc = nn.Linear(self.backbone.fc.in_features, num_classes)
+        else:
+            last = self.backbone.classifier[-1]
+            self.backbone.classifier[-1] = nn.Linear(last.in_features, num_classes)
+
+    def forward(self, x):
+        return self.backbone(x)
+
+    def snapshot(self):
+        return {'arch': self.arch, 'num_classes': self.num_classes, 'student': self.state_dict()}
+
+    @classmethod
+    def load(cls, path, map_location='cpu'):
+        """Student saved by distill.py."""
+        checkpoint = torch.load(path, map_location=map_location)
+        student = cls(checkpoint['arch'], checkpoint['num_classes'])
+        student.load_state_dict(checkpoint['student'])
+        return student
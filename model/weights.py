@@ -0,0 +1,131 @@
+import argparse
+import os
+import torch
+from torchvision import models
+
+
+# File names inside the weight directory when the config does not name them
+DEFAULT_FILES = {
+    'resnet50': 'resnet50.pth',
+    # Distillation students (model/student.py), stored with torchvision keys
+    'resnet18': 'resnet18.pth',
+    'resnet34': 'resnet34.pth',
+    'mobilenet_v2': 'mobilenet_v2.pth',
+    'mobilenet_v3_small': 'mobilenet_v3_small.pth',
+    'mobilenet_v3_large': 'mobilenet_v3_large.pth',
+}
+
+# torchvision resnet50 children -> ResNetMulti stages:
+#   conv1 = [conv1, bn1, relu], conv2 = [maxpool, layer1],
+#   conv3 = layer2, conv4 = layer3, conv5 = layer4 (blocks unpacked)
+_RESNET_PREFIXES = [
+    ('conv1.', 'conv1.0.'),
+    ('bn1.', 'conv1.1.'),
+    ('layer1.', 'conv2.1.'),
+    ('layer2.', 'conv3.'),
+    ('layer3.', 'conv4.'),
+    ('layer4.', 'conv5.'),
+]
+
+
+def weight_path(config, name):
+    """
+    Path of the weights `name` in the local store: train.weights.dir (or the
+    MIAN_WEIGHTS_DIR environment variable) joined with train.weights.{name}.
+    """
+    registry = config['train'].get('weights', {})
+    weight_dir = os.environ.get('MIAN_WEIGHTS_DIR', registry.get('dir', 'weights'))
+    return os.path.join(weight_dir, registry.get(name, DEFAULT_FILES[name]))
+
+
+def resnet50_stage_state_dict(state_dict):
+    """Rename torchvision resnet50 keys to ResNetMulti stage keys; fc is dropped."""
+    stage_state_dict = {}
+    for key, value in state_dict.items():
+        for prefix, stage_prefix in _RESNET_PREFIXES:
+            if key.startswith(prefix):
+                stage_state_dict[stage_prefix + key[len(prefix):]] = value
+                break
+    return stage_state_dict
+
+
+def load_weights(path):
+    """
+    Memory-map a weight file of the store. Pages are read on first access and
+    shared through the page cache by every process on the host; tensors that
+    are never written (e.g. frozen stages on CPU) stay shared.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(
+            'pretrained weights {} not found. Training nodes do not download weights: create the file with\n'
+            '  python -m model.weights convert --input <torchvision resnet50 .pth> --output {}\n'
+            'or, on a machine with network access,\n'
+            '  python -m model.weights fetch --output {}\n'
+            'or set train.weights.dir / MIAN_WEIGHTS_DIR.'.format(path, path, path))
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError as e:
+        raise RuntimeError('{} cannot be memory-mapped ({}); rewrite it with '
+                           'python -m model.weights convert'.format(path, e))
+
+
+def save_weights(state_dict, path):
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # The zipfile format written by torch.save is the one torch.load can mmap
+    torch.save({k: v.contiguous() for k, v in state_dict.items()}, path)
+    print('saved {} ({} tensors)'.format(path, len(state_dict)))
+
+
+def _weights_url(arch):
+    try:
+        return models.get_model_weights(arch).IMAGENET1K_V1.url
+    except AttributeError:
+        # torchvision < 0.13
+        return models.resnet.model_urls[arch]
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Local pretrained weight store")
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    convert = sub.add_parser('convert', help="torchvision checkpoint -> weight store (ResNetMulti stage keys for resnet50)")
+    convert.add_argument("--input", type=str, required=True,
+                         help="e.g. ~/.cache/torch/hub/checkpoints/resnet50-0676ba61.pth")
+    convert.add_argument("--arch", type=str, default='resnet50', choices=sorted(DEFAULT_FILES),
+                         help="resnet50 (backbone) or a distillation student")
+    convert.add_argument("--output", type=str, default=None,
+                         help="default: weights/{arch}.pth")
+
+    fetch = sub.add_parser('fetch', help="download the ImageNet weights of --arch and convert them")
+    fetch.add_argument("--arch", type=str, default='resnet50', choices=sorted(DEFAULT_FILES),
+                       help="resnet50 (backbone) or a distillation student")
+    fetch.add_argument("--output", type=str, default=None,
+                       help="default: weights/{arch}.pth")
+    return parser.parse_args()
+
+
+def main(args):
+    if args.command == 'fetch':
+        state_dict = torch.hub.load_state_dict_from_url(_weights_url(args.arch), map_location='cpu')
+    else:
+        state_dict = torch.load(args.input, map_location='cpu')
+    output = args.output or os.path.join('weights', DEFAULT_FILES[args.arch])
+    # Through a real model, so that legacy checkpoints get every buffer
+    model = getattr(models, args.arch)()
+    model.load_state_dict(state_dict)
+    if args.arch == 'resnet50':
+        save_weights(resnet50_stage_state_dict(model.state_dict()), output)
+    else:
+        save_weights(model.state_dict(), output)
+
+
+if __name__ == '__main__':
+    main(get_arguments())
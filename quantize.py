@@ -0,0 +1,110 @@
+import argparse
+import os
+import copy
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from model.ensemble import EnsemblePredictor
+from utils.builder import build_models, build_loader, load_snapshot
+from utils.config import load_config
+from utils.evaluate import evaluate_accuracy, measure_latency, model_size_bytes
+
+
+def get_arguments():
+    """Parse all the arguments provided from the CLI.
+
+    Returns:
+      A list of parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Post-training INT8 quantization of a MIAN snapshot")
+    parser.add_argument("--snapshot", type=str, required=True,
+                        help="snapshot .pth written by Solver")
+    parser.add_argument("--config", type=str, required=True,
+                        help="config.json of the run (log/{exp_name}/config.json) or a yaml")
+    parser.add_argument("--output", type=str, required=True,
+                        help="path of the quantized TorchScript model")
+    parser.add_argument("--rootdir", type=str, default='.',
+                        help="directory holding data/")
+    parser.add_argument("--calib", type=str, default='target',
+                        help="target, source: domain(s) used to calibrate activation ranges")
+    parser.add_argument("--num_calib", type=int, default=512,
+                        help="number of calibration images")
+    parser.add_argument("--batch_size", type=int, default=32,
+                        help="")
+    parser.add_argument("--backend", type=str, default='x86',
+                        help="x86, fbgemm, qnnpack")
+    parser.add_argument("--latency_batch", type=int, nargs='+', default=[1, 32],
+                        help="batch sizes for the latency report")
+    return parser.parse_args()
+
+
+def calibration_set(loader, calib, num_calib):
+    """
+    Random subset of the unlabeled training images of the target domain (the
+    distribution we serve), or of all source domains for comparison.
+    """
+    assert calib == 'target' or calib == 'source'
+    if calib == 'target':
+        dataset = loader.target_dataset
+    else:
+        dataset = torch.utils.data.ConcatDataset(loader.source_dataset)
+    indices = torch.randperm(len(dataset))[:num_calib].tolist()
+    return torch.utils.data.Subset(dataset, indices)
+
+
+def quantize(model, calib_set, batch_size, backend):
+    """Static INT8 quantization of every conv/linear layer with FX graph mode."""
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    calib_loader = torch.utils.data.DataLoader(calib_set, batch_size=batch_size, shuffle=False)
+    example, _ = next(iter(calib_loader))
+    prepared = prepare_fx(copy.deepcopy(model), qconfig_mapping, example_inputs=(example.to(torch.float),))
+    with torch.no_grad():
+        # Labels are never used: calibration only observes activation ranges
+        for images, _ in calib_loader:
+            prepared(images.to(torch.float))
+    return convert_fx(prepared)
+
+
+def main(args):
+    config = load_config(args.config)
+    task = config['data']['task']
+    cropsize = config['data']['crop_size'][task]
+
+    basemodel, C1, C2, _ = build_models(config, pretrained=False)
+    load_snapshot(args.snapshot, basemodel, C1, C2)
+    model = EnsemblePredictor(basemodel, C1, C2).eval()
+
+    loader = build_loader(config, rootdir=args.rootdir, batch_size=args.batch_size)
+    calib_set = calibration_set(loader, args.calib, args.num_calib)
+    print('calibrate on {} {} images'.format(len(calib_set), args.calib))
+    qmodel = quantize(model, calib_set, args.batch_size, args.backend)
+
+    sample = torch.randn(1, 3, cropsize, cropsize)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(qmodel, sample))
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    scripted.save(args.output)
+    print('saved {}'.format(args.output))
+
+    acc_fp32 = evaluate_accuracy(model, loader.target_valid_dataset, batch_size=args.batch_size)
+    acc_int8 = evaluate_accuracy(scripted, loader.target_valid_dataset, batch_size=args.batch_size)
+    size_fp32 = model_size_bytes(model)
+    size_int8 = model_size_bytes(qmodel)
+
+    print('target {} val acc: fp32 {:.2f} int8 {:.2f} (delta {:+.2f})'.format(
+        config['data']['target'], acc_fp32, acc_int8, acc_int8 - acc_fp32))
+    print('model size: fp32 {:.1f}MB int8 {:.1f}MB ({:.1f}x smaller)'.format(
+        size_fp32 / 2**20, size_int8 / 2**20, size_fp32 / size_int8))
+    for batch in args.latency_batch:
+        sample = torch.randn(batch, 3, cropsize, cropsize)
+        latency_fp32 = measure_latency(model, sample)
+        latency_int8 = measure_latency(scripted, sample)
+        print('latency batch {}: fp32 {:.1f}ms int8 {:.1f}ms ({:.2f}x faster)'.format(
+            batch, latency_fp32, latency_int8, latency_fp32 / latency_int8))
+
+
+if __name__ == '__main__':
+    main(get_arguments())
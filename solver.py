@@ -5,19 +5,22 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 import os
 import os.path as osp
-import matplotlib.pyplot as plt
 from utils.loss import CrossEntropy2d, loss_calc, lr_poly, adjust_learning_rate, seg_accuracy, per_class_iu
 import time
 import datetime
-from PIL import Image
-from torchvision.utils import save_image
-from sklearn.manifold import TSNE
-from Visualize import plot_embedding
 import math
 import warnings
 import time
 import pickle as pkl
-from model.SVD import SVD_entropy, SVD_norm
+from model.SVD import SVD_entropy, SVD_norm, SVD_entropy_from_cov, SVD_norm_from_cov
+from utils.checkpoint import keep_running_stats
+from utils.profiler import StepProfiler
+from utils.memory import build_memory_monitor
+from utils.pruning import build_pruner
+from utils.async_eval import build_evaluator
+from utils.replay import build_replay
+from utils.concurrent_d import build_concurrent_D
+from model.replicas import HeadReplicas
 
 
 class Solver(object):
@@ -44,7 +47,7 @@ class Solver(object):
         self.optC2 = optC2
         self.optDFeat = optDFeat
         self.gpu_map = gpu_map
-        self.gpu0 = 'cuda:0'
+        self.gpu0 = gpu_map['basemodel']
         self.task = task
 
         self.loader_iter = iter(loader)
@@ -63,6 +66,18 @@ class Solver(object):
             config['train']['GAN']['featAdv'] == 'LS'
         self.featAdv_algorithm = config['train']['GAN']['featAdv']
 
+        # Static hot path: cached domain-label tensors, no per-step requires_grad
+        # toggling on netDFeat and no host syncs in the SVD accumulation.
+        self.static_step = config['train'].get('static_step', False)
+        self._domain_label_cache = {}
+        self.base_params = [p for p in basemodel.parameters() if p.requires_grad]
+
+        # Gradient accumulation: every step runs on accum_steps micro-batches of
+        # batch_size // accum_steps images per domain. Older configs have no key.
+        self.accum_steps = config['train'].get('accum_steps', 1)
+        assert self.batch_size % self.accum_steps == 0, \
+            'batch_size {} is not divisible by accum_steps {}'.format(self.batch_size, self.accum_steps)
+
         self.base_lr = base_lr
         self.DFeat_lr = DFeat_lr
         self.FeatAdv_coeff_init = config['train']['lambda']['base_model']['bloss_AdvFeat'][task]
@@ -73,6 +88,8 @@ class Solver(object):
         self.SVD_norm = config['train']['SVD_norm']
         self.SVD_ld_adapt = config['train']['SVD_ld_adapt']
         self.ld_alpha = 1e-6
+        self.SVD_ld_array = [self.SVD_ld for _ in range(self.num_domain)]
+        self.FeatAdv_coeff = 0.
 
         self.total_step = self.config['train']['num_steps']
         self.early_stop_step = self.config['train']['num_steps_stop'][task]
@@ -94,15 +111,62 @@ class Solver(object):
         self.val_step = 1000
         self.tsne_step = 2000
         self.save_step = 10000 #5000
+        self.start_time = time.time()
 
-        self.tsne = TSNE(n_components=2, perplexity=20, init='pca', n_iter=3000)
+        # Older config.json files have no profile or memory section
+        self.memory = build_memory_monitor(config, self.log_dir, device=self.gpu0)
+        profile_config = config['exp_setting'].get('profile', {})
+        self.profiler = StepProfiler(enabled=profile_config.get('enabled', False),
+                                     window=profile_config.get('window', 100),
+                                     trace_steps=profile_config.get('trace_steps', []),
+                                     trace_length=profile_config.get('trace_length', 5),
+                                     trace_dir=self.log_dir, device=self.gpu0, memory=self.memory)
+
+        self.pruner = build_pruner(config, exp_name)
+
+        # Extra head configurations trained on the same backbone features
+        replicas = config['train'].get('replicas') or []
+        self.replicas = None
+        if replicas:
+            self.replicas = HeadReplicas(replicas, C1, C2, netDFeat, config, self.gpu_map['C'])
+            self.log_loss['replicas'] = {'D_loss': [], 'source_loss': [], 'target_acc': []}
+            for k in range(self.replicas.num):
+                print('replica {}: {}'.format(k, self.replicas.describe(k)))
+
+        # Extra netDFeat updates on replayed features, per backbone forward
+        self.replay = build_replay(config, self.num_domain, netDFeat.channel, device=self.gpu_map['netDFeat'])
+        if self.replay is not None:
+            self.replay_updates = config['train']['replay'].get('updates', 1)
+            self.log_loss['D_replay_loss'] = []
+            self.log_loss['D_replay_staleness'] = []
+
+        # netDFeat update on a worker thread, overlapped with the generator phases
+        self.concurrent_D = build_concurrent_D(config, netDFeat, optDFeat, device=self.gpu_map['netDFeat'])
+
+        # Validation in a separate process, started in train()
+        self.evaluator = None
+        self.log_loss['target_acc_step'] = []
+        # Wall-clock seconds since the start of train() of every target_acc entry
+        self.log_loss['target_acc_time'] = []
+
+        # Progressive resolution: (until, input_size, crop_size) phases, then the configured sizes
+        schedule = config['data'].get('resolution_schedule') or []
+        self.resolution_schedule = sorted((p['until'], p['input_size'], p['crop_size']) for p in schedule)
+        self.resolution = (config['data']['input_size'][task], config['data']['crop_size'][task])
+        if self.resolution_schedule:
+            assert task not in ('digits', 'segmentation'), 'resolution_schedule needs a folder-image task'
+            assert not config['train'].get('freeze', {}).get('cache', False), \
+                'resolution_schedule resizes images; it cannot be used with the feature cache'
+
+        # sklearn and matplotlib load on the first _tsne call
+        self.tsne = None
 
     def train(self):
         # Broadcast parameters and optimizer state for every processes
 
         self.start_time = time.time()
-        self.SVD_ld_array = [self.SVD_ld for _ in range(self.num_domain)]
         adv_thres = 18000
+        self.evaluator = build_evaluator(self.config, self.log_dir)
 
         for i_iter in range(self.total_step):
             self.basemodel.train()
@@ -116,24 +180,86 @@ class Solver(object):
                 p = float(i_iter) / 18000
             self.FeatAdv_coeff = self.FeatAdv_coeff_init * (2. / (1. + np.exp(-10. * p)) - 1.)
 
-            self._train_step(i_iter)
+            if self.resolution_schedule:
+                self._update_resolution(i_iter)
+            with self.profiler.step(i_iter):
+                self._train_step(i_iter)
+            if self.profiler.enabled and (i_iter+1) % self.log_step == 0:
+                print(self.profiler.summary())
+            if self.memory is not None and (i_iter+1) % self.log_step == 0:
+                print(self.memory.summary(self.memory.sample(i_iter+1)))
 
             if (i_iter+1) % self.val_step == 0:
-                self.basemodel.eval()
-                self.C1.eval()
-                self.C2.eval()
-                self._validation(i_iter)
+                if self.evaluator is not None:
+                    # Results arrive later, tagged with the iteration of their weights
+                    self.evaluator.submit(i_iter+1, self.basemodel, self.C1, self.C2,
+                                          elapsed=time.time() - self.start_time)
+                    reports = [(r['step'], r['acc_ensemble']) for r in self._evaluator_results()]
+                else:
+                    self.basemodel.eval()
+                    self.C1.eval()
+                    self.C2.eval()
+                    reports = [(i_iter+1, self._validation(i_iter))]
                 print('SVD ld: ', self.SVD_ld_array)
 
+                pruned = False
+                # A run that has reached early_stop_step completed; it is not recorded as pruned
+                final = (i_iter+1) >= self.early_stop_step
+                for step, acc in reports:
+                    pruned = self.pruner.report(step, acc, final=final) or pruned
+                if pruned:
+                    print('Stopped by pruning policy at iteration {}'.format(i_iter+1))
+                    self._save_snapshot(osp.join(self.snapshot_dir, 'pruned_'+str(i_iter+1)+'.pth'))
+                    self._close_evaluator()
+                    with open(os.path.join(self.log_dir, 'val_result.txt'), 'a') as f:
+                        f.write('Iteration {}: pruned, {}\n'.format(i_iter+1, self.pruner.reason))
+                    with open(os.path.join(self.log_dir, '{}_log.pkl'.format(i_iter+1)), 'wb') as f:
+                        pkl.dump(self.log_loss, f)
+                    break
+
             if (i_iter+1) % self.tsne_step == 0:
                 self._tsne(i_iter)
                 self.basemodel.to(self.gpu_map['basemodel'])
 
             if (i_iter+1) >= self.early_stop_step:
+                self._close_evaluator()
                 with open(os.path.join(self.log_dir, '{}_log.pkl'.format(i_iter+1)), 'wb') as f:
                     pkl.dump(self.log_loss, f)
                 break
                 print('Training Finished')
+        self._close_evaluator()
+        if self.memory is not None:
+            self.memory.close()
+        if self.concurrent_D is not None:
+            self.concurrent_D.close()
+
+    def _evaluator_results(self, block=False):
+        records = self.evaluator.results(block)
+        for r in records:
+            self.log_loss['target_acc'].append(r['acc_ensemble'])
+            self.log_loss['target_acc_step'].append(r['step'])
+            self.log_loss['target_acc_time'].append(r['elapsed'])
+        return records
+
+    def _close_evaluator(self):
+        """Wait for the evaluations still running and log them."""
+        if self.evaluator is None:
+            return
+        self._evaluator_results(block=True)
+        self.evaluator.close()
+        self.evaluator = None
+
+    def _update_resolution(self, i_iter):
+        """Switch the training loader to the resolution_schedule phase of i_iter."""
+        resolution = (self.config['data']['input_size'][self.task], self.config['data']['crop_size'][self.task])
+        for until, input_size, crop_size in self.resolution_schedule:
+            if i_iter < until:
+                resolution = (input_size, crop_size)
+                break
+        if resolution != self.resolution:
+            print('Iteration {}: training at input_size {} crop_size {}'.format(i_iter, *resolution))
+            self.loader.set_resolution(*resolution)
+            self.resolution = resolution
 
     def _adjust_lr_opts(self, i_iter):
         if self.task != 'digits':
@@ -146,23 +272,54 @@ class Solver(object):
             self.log_lr['C1'] = adjust_learning_rate(self.optC1, self.base_lr, i_iter, self.total_step, self.power)
             self.log_lr['C2'] = adjust_learning_rate(self.optC2, self.base_lr, i_iter, self.total_step, self.power)
             self.log_lr['DFeat'] = adjust_learning_rate(self.optDFeat, self.DFeat_lr, i_iter, self.total_step, self.power)
+        if self.replicas is not None:
+            self.replicas.set_lr_scale(lr_poly(1., i_iter, self.total_step, self.power))
+
+    def _domain_labels(self, tensor):
+        """(real, fake) domain-label tensors for logits shaped like tensor, built once per shape."""
+        key = (tuple(tensor.shape), tensor.device)
+        if key not in self._domain_label_cache:
+            per_domain = tensor.size(0) // self.num_domain
+            real = torch.eye(self.num_domain, device=tensor.device).repeat_interleave(per_domain, dim=0)
+            self._domain_label_cache[key] = (real, 1. - real)
+        return self._domain_label_cache[key]
 
     def _fake_domain_label(self, tensor, model):
+        if self.static_step:
+            return self._domain_labels(tensor)[1]
         if type(tensor).__module__ == np.__name__:
             tensor = torch.tensor(tensor)
         ones = torch.ones_like(tensor, dtype=torch.float)
+        batch_size = tensor.shape[0] // self.num_domain
         for i in range(self.num_domain):
-            ones[self.batch_size*i: self.batch_size*(i+1), i] = 0.
+            ones[batch_size*i: batch_size*(i+1), i] = 0.
         return ones.to(self.gpu_map['netD{}'.format(model)])
 
     def _real_domain_label(self, tensor, model):
+        if self.static_step:
+            return self._domain_labels(tensor)[0]
         if type(tensor).__module__ == np.__name__:
             tensor = torch.tensor(tensor)
         zeros = torch.zeros_like(tensor, dtype=torch.float)
+        batch_size = tensor.shape[0] // self.num_domain
         for i in range(self.num_domain):
-            zeros[self.batch_size*i: self.batch_size*(i+1), i] = 1.
+            zeros[batch_size*i: batch_size*(i+1), i] = 1.
         return zeros.to(self.gpu_map['netD{}'.format(model)])
 
+    def _adv_loss(self, logit, target):
+        if self.featAdv_algorithm == 'Vanila':
+            return F.binary_cross_entropy_with_logits(logit, target)
+        elif self.featAdv_algorithm == 'LS':
+            return F.mse_loss(logit, target)
+
+    def _set_requires_grad_D(self, requires_grad):
+        # The static path never toggles: the D update only sees detached
+        # features, and the generator step backpropagates into base_params only.
+        if self.static_step:
+            return
+        for param in self.netDFeat.parameters():
+            param.requires_grad = requires_grad
+
     def _update_SVD_ld(self, entropy, i_iter, index):
         assert self.SVD_ld_adapt == 'exponential' or self.SVD_ld_adapt == 'constant'
         if self.SVD_ld_adapt == 'exponential':
@@ -178,15 +335,17 @@ class Solver(object):
         h, _ = self.basemodel(images)
         C1_feat = self.C1(h)
         C2_feat = self.C2(h)
-        output_s1 = C1_feat[:self.batch_size*(self.num_domain-1)]
-        output_s2 = C2_feat[:self.batch_size*(self.num_domain-1)]
+        # labels cover the source rows, which come before the target rows
+        num_source_rows = labels.size(0)
+        output_s1 = C1_feat[:num_source_rows]
+        output_s2 = C2_feat[:num_source_rows]
 
-        loss_s1 = nn.CrossEntropyLoss()(output_s1, labels)
-        loss_s2 = nn.CrossEntropyLoss()(output_s2, labels)
+        loss_s1 = F.cross_entropy(output_s1, labels)
+        loss_s2 = F.cross_entropy(output_s2, labels)
         loss_s = loss_s1 + loss_s2
 
-        output_t1 = C1_feat[self.batch_size*(self.num_domain-1):]
-        output_t2 = C2_feat[self.batch_size*(self.num_domain-1):]
+        output_t1 = C1_feat[num_source_rows:]
+        output_t2 = C2_feat[num_source_rows:]
         loss_dis = self._discrepancy(output_t1, output_t2)
         return loss_s, loss_dis
 
@@ -196,159 +355,317 @@ class Solver(object):
         self.optC1.zero_grad()
         self.optC2.zero_grad()
 
+    def _micro_batches(self, images, labels):
+        """
+        Split the stacked domain batch into accum_steps micro-batches with the
+        same layout (domain after domain, target last). Losses that are means
+        over equal-sized micro-batches, divided by accum_steps, sum to the
+        full-batch loss.
+        """
+        if self.accum_steps == 1:
+            return [(images, labels)]
+        size = self.batch_size // self.accum_steps
+        images = images.view(self.num_domain, self.batch_size, *images.shape[1:])
+        labels = labels.view(self.num_source, self.batch_size)
+        return [(images[:, j*size: (j+1)*size].reshape(-1, *images.shape[2:]),
+                 labels[:, j*size: (j+1)*size].reshape(-1))
+                for j in range(self.accum_steps)]
+
+    def _SVD_loss(self, d, features, i_iter):
+        """SVD regularizer of domain d, from its features or, under accumulation, its F^T F."""
+        if self.accum_steps == 1:
+            en_transfer_d, en_discrim_d, singular_values = SVD_entropy(features, self.SVD_k)
+        else:
+            en_transfer_d, en_discrim_d, singular_values = SVD_entropy_from_cov(features, self.SVD_k)
+        total_en = en_transfer_d + en_discrim_d
+
+        if (i_iter+1) % self.log_step == 0:
+            self.log_loss['SVD_entropy'][self.dataset[d]].append(total_en.cpu().item())
+            # detach: a CPU copy of a graph tensor would keep the step's autograd graph alive.
+            # F^T F has D eigenvalues, all but min(batch, D) zero: log the same spectrum as the full batch
+            self.log_loss['SVD_singular'][self.dataset[d]].append(singular_values[:self.batch_size].detach().cpu())
+
+        # The schedule does not depend on the entropy value, so the
+        # static path skips the host sync of total_en.item()
+        with torch.no_grad():
+            self._update_SVD_ld(None if self.static_step else total_en.item(), i_iter, d)
+
+        if not self.SVD_norm:
+            return self.SVD_ld_array[d] * (-total_en)
+        elif self.accum_steps == 1:
+            norm, _ = SVD_norm(features, self.SVD_k)
+        else:
+            norm, _ = SVD_norm_from_cov(features, self.SVD_k)
+        return self.SVD_ld_array[d] * norm
+
+    def _accumulated_SVD_backward(self, micro, i_iter):
+        """
+        Exact SVD regularizer gradient over micro-batches. F^T F of each domain
+        is additive across micro-batches, so a first no-grad pass accumulates
+        it and the loss is taken from its eigenvalues. With G = dL/d(F^T F),
+        dL/dF_j = F_j (G + G^T) for each micro-batch F_j, which a second pass
+        re-forwards (same RNG state, BatchNorm statistics kept) and backpropagates.
+        """
+        size = self.batch_size // self.accum_steps
+        covs = [0. for _ in range(self.num_domain)]
+        rng_states = []
+        with torch.no_grad():
+            for images, _ in micro:
+                rng_states.append(self._rng_state())
+                adv_feature, _ = self.basemodel(images)
+                adv_feature = adv_feature.double()
+                for d in range(self.num_domain):
+                    d_feature = adv_feature[d*size: (d+1)*size]
+                    covs[d] = covs[d] + d_feature.t().mm(d_feature)
+
+        covs = [cov.requires_grad_(True) for cov in covs]
+        SVD_en = 0.
+        for d in range(self.num_domain):
+            SVD_en = SVD_en + self._SVD_loss(d, covs[d], i_iter)
+        SVD_en.backward()
+        grads = [cov.grad + cov.grad.t() for cov in covs]
+
+        rng_state = self._rng_state()
+        with keep_running_stats(self.basemodel):
+            for (images, _), state in zip(micro, rng_states):
+                self._set_rng_state(state)
+                adv_feature, _ = self.basemodel(images)
+                surrogate = 0.
+                for d in range(self.num_domain):
+                    d_feature = adv_feature[d*size: (d+1)*size]
+                    d_grad = d_feature.detach().double().mm(grads[d]).to(d_feature.dtype)
+                    surrogate = surrogate + torch.sum(d_feature * d_grad)
+                surrogate.backward()
+        self._set_rng_state(rng_state)
+
+    def _rng_state(self):
+        cuda = torch.device(self.gpu0).type == 'cuda'
+        return torch.get_rng_state(), torch.cuda.get_rng_state(self.gpu0) if cuda else None
+
+    def _set_rng_state(self, state):
+        torch.set_rng_state(state[0])
+        if state[1] is not None:
+            torch.cuda.set_rng_state(state[1], self.gpu0)
+
     def _train_step(self, i_iter):
         self._adjust_lr_opts(i_iter)
         self._zero_grad()
+        profiler = self.profiler
+        accum = float(self.accum_steps)
 
         # -----------------------------
         # 1. Load data
         # -----------------------------
 
-        try:
-            images, labels = next(self.loader_iter)
-        except StopIteration:
-            self.loader_iter = iter(self.loader)
-            images, labels = next(self.loader_iter)
-
-        images = Variable(images.to(torch.float))
-        labels = Variable(labels.long())
-
-        images = images.to(self.gpu0)
-        labels = labels.to(self.gpu0)
-
-        # -----------------------------
-        # 2. Feedforward Basemodel
-        # -----------------------------
-
-        """ Classification and Adversarial Loss (Basemodel) """
-        adv_feature, _ = self.basemodel(images)
-
-        # -----------------------------
-        # 3. Train Discriminators
-        # -----------------------------
-        for param in self.netDFeat.parameters():
-            param.requires_grad = True
-
-        # Train with original domain labels
-        DFeatlogit = self.netDFeat(adv_feature.detach().to(self.gpu_map['netDFeat']))
-
-        if self.featAdv_algorithm == 'Vanila':
-            Dloss_AdvFeat = nn.BCEWithLogitsLoss()(DFeatlogit,
-                                                  self._real_domain_label(DFeatlogit, 'Feat'))
-        elif self.featAdv_algorithm == 'LS':
-            Dloss_AdvFeat = nn.MSELoss()(DFeatlogit,
-                                         self._real_domain_label(DFeatlogit, 'Feat'))
-
-        Dloss_AdvFeat.backward()
-        if (i_iter+1) % self.log_step == 0:
-            self.log_loss['D_loss'].append(Dloss_AdvFeat.cpu().item())
-        self.optDFeat.step()
+        with profiler.phase('data'):
+            try:
+                images, labels = next(self.loader_iter)
+            except StopIteration:
+                self.loader_iter = iter(self.loader)
+                images, labels = next(self.loader_iter)
+
+            images = Variable(images.to(torch.float))
+            labels = Variable(labels.long())
+
+            images = images.to(self.gpu0)
+            labels = labels.to(self.gpu0)
+            micro = self._micro_batches(images, labels)
+
+        with profiler.phase('D update'):
+            self._set_requires_grad_D(True)
+            D_features = []
+            replica_micro = []
+            for micro_images, micro_labels in micro:
+                # -----------------------------
+                # 2. Feedforward Basemodel
+                # -----------------------------
+
+                """ Classification and Adversarial Loss (Basemodel) """
+                adv_feature, _ = self.basemodel(micro_images)
+                D_features.append(adv_feature.detach().to(self.gpu_map['netDFeat']))
+                if self.replicas is not None:
+                    replica_micro.append((adv_feature.detach().to(self.gpu_map['C']), micro_labels))
+                if self.replay is not None:
+                    self.replay.push(adv_feature.detach(), i_iter)
+
+            # -----------------------------
+            # 3. Train Discriminators
+            # -----------------------------
+            if self.concurrent_D is not None:
+                # Overlapped with the phases below, which see netDFeat of the previous step
+                self.concurrent_D.submit(self._concurrent_D_update, D_features, i_iter)
+            else:
+                self._D_update(self.netDFeat, self.optDFeat, D_features, i_iter)
+
+        if self.replay is not None and self.concurrent_D is None:
+            with profiler.phase('D replay'):
+                self._replay_D_update(self.netDFeat, self.optDFeat, i_iter, D_features[0].size(0) // self.num_domain)
+
+        if self.replicas is not None:
+            with profiler.phase('replicas'):
+                replica_D_loss, replica_source_loss = self.replicas.train_step(
+                    replica_micro, lambda logit: self._real_domain_label(logit, 'Feat'), self.MCD)
+                if (i_iter+1) % self.log_step == 0:
+                    self.log_loss['replicas']['D_loss'].append(replica_D_loss.cpu().numpy())
+                    self.log_loss['replicas']['source_loss'].append(replica_source_loss.cpu().numpy())
         # ----------------------------
         # 4. Train Basemodel
         # ----------------------------
 
-        for param in self.netDFeat.parameters():
-            param.requires_grad = False
+        self._set_requires_grad_D(False)
 
         # ----------------------------
         # Maximum Classifier Discrepancy
         # ----------------------------
         if self.MCD:
-            loss_s, _ = self._maximum_classifier_discrepancy(images, labels)
-            loss_s.backward()
-            if (i_iter+1) % self.log_step == 0:
-                self.log_loss['source_loss'].append(loss_s.cpu().item())
-            self.optBase.step()
-            self.optC1.step()
-            self.optC2.step()
-            self._zero_grad()
-
-            loss_s, loss_dis = self._maximum_classifier_discrepancy(images, labels)
-            loss = loss_s - loss_dis
-            loss.backward()
-            self.optC1.step()
-            self.optC2.step()
-            self._zero_grad()
-
-            for i in range(4):
-                _, loss_dis = self._maximum_classifier_discrepancy(images, labels)
-                loss_dis.backward()
+            with profiler.phase('MCD 1'):
+                loss_total = 0.
+                for micro_images, micro_labels in micro:
+                    loss_s, _ = self._maximum_classifier_discrepancy(micro_images, micro_labels)
+                    loss_s = loss_s / accum
+                    loss_s.backward()
+                    loss_total = loss_total + loss_s.detach()
+                if (i_iter+1) % self.log_step == 0:
+                    self.log_loss['source_loss'].append(loss_total.cpu().item())
                 self.optBase.step()
+                self.optC1.step()
+                self.optC2.step()
                 self._zero_grad()
-        else:
-            h, _ = self.basemodel(images)
-            C1_feat = self.C1(h)
-            output_s1 = C1_feat[:self.batch_size*(self.num_domain-1)]
-            loss_s1 = nn.CrossEntropyLoss()(output_s1, labels)
-            loss_s1.backward()
-            self.optBase.step()
-            self.optC1.step()
-            self._zero_grad()
-
-        adv_feature, _ = self.basemodel(images)
-
-        # ----------------------------
-        # SVD Entropy regularization
-        # ----------------------------
-        SVD_en = Variable(torch.tensor(0.), requires_grad=False).to(self.gpu0)
-        for d in range(self.num_domain):
-            d_feature = adv_feature[d*self.batch_size: (d+1)*self.batch_size]
-            en_transfer_d, en_discrim_d, singular_values = SVD_entropy(d_feature, self.SVD_k)
-            total_en = en_transfer_d + en_discrim_d
 
-            if (i_iter+1) % self.log_step == 0:
-                self.log_loss['SVD_entropy'][self.dataset[d]].append(total_en.cpu().item())
-                self.log_loss['SVD_singular'][self.dataset[d]].append(singular_values.cpu())
+            with profiler.phase('MCD 2'):
+                for micro_images, micro_labels in micro:
+                    loss_s, loss_dis = self._maximum_classifier_discrepancy(micro_images, micro_labels)
+                    loss = (loss_s - loss_dis) / accum
+                    loss.backward()
+                self.optC1.step()
+                self.optC2.step()
+                self._zero_grad()
 
-            with torch.no_grad():
-                self._update_SVD_ld(total_en.item(), i_iter, d)
+            with profiler.phase('MCD 3'):
+                for i in range(4):
+                    for micro_images, micro_labels in micro:
+                        _, loss_dis = self._maximum_classifier_discrepancy(micro_images, micro_labels)
+                        loss_dis = loss_dis / accum
+                        loss_dis.backward()
+                    self.optBase.step()
+                    self._zero_grad()
+        else:
+            with profiler.phase('classification'):
+                for micro_images, micro_labels in micro:
+                    h, _ = self.basemodel(micro_images)
+                    C1_feat = self.C1(h)
+                    output_s1 = C1_feat[:micro_labels.size(0)]
+                    loss_s1 = F.cross_entropy(output_s1, micro_labels) / accum
+                    loss_s1.backward()
+                self.optBase.step()
+                self.optC1.step()
+                self._zero_grad()
 
-            if not self.SVD_norm:
-                SVD_en += self.SVD_ld_array[d] * (-total_en)
+        with profiler.phase('SVD'):
+            # ----------------------------
+            # SVD Entropy regularization
+            # ----------------------------
+            if self.accum_steps > 1:
+                self._accumulated_SVD_backward(micro, i_iter)
             else:
-                norm, _ = SVD_norm(d_feature, self.SVD_k)
-                SVD_en += self.SVD_ld_array[d] * norm
-
-        SVD_en.backward()
-        self.optBase.step()
-        self._zero_grad()
+                adv_feature, _ = self.basemodel(images)
+                if self.static_step:
+                    SVD_en = 0.
+                else:
+                    SVD_en = Variable(torch.tensor(0.), requires_grad=False).to(self.gpu0)
+                for d in range(self.num_domain):
+                    d_feature = adv_feature[d*self.batch_size: (d+1)*self.batch_size]
+                    SVD_en = SVD_en + self._SVD_loss(d, d_feature, i_iter)
+                SVD_en.backward()
+            self.optBase.step()
+            self._zero_grad()
         # ----------------------------
 
-        adv_feature, _ = self.basemodel(images)
-        DFeatlogit = self.netDFeat(adv_feature.to(self.gpu_map['netDFeat']))
-
-        fake_domain_label = self._fake_domain_label(DFeatlogit, 'Feat')
-
-        if self.featAdv_algorithm == 'Vanila':
-            bloss_AdvFeat = nn.BCEWithLogitsLoss()(DFeatlogit, fake_domain_label)
-        elif self.featAdv_algorithm == 'LS':
-            bloss_AdvFeat = nn.MSELoss()(DFeatlogit, fake_domain_label)
-        bloss_AdvFeat *= self.FeatAdv_coeff
-        bloss_AdvFeat.backward()
-        self.optBase.step()
+        with profiler.phase('adversarial'):
+            for micro_images, _ in micro:
+                adv_feature, _ = self.basemodel(micro_images)
+                DFeatlogit = self.netDFeat(adv_feature.to(self.gpu_map['netDFeat']))
+
+                fake_domain_label = self._fake_domain_label(DFeatlogit, 'Feat')
+                bloss_AdvFeat = self._adv_loss(DFeatlogit, fake_domain_label)
+                bloss_AdvFeat *= self.FeatAdv_coeff / accum
+                if self.static_step:
+                    bloss_AdvFeat.backward(inputs=self.base_params)
+                else:
+                    bloss_AdvFeat.backward()
+            self.optBase.step()
+        if self.concurrent_D is not None:
+            with profiler.phase('D join'):
+                self.concurrent_D.join()
         # -----------------------------------------------
         # -----------------------------------------------
 
         if (i_iter+1) % self.log_step == 0:
-            et = time.time() - self.start_time
-            et = str(datetime.timedelta(seconds=et))[:-7]
-            log = "Elapsed [{}], Iteration [{}/{}]\n".format(et, i_iter+1, self.early_stop_step)
-            h, _ = self.basemodel(images)
-            pred = self.C1(h)
-            source_pd = pred.detach().data[:self.batch_size*self.num_source].max(1)[1].cpu().numpy()
-            source_lb = labels.data.cpu().numpy()
-            acc = np.mean(source_pd == source_lb)
-            if (i_iter+1) % self.log_step == 0:
-                self.log_loss['source_acc'].append(acc.item())
-            log += "\nAcc: {:.2f}".format(acc.item()*100)
-            print(log)
+            with profiler.phase('logging'):
+                et = time.time() - self.start_time
+                et = str(datetime.timedelta(seconds=et))[:-7]
+                log = "Elapsed [{}], Iteration [{}/{}]\n".format(et, i_iter+1, self.early_stop_step)
+                with torch.no_grad():
+                    source_pd = []
+                    for micro_images, micro_labels in micro:
+                        h, _ = self.basemodel(micro_images)
+                        pred = self.C1(h)
+                        source_pd.append(pred[:micro_labels.size(0)].max(1)[1])
+                    source_pd = torch.cat(source_pd).cpu().numpy()
+                    source_lb = torch.cat([micro_labels for _, micro_labels in micro]).cpu().numpy()
+                acc = np.mean(source_pd == source_lb)
+                if (i_iter+1) % self.log_step == 0:
+                    self.log_loss['source_acc'].append(acc.item())
+                log += "\nAcc: {:.2f}".format(acc.item()*100)
+                print(log)
 
         if (i_iter+1) % self.save_step == 0:
-            print('taking snapshot ...')
-            torch.save({
-                'basemodel': self.basemodel.state_dict(),
-                'netDFeat': self.netDFeat.state_dict(),
-            }, osp.join(self.snapshot_dir, 'pretrain_'+str(i_iter+1)+'.pth'))
+            with profiler.phase('snapshot'):
+                self._save_snapshot(osp.join(self.snapshot_dir, 'pretrain_'+str(i_iter+1)+'.pth'))
+
+    def _D_update(self, netD, optimizer, features, i_iter):
+        """One netDFeat step on the detached features of every micro-batch, with the original domain labels."""
+        accum = float(self.accum_steps)
+        Dloss_total = 0.
+        for feature in features:
+            DFeatlogit = netD(feature)
+            Dloss_AdvFeat = self._adv_loss(DFeatlogit, self._real_domain_label(DFeatlogit, 'Feat')) / accum
+            Dloss_AdvFeat.backward()
+            Dloss_total = Dloss_total + Dloss_AdvFeat.detach()
+        if (i_iter+1) % self.log_step == 0:
+            self.log_loss['D_loss'].append(Dloss_total.cpu().item())
+        optimizer.step()
+
+    def _concurrent_D_update(self, netD, optimizer, features, i_iter):
+        """D update and replayed updates of the concurrent schedule, on its worker thread."""
+        self._D_update(netD, optimizer, features, i_iter)
+        if self.replay is not None:
+            self._replay_D_update(netD, optimizer, i_iter, features[0].size(0) // self.num_domain)
+
+    def _replay_D_update(self, netD, optimizer, i_iter, per_domain):
+        """replay_updates netDFeat steps on replayed features, same batch layout and loss as the D update."""
+        Dloss_total = 0.
+        for _ in range(self.replay_updates):
+            optimizer.zero_grad()
+            DFeatlogit = netD(self.replay.sample(per_domain, i_iter))
+            Dloss_replay = self._adv_loss(DFeatlogit, self._real_domain_label(DFeatlogit, 'Feat'))
+            Dloss_replay.backward()
+            optimizer.step()
+            Dloss_total = Dloss_total + Dloss_replay.detach()
+        if (i_iter+1) % self.log_step == 0:
+            self.log_loss['D_replay_loss'].append(Dloss_total.cpu().item() / self.replay_updates)
+            # Mean age in steps of the features sample() draws from
+            self.log_loss['D_replay_staleness'].append(self.replay.staleness(i_iter))
+
+    def _save_snapshot(self, path):
+        print('taking snapshot ...')
+        torch.save({
+            'basemodel': self.basemodel.state_dict(),
+            'C1': self.C1.state_dict(),
+            'C2': self.C2.state_dict(),
+            'netDFeat': self.netDFeat.state_dict(),
+            'replicas': self.replicas.state_dict() if self.replicas is not None else None,
+        }, path)
 
     def _validation(self, i_iter):
         val_iter = 0
@@ -356,6 +673,7 @@ class Solver(object):
         correct1 = 0
         correct2 = 0
         correct3 = 0
+        replica_correct = 0
 
         for i in range(len(self.TargetLoader) // self.batch_size):
             with torch.no_grad():
@@ -384,21 +702,44 @@ class Solver(object):
                 correct3 += pred_ensemble.eq(target_labels.data).cpu().sum()
                 size += k
 
+                if self.replicas is not None:
+                    _, _, replica_ensemble = self.replicas.predict(h.to(self.gpu_map['C']))
+                    replica_pred = replica_ensemble.max(2)[1]
+                    replica_correct += replica_pred.eq(target_labels.data.to(replica_pred.device)).sum(1).cpu()
+
         acc1 = 100. * correct1 / size
         acc2 = 100. * correct2 / size
         acc3 = 100. * correct3 / size
 
-        info_str = 'Iteration {}: acc1:{:0.2f} acc2:{:0.2f} acc_ensemble:{:0.2f}'.format(i_iter+1,
-                                                                                         acc1, acc2, acc3)
+        elapsed = time.time() - self.start_time
+        info_str = 'Iteration {}: acc1:{:0.2f} acc2:{:0.2f} acc_ensemble:{:0.2f} elapsed:{:.0f}s'.format(
+            i_iter+1, acc1, acc2, acc3, elapsed)
         self.log_loss['target_acc'].append(acc3.cpu().item())
+        self.log_loss['target_acc_step'].append(i_iter+1)
+        self.log_loss['target_acc_time'].append(elapsed)
         print(info_str)
 
         with open(os.path.join(self.log_dir, 'val_result.txt'), 'a') as f:
             f.write(info_str+'\n')
             f.close()
 
+        if self.replicas is not None:
+            replica_acc = 100. * replica_correct.double() / size
+            self.log_loss['replicas']['target_acc'].append(replica_acc.numpy())
+            with open(os.path.join(self.log_dir, 'val_result_replicas.txt'), 'a') as f:
+                for k in range(self.replicas.num):
+                    replica_str = 'Iteration {}: replica {} ({}): acc_ensemble:{:0.2f}'.format(
+                        i_iter+1, k, self.replicas.describe(k), replica_acc[k])
+                    print(replica_str)
+                    f.write(replica_str+'\n')
+        return acc3.item()
+
     def _tsne(self, i_iter):
         # Plot t-SNE of hidden feature
+        from sklearn.manifold import TSNE
+        from Visualize import plot_embedding
+        if self.tsne is None:
+            self.tsne = TSNE(n_components=2, perplexity=20, init='pca', n_iter=3000)
         source_images1, source_labels1 = next(self.loader_iter)
         target_images1, target_labels1 = next(self.target_iter)
         tsne_images = torch.cat([source_images1[:self.batch_size*self.num_source],
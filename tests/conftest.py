@@ -0,0 +1,47 @@
+import pytest
+from solver import Solver
+
+
+def _solver_attributes():
+    """Defaults of the Solver attributes read by the training-step methods under test: 3 domains, target last."""
+    dataset = ['Source0', 'Source1', 'Target']
+    return {
+        'basemodel': None,
+        'num_domain': 3,
+        'num_source': 2,
+        'dataset': dataset,
+        'batch_size': 8,
+        'accum_steps': 1,
+        'static_step': True,
+        'gpu0': 'cpu',
+        'log_step': 10 ** 9,
+        'log_loss': {'D_loss': [], 'SVD_entropy': {name: [] for name in dataset},
+                     'SVD_singular': {name: [] for name in dataset}},
+        'SVD_k': 1,
+        'SVD_norm': False,
+        'SVD_ld_adapt': 'constant',
+        'SVD_ld_array': [0.1, 0.2, 0.3],
+        'featAdv_algorithm': 'Vanila',
+        '_domain_label_cache': {},
+        'replay': None,
+    }
+
+
+@pytest.fixture
+def bare_solver():
+    """
+    Factory of Solvers built without __init__ (no data, models or log
+    directories), with the attributes of _solver_attributes() and keyword
+    overrides. Add an attribute here when a method under test starts
+    reading it.
+    """
+    def make(**overrides):
+        solver = Solver.__new__(Solver)
+        attributes = _solver_attributes()
+        unknown = set(overrides) - set(attributes)
+        assert not unknown, 'no default for {}; add it to _solver_attributes'.format(sorted(unknown))
+        attributes.update(overrides)
+        for name, value in attributes.items():
+            setattr(solver, name, value)
+        return solver
+    return make
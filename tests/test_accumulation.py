@@ -0,0 +1,72 @@
+import pytest
+import torch
+import torch.nn as nn
+
+
+class TinyBase(nn.Module):
+    def __init__(self):
+        super(TinyBase, self).__init__()
+        self.layers = nn.Sequential(nn.Linear(10, 16), nn.BatchNorm1d(16), nn.ReLU(), nn.Linear(16, 6))
+
+    def forward(self, x):
+        h = self.layers(x)
+        return h, h
+
+
+def _grads(model):
+    return [p.grad.clone() for p in model.parameters()]
+
+
+def _eval_bn_model():
+    model = TinyBase()
+    model.train()
+    model.layers[1].eval()
+    with torch.no_grad():
+        model.layers[1].running_mean.normal_()
+        model.layers[1].running_var.uniform_(0.5, 2.)
+    return model
+
+
+@pytest.mark.parametrize('SVD_norm', [False, True])
+def test_accumulated_SVD_gradient_matches_full_batch(bare_solver, SVD_norm):
+    torch.manual_seed(0)
+    batch_size = 8
+    model = _eval_bn_model()
+    images = torch.randn(3 * batch_size, 10)
+    labels = torch.randint(0, 4, (2 * batch_size,))
+
+    solver = bare_solver(basemodel=model, batch_size=batch_size, SVD_norm=SVD_norm)
+    features, _ = model(images)
+    loss = 0.
+    for d in range(solver.num_domain):
+        loss = loss + solver._SVD_loss(d, features[d*batch_size: (d+1)*batch_size], 0)
+    loss.backward()
+    expected = _grads(model)
+
+    model.zero_grad()
+    solver = bare_solver(basemodel=model, batch_size=batch_size, accum_steps=2, SVD_norm=SVD_norm)
+    solver._accumulated_SVD_backward(solver._micro_batches(images, labels), 0)
+    for grad, reference in zip(_grads(model), expected):
+        torch.testing.assert_close(grad, reference, rtol=1e-3, atol=1e-5)
+
+
+def test_accumulated_SVD_logs_full_batch_spectrum(bare_solver):
+    torch.manual_seed(0)
+    batch_size = 4
+    model = _eval_bn_model()
+    # Feature dimension 6 > per-domain batch 4: F^T F has zero eigenvalues
+    images = torch.randn(3 * batch_size, 10)
+    labels = torch.randint(0, 4, (2 * batch_size,))
+
+    full = bare_solver(basemodel=model, batch_size=batch_size, log_step=1)
+    features, _ = model(images)
+    for d in range(full.num_domain):
+        full._SVD_loss(d, features[d*batch_size: (d+1)*batch_size], 0)
+    accumulated = bare_solver(basemodel=model, batch_size=batch_size, accum_steps=2, log_step=1)
+    accumulated._accumulated_SVD_backward(accumulated._micro_batches(images, labels), 0)
+
+    for name in full.dataset:
+        expected = full.log_loss['SVD_singular'][name][0]
+        logged = accumulated.log_loss['SVD_singular'][name][0]
+        assert logged.shape == expected.shape == (batch_size,)
+        torch.testing.assert_close(logged.float(), expected, rtol=1e-3, atol=1e-5)
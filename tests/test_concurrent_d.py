@@ -0,0 +1,38 @@
+import copy
+import torch
+import torch.nn as nn
+from utils.concurrent_d import ConcurrentDUpdate
+
+
+def test_concurrent_D_matches_sequential(bare_solver):
+    torch.manual_seed(0)
+    netD = nn.Sequential(nn.Linear(6, 16), nn.ReLU(), nn.Linear(16, 3))
+    sequential_D = copy.deepcopy(netD)
+    sequential_opt = torch.optim.SGD(sequential_D.parameters(), lr=0.1, momentum=0.9, weight_decay=5e-4)
+    optDFeat = torch.optim.SGD(netD.parameters(), lr=0.1, momentum=0.9, weight_decay=5e-4)
+    concurrent = ConcurrentDUpdate(netD, optDFeat)
+    sequential, threaded = bare_solver(log_step=1), bare_solver(log_step=1)
+
+    for i_iter in range(5):
+        features = [torch.randn(3 * 4, 6), torch.randn(3 * 4, 6)]
+        lr = 0.1 * (1. - i_iter / 10.)
+        for opt in (sequential_opt, optDFeat):
+            opt.param_groups[0]['lr'] = lr
+        before = [p.detach().clone() for p in sequential_D.parameters()]
+
+        sequential_opt.zero_grad()
+        sequential._D_update(sequential_D, sequential_opt, features, i_iter)
+
+        concurrent.submit(threaded._concurrent_D_update, features, i_iter)
+        # The generator phases: zero_grad of the Solver optimizers, forwards with the stale netDFeat
+        for _ in range(50):
+            optDFeat.zero_grad()
+            netD(features[0]).sum().backward()
+        for p, q in zip(netD.parameters(), before):
+            torch.testing.assert_close(p.detach(), q)
+        concurrent.join()
+
+        for p, q in zip(netD.parameters(), sequential_D.parameters()):
+            torch.testing.assert_close(p.detach(), q.detach())
+    concurrent.close()
+    torch.testing.assert_close(torch.tensor(threaded.log_loss['D_loss']), torch.tensor(sequential.log_loss['D_loss']))
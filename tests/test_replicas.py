@@ -0,0 +1,32 @@
+import pytest
+import torch
+from model.replicas import StackedOptimizer
+
+
+@pytest.mark.parametrize('algorithm', ['Momentum', 'Adam'])
+def test_stacked_optimizer_matches_torch(algorithm):
+    torch.manual_seed(0)
+    lrs = [0.1, 0.01, 0.001]
+    stacked = torch.randn(len(lrs), 5, 3)
+    singles = [torch.nn.Parameter(stacked[k].clone()) for k in range(len(lrs))]
+    stacked = torch.nn.Parameter(stacked)
+    optimizer = StackedOptimizer([stacked], lrs, algorithm, momentum=0.9, weight_decay=5e-4,
+                                 betas=(0.9, 0.99), eps=1e-8)
+    if algorithm == 'Momentum':
+        references = [torch.optim.SGD([p], lr=lr, momentum=0.9, weight_decay=5e-4) for p, lr in zip(singles, lrs)]
+    else:
+        references = [torch.optim.Adam([p], lr=lr, betas=(0.9, 0.99), eps=1e-8, weight_decay=5e-4)
+                      for p, lr in zip(singles, lrs)]
+
+    for _ in range(5):
+        grad = torch.randn_like(stacked)
+        optimizer.zero_grad()
+        stacked.grad = grad.clone()
+        optimizer.step()
+        for k, (p, reference) in enumerate(zip(singles, references)):
+            reference.zero_grad()
+            p.grad = grad[k].clone()
+            reference.step()
+
+    for k, p in enumerate(singles):
+        torch.testing.assert_close(stacked.detach()[k], p.detach(), rtol=1e-5, atol=1e-6)
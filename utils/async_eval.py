@@ -0,0 +1,145 @@
+import json
+import os
+import queue
+import time
+import torch
+import torch.multiprocessing as mp
+
+
+def cpu_state_dict(module):
+    """Copy of the weights of module on CPU, detached from training."""
+    return {k: v.detach().to('cpu', copy=True) for k, v in module.state_dict().items()}
+
+
+def _evaluate(basemodel, C1, C2, loader, device):
+    """Full pass over the target val set; (acc1, acc2, acc_ensemble) in %."""
+    correct1 = correct2 = correct3 = 0
+    size = 0
+    with torch.no_grad():
+        for target_images, target_labels in loader:
+            target_images = target_images.to(torch.float).to(device)
+            target_labels = target_labels.long().to(device)
+            h, _ = basemodel(target_images)
+            if torch.isnan(h).any(): raise ValueError
+            output1 = C1(h)
+            output2 = C2(h)
+            correct1 += output1.max(1)[1].eq(target_labels).sum().item()
+            correct2 += output2.max(1)[1].eq(target_labels).sum().item()
+            correct3 += (output1 + output2).max(1)[1].eq(target_labels).sum().item()
+            size += target_labels.size(0)
+    return 100. * correct1 / size, 100. * correct2 / size, 100. * correct3 / size
+
+
+def _evaluator_main(config, rootdir, log_dir, settings, jobs, results):
+    """Evaluator process: build the models once, then evaluate every snapshot of `jobs`."""
+    from utils.builder import build_models, build_target_valid_dataset
+    from utils.runtime import apply_runtime
+
+    apply_runtime({'main_cpus': settings.get('cpus'), 'num_threads': settings.get('num_threads')})
+    task = config['data']['task']
+    device = settings.get('device', 'cpu')
+    dataset = build_target_valid_dataset(config, rootdir)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=settings.get('batch_size') or
+                                         config['train']['batch_size'][task],
+                                         num_workers=settings.get('num_workers', 0), shuffle=False, drop_last=False)
+    basemodel, C1, C2, _ = build_models(config, pretrained=False)
+    for m in [basemodel, C1, C2]:
+        m.to(device).eval()
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        start = time.time()
+        basemodel.load_state_dict(job['basemodel'])
+        C1.load_state_dict(job['C1'])
+        C2.load_state_dict(job['C2'])
+        del job['basemodel'], job['C1'], job['C2']
+        acc1, acc2, acc3 = _evaluate(basemodel, C1, C2, loader, device)
+
+        info_str = 'Iteration {}: acc1:{:0.2f} acc2:{:0.2f} acc_ensemble:{:0.2f} elapsed:{:.0f}s'.format(
+            job['step'], acc1, acc2, acc3, job['elapsed'])
+        print('[evaluator] ' + info_str)
+        with open(os.path.join(log_dir, 'val_result.txt'), 'a') as f:
+            f.write(info_str+'\n')
+        record = {'step': job['step'], 'acc1': acc1, 'acc2': acc2, 'acc_ensemble': acc3,
+                  'submitted': job['time'], 'elapsed': job['elapsed'], 'eval_sec': time.time() - start}
+        with open(os.path.join(log_dir, 'val_metrics.jsonl'), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        results.put(record)
+
+
+class AsyncEvaluator(object):
+    """
+    Target-set validation in a separate process. submit() hands over CPU
+    copies of the basemodel/C1/C2 weights through a queue of at most
+    max_pending snapshots: while the evaluator is that far behind, submit()
+    blocks (backpressure) instead of piling up snapshots. The evaluator
+    writes val_result.txt and val_metrics.jsonl, tagged with the iteration
+    of the weights; results() returns the records evaluated since the last
+    call.
+    """
+    def __init__(self, config, log_dir, rootdir='.', settings=None):
+        settings = settings or {}
+        # spawn: no forked copy of the training process, its CUDA context or loader workers
+        ctx = mp.get_context('spawn')
+        self.jobs = ctx.Queue(maxsize=settings.get('max_pending', 1))
+        self._results = ctx.Queue()
+        self.process = ctx.Process(target=_evaluator_main, name='evaluator',
+                                   args=(config, rootdir, log_dir, settings, self.jobs, self._results))
+        self.process.daemon = True
+        self.process.start()
+        self.pending = 0
+
+    def _check_alive(self):
+        if not self.process.is_alive():
+            raise RuntimeError('the evaluator process exited with code {}'.format(self.process.exitcode))
+
+    def submit(self, step, basemodel, C1, C2, elapsed):
+        """Queue the weights of iteration step; elapsed is the training wall-clock time logged with them."""
+        job = {'step': step, 'time': time.time(), 'elapsed': elapsed, 'basemodel': cpu_state_dict(basemodel),
+               'C1': cpu_state_dict(C1), 'C2': cpu_state_dict(C2)}
+        start = time.time()
+        while True:
+            self._check_alive()
+            try:
+                self.jobs.put(job, timeout=1.)
+                break
+            except queue.Full:
+                continue
+        waited = time.time() - start
+        if waited > 1.:
+            print('evaluator behind: training waited {:.1f}s to submit iteration {}'.format(waited, step))
+        self.pending += 1
+
+    def results(self, block=False):
+        """Records finished since the last call; with block=True, wait for every submitted snapshot."""
+        records = []
+        while self.pending > 0:
+            try:
+                records.append(self._results.get(timeout=1. if block else 0.01))
+                self.pending -= 1
+            except queue.Empty:
+                if not block:
+                    break
+                self._check_alive()
+        return records
+
+    def close(self):
+        """Wait for the pending evaluations and stop the process; returns their records."""
+        records = self.results(block=True)
+        self.jobs.put(None)
+        self.process.join()
+        return records
+
+
+def build_evaluator(config, log_dir, rootdir='.'):
+    """AsyncEvaluator from exp_setting.async_eval; None when it is missing or disabled."""
+    settings = config['exp_setting'].get('async_eval') or {}
+    if not settings.get('enabled', False):
+        return None
+    assert not config['train'].get('freeze', {}).get('cache', False), \
+        'async_eval evaluates images; it cannot be used with the feature cache'
+    assert not config['train'].get('replicas'), \
+        'async_eval evaluates basemodel/C1/C2 only; train.replicas are validated inline, disable async_eval'
+    return AsyncEvaluator(config, log_dir, rootdir, settings)
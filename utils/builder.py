@@ -0,0 +1,130 @@
+import torch
+import torch.optim as optim
+from dataset.multiloader import MultiDomainLoader, target_valid_dataset
+from model.deeplab_res import DeeplabRes
+from model.deeplab_digit import DeepDigits
+from model.discriminator import DigitDiscriminator, OfficeDiscriminator
+from model.weights import weight_path
+from model.classifier import Predictor
+from utils.weight_init import weight_init
+
+
+def feature_size(task):
+    return 2048 if task == 'digits' else 256
+
+
+def domain_order(config):
+    """Domains of the task with the target moved last, as MultiDomainLoader expects."""
+    task = config['data']['task']
+    target = config['data']['target']
+    return [d for d in config['data']['domain'][task] if d != target] + [target]
+
+
+def build_loader(config, rootdir='.', batch_size=None, num_workers=None):
+    """MultiDomainLoader for config['data']['task'] and config['data']['target']."""
+    task = config['data']['task']
+    if batch_size is None:
+        batch_size = config['train']['batch_size'][task]
+    if num_workers is None:
+        num_workers = config['data']['num_workers']
+    # Older configs have no runtime section
+    worker_cpus = config['exp_setting'].get('runtime', {}).get('worker_cpus')
+    return MultiDomainLoader(domain_order(config), rootdir,
+                             config['data']['input_size'][task], config['data']['crop_size'][task],
+                             batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                             half_crop=None, task=task, worker_cpus=worker_cpus,
+                             joint_augment=config['data'].get('joint_augment', False),
+                             draft=config['data'].get('draft_decode', False))
+
+
+def build_target_valid_dataset(config, rootdir='.'):
+    """Val split of config['data']['target'] without the other domains, e.g. for an evaluator process."""
+    task = config['data']['task']
+    return target_valid_dataset(task, config['data']['target'], rootdir,
+                                config['data']['input_size'][task], config['data']['crop_size'][task],
+                                draft=config['data'].get('draft_decode', False))
+
+
+def build_models(config, num_domain=None, pretrained=True):
+    """
+    Create basemodel, C1, C2 and netDFeat for config['data']['task'] on CPU.
+    pretrained=False skips the ImageNet weights, e.g. when a snapshot is
+    loaded right after; otherwise they come from the local weight store.
+
+    Returns:
+      basemodel, C1, C2, netDFeat
+    """
+    task = config['data']['task']
+    num_classes = config['data']['num_classes'][task]
+    if num_domain is None:
+        num_domain = len(config['data']['domain'][task])
+    prev_feature_size = feature_size(task)
+    # Configs dumped by older runs have no freeze section, checkpoint flag or rank
+    checkpoint = config['train'].get('checkpoint', False)
+
+    if task == 'digits':
+        basemodel = DeepDigits(num_classes=num_classes, checkpoint=checkpoint, rank=config['train'].get('rank'))
+        basemodel.apply(weight_init)
+    else:
+        freeze_stages = config['train'].get('freeze', {}).get('stages', 0)
+        weights = weight_path(config, 'resnet50') if pretrained else None
+        basemodel = DeeplabRes(num_classes=num_classes, freeze_stages=freeze_stages, pretrained=pretrained,
+                               checkpoint=checkpoint, weights=weights)
+
+    c1 = Predictor(prev_feature_size=prev_feature_size, num_classes=num_classes)
+    c2 = Predictor(prev_feature_size=prev_feature_size, num_classes=num_classes)
+
+    if task == 'digits':
+        netDFeat = DigitDiscriminator(channel=prev_feature_size, num_domain=num_domain)
+    else:
+        netDFeat = OfficeDiscriminator(channel=prev_feature_size, num_domain=num_domain)
+
+    c1.apply(weight_init)
+    c2.apply(weight_init)
+    netDFeat.apply(weight_init)
+    return basemodel, c1, c2, netDFeat
+
+
+def build_optimizers(config, basemodel, C1, C2, netDFeat):
+    """
+    Optimizers of the four modules. Heads use 10x the base lr with SGD.
+
+    Returns:
+      optBase, optC1, optC2, optDFeat
+    """
+    task = config['data']['task']
+    base_lr = config['train']['base_model'][task]['lr']
+    base_momentum = config['train']['base_model'][task]['momentum']
+    D_lr = config['train']['netD'][task]['lr']
+    D_momentum = config['train']['netD'][task]['momentum']
+    weight_decay = config['train']['weight_decay']
+    base_params = [p for p in basemodel.parameters() if p.requires_grad]
+
+    if config['train']['optimizer'][task] == 'Momentum':
+        print('Setting SGD Optimizer')
+        optBase = optim.SGD(base_params, lr=base_lr, momentum=base_momentum, weight_decay=weight_decay)
+        optC1 = optim.SGD(C1.parameters(), lr=10*base_lr, momentum=base_momentum, weight_decay=weight_decay)
+        optC2 = optim.SGD(C2.parameters(), lr=10*base_lr, momentum=base_momentum, weight_decay=weight_decay)
+        optDFeat = optim.SGD(netDFeat.parameters(), lr=D_lr, momentum=D_momentum, weight_decay=weight_decay)
+    elif config['train']['optimizer'][task] == 'Adam':
+        print('Setting Adam Optimizer')
+        optBase = optim.Adam(base_params, lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
+        optC1 = optim.Adam(C1.parameters(), lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
+        optC2 = optim.Adam(C2.parameters(), lr=base_lr, betas=(base_momentum, 0.99), weight_decay=weight_decay)
+        optDFeat = optim.Adam(netDFeat.parameters(), lr=D_lr, betas=(D_momentum, 0.99), weight_decay=weight_decay)
+    return optBase, optC1, optC2, optDFeat
+
+
+def load_snapshot(path, basemodel, C1=None, C2=None, netDFeat=None, map_location='cpu'):
+    """Load a snapshot written by Solver into the given modules."""
+    checkpoint = torch.load(path, map_location=map_location)
+    modules = {'basemodel': basemodel, 'C1': C1, 'C2': C2, 'netDFeat': netDFeat}
+    for key, module in modules.items():
+        if module is None:
+            continue
+        if key not in checkpoint:
+            raise KeyError('{} has no {} weights; only {} are stored (snapshots taken before '
+                           'C1/C2 were saved cannot be used for prediction)'.format(
+                               path, key, sorted(checkpoint.keys())))
+        module.load_state_dict(checkpoint[key])
+    return checkpoint
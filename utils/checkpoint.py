@@ -0,0 +1,31 @@
+import contextlib
+import torch
+import torch.nn as nn
+
+
+@contextlib.contextmanager
+def keep_running_stats(module):
+    """
+    BatchNorm layers in train mode update their running statistics again when
+    a forward pass is recomputed (e.g. during backward); restore them afterwards.
+    """
+    buffers = [(b, b.clone()) for m in module.modules()
+               if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training and m.track_running_stats
+               for b in m.buffers()]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for b, saved in buffers:
+                b.copy_(saved)
+
+
+def checkpointed(module, x):
+    """
+    module(x) without keeping the activations inside module; they are
+    recomputed during backward.
+    """
+    # torch.utils.checkpoint pulls in sympy; only load it when train.checkpoint is on
+    from torch.utils.checkpoint import checkpoint
+    return checkpoint(module, x, use_reentrant=False,
+                      context_fn=lambda: (contextlib.nullcontext(), keep_running_stats(module)))
@@ -0,0 +1,82 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+
+class ConcurrentDUpdate(object):
+    """
+    Runs the netDFeat update of a training step on a worker thread (and its
+    own CUDA stream), overlapped with the generator phases of the same step.
+
+    The update acts on a shadow copy of netDFeat with its own optimizer,
+    built from the state of optDFeat, so the generator phases can keep
+    using netDFeat meanwhile. The shadow optimizer is private: zero_grad()
+    on optDFeat from the training thread never touches the gradients of a
+    running update. submit() copies the current learning rates of optDFeat,
+    i.e. the lr schedule, to it. join() waits for the update and copies the
+    shadow weights into netDFeat. Staleness is therefore exactly one step:
+    the D update of step t sees the features of step t, as in the
+    sequential schedule, but the adversarial loss of step t is computed
+    with netDFeat as it was after step t-1.
+
+    Usage:
+        concurrent = ConcurrentDUpdate(netDFeat, optDFeat, device)
+        concurrent.submit(update_fn, features)   # update_fn(shadow, shadow_optimizer, features)
+        ...                                      # generator phases with netDFeat
+        result = concurrent.join()               # netDFeat now holds the updated weights
+    """
+    def __init__(self, netDFeat, optDFeat, device='cpu'):
+        self.netD = netDFeat
+        self.optDFeat = optDFeat
+        self.shadow = copy.deepcopy(netDFeat)
+        self._optimizer = type(optDFeat)(self.shadow.parameters(), **optDFeat.defaults)
+        self._optimizer.load_state_dict(optDFeat.state_dict())
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='D-update')
+        self.future = None
+
+    def _run(self, fn, features, args):
+        self._optimizer.zero_grad()
+        if self.stream is None:
+            return fn(self.shadow, self._optimizer, features, *args)
+        with torch.cuda.stream(self.stream):
+            return fn(self.shadow, self._optimizer, features, *args)
+
+    def submit(self, fn, features, *args):
+        """Start fn(shadow, shadow_optimizer, features, *args) on the worker thread; features is a list of tensors."""
+        assert self.future is None, 'join() the previous D update first'
+        for group, shadow_group in zip(self.optDFeat.param_groups, self._optimizer.param_groups):
+            shadow_group['lr'] = group['lr']
+        if self.stream is not None:
+            # The features come from the current stream; keep their memory until the D stream is done
+            self.stream.wait_stream(torch.cuda.current_stream(self.device))
+            for f in features:
+                f.record_stream(self.stream)
+        self.future = self.executor.submit(self._run, fn, features, args)
+
+    def join(self):
+        """Wait for the running update, publish the shadow weights to netDFeat and return fn's result."""
+        if self.future is None:
+            return None
+        result = self.future.result()
+        self.future = None
+        if self.stream is not None:
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+        with torch.no_grad():
+            for p, s in zip(self.netD.parameters(), self.shadow.parameters()):
+                p.copy_(s)
+            for b, s in zip(self.netD.buffers(), self.shadow.buffers()):
+                b.copy_(s)
+        return result
+
+    def close(self):
+        self.join()
+        self.executor.shutdown()
+
+
+def build_concurrent_D(config, netDFeat, optDFeat, device='cpu'):
+    """ConcurrentDUpdate when train.concurrent_D is set, None for the sequential schedule."""
+    if not config['train'].get('concurrent_D', False):
+        return None
+    return ConcurrentDUpdate(netDFeat, optDFeat, device)
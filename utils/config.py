@@ -0,0 +1,23 @@
+import json
+import yaml
+
+
+def load_config(path):
+    """
+    Load an experiment config, either the yaml passed to main.py or the
+    config.json it dumps into the log directory of every run.
+    """
+    with open(path, 'r') as f:
+        if path.endswith('.json'):
+            return json.load(f)
+        return yaml.safe_load(f)
+
+
+def merge_config(config, overlay):
+    """Recursively override the entries of config with those of overlay, in place."""
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge_config(config[key], value)
+        else:
+            config[key] = value
+    return config
@@ -0,0 +1,64 @@
+import io
+import time
+import numpy as np
+import torch
+from utils.loss import ConfusionMatrix
+
+
+def evaluate_accuracy(model, dataset, batch_size=64, num_workers=1, device='cpu'):
+    """Top-1 accuracy (%) of a model returning logits over a labeled dataset."""
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                         shuffle=False, drop_last=False)
+    correct = 0
+    size = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            output = model(images.to(torch.float).to(device))
+            if isinstance(output, tuple):
+                output = output[0]
+            correct += output.max(1)[1].cpu().eq(labels.long()).sum().item()
+            size += labels.size(0)
+    return 100. * correct / size
+
+
+def evaluate_segmentation(model, loader, num_classes, device='cpu', ignore_label=255, tiler=None):
+    """
+    Pixel accuracy and per-class IoU of a model returning (n, c, h, w) logits,
+    accumulated on `device` over the whole loader. With a
+    utils.tiling.TiledInference, images are predicted tile by tile.
+
+    Returns:
+      accuracy, per-class IoU (numpy), mIoU
+    """
+    hist = ConfusionMatrix(num_classes, device=device, ignore_label=ignore_label)
+    with torch.no_grad():
+        for images, labels in loader:
+            if tiler is not None:
+                tiler.update(hist, images.to(torch.float), labels.long())
+                continue
+            output = model(images.to(torch.float).to(device))
+            if isinstance(output, tuple):
+                output = output[0]
+            hist.update(output, labels.long())
+    return hist.accuracy(), hist.per_class_iu(), hist.mean_iu()
+
+
+def measure_latency(model, sample, iters=20, warmup=3):
+    """Median wall time (ms) of one forward pass over `sample`."""
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + iters):
+            start = time.perf_counter()
+            model(sample)
+            if sample.is_cuda:
+                torch.cuda.synchronize()
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+    return 1000. * float(np.median(times))
+
+
+def model_size_bytes(model):
+    """Size of the serialized state_dict."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
@@ -0,0 +1,72 @@
+import copy
+import torch
+import torch.nn as nn
+from torchvision.models.resnet import Bottleneck, BasicBlock
+from model.lowrank import LowRankLinear
+
+
+def fuse_conv_bn(conv, bn):
+    """Conv2d with an eval-mode BatchNorm2d folded into its weight and bias."""
+    fused = copy.deepcopy(conv)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.weight = nn.Parameter(conv.weight * scale.view(-1, 1, 1, 1))
+    fused.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def fuse_linear_bn(linear, bn):
+    """Linear with an eval-mode BatchNorm1d folded into its weight and bias."""
+    fused = copy.deepcopy(linear)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = linear.bias if linear.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.weight = nn.Parameter(linear.weight * scale.view(-1, 1))
+    fused.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def _fuse_pair(layer, bn):
+    if isinstance(layer, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+        return fuse_conv_bn(layer, bn)
+    if isinstance(layer, nn.Linear) and isinstance(bn, nn.BatchNorm1d):
+        return fuse_linear_bn(layer, bn)
+    if isinstance(layer, LowRankLinear) and isinstance(bn, nn.BatchNorm1d):
+        fused = copy.deepcopy(layer)
+        fused.up = fuse_linear_bn(layer.up, bn)
+        return fused
+    return None
+
+
+def fuse_bn(module):
+    """
+    Fold every BatchNorm that directly follows a Conv2d/Linear into that layer,
+    in place, and replace the BatchNorm by nn.Identity. Only pairs whose
+    execution order is known are folded: adjacent layers of nn.Sequential and
+    the convN/bnN pairs of torchvision's residual blocks. The module must be in
+    eval mode since running statistics are baked in.
+    """
+    assert not module.training, 'fuse_bn needs a module in eval mode'
+    with torch.no_grad():
+        _fuse_bn(module)
+    return module
+
+
+def _fuse_bn(module):
+    if isinstance(module, nn.Sequential):
+        names = list(module._modules.keys())
+        for name, next_name in zip(names[:-1], names[1:]):
+            fused = _fuse_pair(module._modules[name], module._modules[next_name])
+            if fused is not None:
+                module._modules[name] = fused
+                module._modules[next_name] = nn.Identity()
+    elif isinstance(module, (Bottleneck, BasicBlock)):
+        i = 1
+        while hasattr(module, 'conv{}'.format(i)):
+            fused = _fuse_pair(getattr(module, 'conv{}'.format(i)), getattr(module, 'bn{}'.format(i)))
+            if fused is not None:
+                setattr(module, 'conv{}'.format(i), fused)
+                setattr(module, 'bn{}'.format(i), nn.Identity())
+            i += 1
+
+    for child in module.children():
+        _fuse_bn(child)
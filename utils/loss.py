@@ -2,7 +2,6 @@ import torch
 import numpy as np
 import torch.nn.functional as F
 import torch.nn as nn
-from torch.autograd import Variable
 
 
 class CrossEntropy2d(nn.Module):
@@ -26,15 +25,19 @@ class CrossEntropy2d(nn.Module):
         assert predict.size(0) == target.size(0), "{0} vs {1} ".format(predict.size(0), target.size(0))
         assert predict.size(2) == target.size(1), "{0} vs {1} ".format(predict.size(2), target.size(1))
         assert predict.size(3) == target.size(2), "{0} vs {1} ".format(predict.size(3), target.size(3))
-        n, c, h, w = predict.size()
-        target_mask = (target >= 0) * (target != self.ignore_label)
-        target = target[target_mask]
-        if not target.data.dim():
-            return Variable(torch.zeros(1))
-        predict = predict.transpose(1, 2).transpose(2, 3).contiguous()
-        predict = predict[target_mask.view(n, h, w, 1).repeat(1, 1, 1, c)].view(-1, c)
-        loss = F.cross_entropy(predict, target, weight=weight, size_average=self.size_average)
-        return loss
+        # Native ignore_index on the NCHW logits: no transposed or masked copies
+        # of predict. Negative labels are ignored as well.
+        target = target.masked_fill(target < 0, self.ignore_label)
+        loss = F.cross_entropy(predict, target, weight=weight, ignore_index=self.ignore_label, reduction='sum')
+        if not self.size_average:
+            return loss
+        # Mean over the labeled pixels, 0 (instead of nan) when there are none
+        valid = target != self.ignore_label
+        if weight is None:
+            total = valid.sum()
+        else:
+            total = torch.where(valid, weight[target.clamp(max=predict.size(1) - 1)], weight.new_zeros(())).sum()
+        return loss / total.clamp(min=1e-12)
 
 
 def loss_calc(pred, label):
@@ -48,6 +51,16 @@ def loss_calc(pred, label):
     return criterion(pred, label)
 
 
+def distillation_loss(student_logits, teacher_logits, temperature=1.):
+    """
+    KL(teacher || student) of the temperature-softened class distributions,
+    scaled by T^2 so that gradients keep their magnitude across temperatures.
+    """
+    log_p_student = F.log_softmax(student_logits / temperature, dim=1)
+    p_teacher = F.softmax(teacher_logits / temperature, dim=1)
+    return F.kl_div(log_p_student, p_teacher, reduction='batchmean') * temperature ** 2
+
+
 def lr_poly(base_lr, iter, max_iter, power):
     return base_lr * ((1 - float(iter) / max_iter) ** (power))
 
@@ -72,3 +85,52 @@ def seg_accuracy(pred, label, num_cls):
 
 def per_class_iu(hist):
     return np.diag(hist) / (hist.sum(1) + hist.sum(0) - np.diag(hist))
+
+
+class ConfusionMatrix(object):
+    """
+    Confusion matrix (rows: labels, columns: predictions) accumulated on the
+    device of the predictions over a whole validation pass, without host
+    syncs; read it once at the end.
+
+    Usage:
+        hist = ConfusionMatrix(num_classes, device)
+        for images, labels in loader:
+            hist.update(model(images), labels)
+        print(hist.mean_iu())
+    """
+    def __init__(self, num_classes, device='cpu', ignore_label=255):
+        self.num_classes = num_classes
+        self.ignore_label = ignore_label
+        # One extra bin collects the ignored pixels
+        self.counts = torch.zeros(num_classes ** 2 + 1, dtype=torch.long, device=device)
+
+    def reset(self):
+        self.counts.zero_()
+
+    def update(self, pred, label):
+        """pred: (n, c, h, w) logits or (n, h, w) class indices, label: (n, h, w)"""
+        if pred.dim() == label.dim() + 1:
+            pred = pred.argmax(1)
+        n = self.num_classes
+        label = label.to(self.counts.device)
+        pred = pred.to(self.counts.device)
+        valid = (label >= 0) & (label < n)
+        # bincount by scatter_add_: the output size is fixed, so nothing is read back
+        index = torch.where(valid, n * label + pred, n ** 2).flatten()
+        self.counts.scatter_add_(0, index, self.counts.new_ones(()).expand_as(index))
+
+    def histogram(self):
+        return self.counts[:-1].view(self.num_classes, self.num_classes)
+
+    def accuracy(self):
+        hist = self.histogram().double()
+        return (hist.diag().sum() / hist.sum()).item()
+
+    def per_class_iu(self):
+        """numpy array of per-class IoU, nan for classes absent from labels and predictions."""
+        hist = self.histogram().double()
+        return (hist.diag() / (hist.sum(1) + hist.sum(0) - hist.diag())).cpu().numpy()
+
+    def mean_iu(self):
+        return float(np.nanmean(self.per_class_iu()))
@@ -0,0 +1,205 @@
+import collections
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+import torch
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_rss(pid='self'):
+    """Resident set size of a process in bytes, from /proc; None when it is not readable."""
+    try:
+        with open('/proc/{}/statm'.format(pid), 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def process_pss(pid='self'):
+    """
+    Proportional set size of a process in bytes: pages shared with other
+    processes (e.g. forked DataLoader workers and their parent) count
+    1/sharers each. Falls back to the RSS without /proc/{pid}/smaps_rollup.
+    """
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid), 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return process_rss(pid)
+
+
+def child_pids(pid=None):
+    """Direct children of a process (e.g. DataLoader workers), from /proc."""
+    pid = pid or os.getpid()
+    children = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'r') as f:
+                # The command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class MemoryMonitor(object):
+    """
+    Opt-in memory accounting of a training run. Every training step is split
+    into the phases of the StepProfiler it is attached to: the RSS (and CUDA
+    allocator) difference across each phase is summed per phase, so the
+    growth retained over the run is attributed to the phase that allocated
+    it, and transient allocations freed within a phase cancel out. Growth
+    inside a step but outside its phases (lr adjustment, zero_grad) goes to
+    'other', growth from one step to the next (validation, evaluator
+    submission, resolution changes, ...) to 'between steps'.
+
+    sample(step), every log step, appends to memory.jsonl: process RSS, the
+    PSS of the child processes (DataLoader workers, evaluator), CUDA
+    allocator stats, the per-phase growth so far and, with tracemalloc, the
+    Python allocation sites that grew most since the previous sample. When
+    the RSS or worker growth fitted over the samples after `warmup` steps
+    exceeds alert_MB_per_1k per 1000 steps, an alert is printed and logged.
+    """
+    def __init__(self, log_dir, device='cpu', use_tracemalloc=False, top=10, warmup=1000, alert_MB_per_1k=50.,
+                 window=20):
+        self.path = os.path.join(log_dir, 'memory.jsonl')
+        self.cuda = str(device).startswith('cuda')
+        self.device = device
+        self.use_tracemalloc = use_tracemalloc
+        self.top = top
+        self.warmup = warmup
+        self.alert_MB_per_1k = alert_MB_per_1k
+        # Samples in the growth fit
+        self.series = collections.deque(maxlen=window)
+        self.phase_growth = collections.OrderedDict()
+        self.phase_start = None
+        self.step_start = None
+        self.step_phases = 0.
+        self.last_step_end = None
+        self.snapshot = None
+        self.start_time = time.time()
+        if use_tracemalloc:
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def _usage(self):
+        """RSS plus CUDA allocated bytes of this process."""
+        rss = process_rss() or 0
+        allocated = torch.cuda.memory_allocated(self.device) if self.cuda else 0
+        return rss + allocated
+
+    def _add(self, name, delta):
+        self.phase_growth[name] = self.phase_growth.get(name, 0.) + delta
+
+    def step_begin(self):
+        self.step_start = self._usage()
+        self.step_phases = 0.
+        if self.last_step_end is not None:
+            self._add('between steps', self.step_start - self.last_step_end)
+
+    def step_end(self):
+        self.last_step_end = self._usage()
+        self._add('other', self.last_step_end - self.step_start - self.step_phases)
+
+    def phase_begin(self, name):
+        self.phase_start = self._usage()
+
+    def phase_end(self, name):
+        delta = self._usage() - self.phase_start
+        self.step_phases += delta
+        self._add(name, delta)
+
+    def sample(self, step):
+        rss = process_rss()
+        workers = [process_pss(pid) for pid in child_pids()]
+        workers = [w for w in workers if w is not None]
+        record = {
+            'step': step,
+            'time': time.time() - self.start_time,
+            'rss_MB': rss / 2. ** 20 if rss is not None else None,
+            'workers': len(workers),
+            'workers_pss_MB': sum(workers) / 2. ** 20,
+            'phase_growth_MB': {k: v / 2. ** 20 for k, v in self.phase_growth.items()},
+        }
+        if self.cuda:
+            record['cuda_allocated_MB'] = torch.cuda.memory_allocated(self.device) / 2. ** 20
+            record['cuda_reserved_MB'] = torch.cuda.memory_reserved(self.device) / 2. ** 20
+            record['cuda_peak_MB'] = torch.cuda.max_memory_allocated(self.device) / 2. ** 20
+        if self.use_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            record['python_traced_MB'] = tracemalloc.get_traced_memory()[0] / 2. ** 20
+            record['top_growth'] = [{'site': str(stat.traceback), 'size_diff_KB': stat.size_diff / 1024.,
+                                     'count_diff': stat.count_diff}
+                                    for stat in snapshot.compare_to(self.snapshot, 'lineno')[:self.top]]
+            self.snapshot = snapshot
+
+        if step > self.warmup and rss is not None:
+            self.series.append((step, record['rss_MB'], record['workers_pss_MB']))
+        record['alert'] = self._check_growth(record)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        return record
+
+    def growth_per_1k(self):
+        """(RSS, workers PSS) growth in MB per 1000 steps, fitted over the recent samples; None before 3 samples."""
+        if len(self.series) < 3:
+            return None
+        steps, rss, workers = [np.array(x, dtype=float) for x in zip(*self.series)]
+        return np.polyfit(steps, rss, 1)[0] * 1000., np.polyfit(steps, workers, 1)[0] * 1000.
+
+    def _check_growth(self, record):
+        growth = self.growth_per_1k()
+        if growth is None:
+            return None
+        main, workers = growth
+        if max(main, workers) <= self.alert_MB_per_1k:
+            return None
+        phases = sorted(record['phase_growth_MB'].items(), key=lambda kv: -kv[1])[:3]
+        alert = 'memory alert at step {}: RSS {:+.1f} MB/1k steps, workers {:+.1f} MB/1k steps (threshold {}); ' \
+                'largest growth in {}'.format(record['step'], main, workers, self.alert_MB_per_1k,
+                                              ', '.join('{} {:+.1f} MB'.format(k, v) for k, v in phases))
+        print(alert)
+        return alert
+
+    def summary(self, record):
+        line = 'memory: RSS {:.0f} MB, {} child processes PSS {:.0f} MB'.format(
+            record['rss_MB'] or 0., record['workers'], record['workers_pss_MB'])
+        if 'cuda_allocated_MB' in record:
+            line += ', CUDA allocated {:.0f} MB reserved {:.0f} MB'.format(record['cuda_allocated_MB'],
+                                                                         record['cuda_reserved_MB'])
+        growth = self.growth_per_1k()
+        if growth is not None:
+            line += ', growth {:+.1f} MB/1k steps (workers {:+.1f})'.format(*growth)
+        lines = [line]
+        for item in record.get('top_growth', [])[:3]:
+            lines.append('  {:+.1f} KB {}'.format(item['size_diff_KB'], item['site']))
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.use_tracemalloc:
+            tracemalloc.stop()
+
+
+def build_memory_monitor(config, log_dir, device='cpu'):
+    """MemoryMonitor from exp_setting.memory; None when it is missing or disabled."""
+    settings = config['exp_setting'].get('memory') or {}
+    if not settings.get('enabled', False):
+        return None
+    return MemoryMonitor(log_dir, device=device, use_tracemalloc=settings.get('tracemalloc', False),
+                         top=settings.get('top', 10), warmup=settings.get('warmup', 1000),
+                         alert_MB_per_1k=settings.get('alert_MB_per_1k', 50.), window=settings.get('window', 20))
@@ -0,0 +1,197 @@
+import os
+import time
+import collections
+import threading
+import numpy as np
+import torch
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.memory is not None:
+            profiler.memory.phase_begin(self.name)
+        if not profiler.enabled:
+            return self
+        if profiler.trace is not None:
+            self.record = torch.profiler.record_function(self.name)
+            self.record.__enter__()
+        profiler._sync()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        if profiler.enabled:
+            profiler._sync()
+            profiler.current[self.name] = profiler.current.get(self.name, 0.) + time.perf_counter() - self.start
+            if self.record is not None:
+                self.record.__exit__(*exc)
+        if profiler.memory is not None:
+            profiler.memory.phase_end(self.name)
+        return False
+
+
+class _Step(object):
+    def __init__(self, profiler, i_iter):
+        self.profiler = profiler
+        self.i_iter = i_iter
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.memory is not None:
+            profiler.memory.step_begin()
+        if not profiler.enabled:
+            return self
+        profiler.current = {}
+        profiler.calls = 0
+        profiler.syncs = 0
+        profiler._start_trace(self.i_iter)
+        profiler._patch()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        if profiler.memory is not None:
+            profiler.memory.step_end()
+        if not profiler.enabled:
+            return False
+        total = time.perf_counter() - self.start
+        profiler._unpatch()
+        for name, elapsed in profiler.current.items():
+            profiler.times[name].append(elapsed)
+        # Phases that did not run this step (e.g. logging) count as zero
+        for name in profiler.times:
+            if name not in profiler.current:
+                profiler.times[name].append(0.)
+        profiler.totals.append(total)
+        profiler.call_counts.append(profiler.calls)
+        profiler.sync_counts.append(profiler.syncs)
+        profiler._stop_trace(self.i_iter)
+        return False
+
+
+class StepProfiler(object):
+    """
+    Wall time of each phase of a training step, the number of .item()/.cpu()
+    calls per step made by the training thread (those on device tensors are
+    host-device syncs; pin-memory and D-update threads are not counted), and
+    optional torch.profiler Chrome traces of selected step windows.
+
+    Usage:
+        with profiler.step(i_iter):
+            with profiler.phase('data'):
+                ...
+
+    With a utils.memory.MemoryMonitor, the same step and phase boundaries
+    attribute memory growth. When disabled and without a monitor, step()
+    and phase() return a shared no-op context.
+    """
+    SYNC_METHODS = ('item', 'cpu')
+
+    def __init__(self, enabled=False, window=100, trace_steps=(), trace_length=5,
+                 trace_dir='.', device='cpu', memory=None):
+        self.enabled = enabled
+        self.memory = memory
+        self.window = window
+        self.trace_steps = set(trace_steps)
+        self.trace_length = trace_length
+        self.trace_dir = trace_dir
+        self.cuda = str(device).startswith('cuda')
+
+        self.times = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.totals = collections.deque(maxlen=window)
+        self.call_counts = collections.deque(maxlen=window)
+        self.sync_counts = collections.deque(maxlen=window)
+        self.current = {}
+        self.calls = 0
+        self.syncs = 0
+        self.trace = None
+        self.trace_start = None
+        self._originals = {}
+        self._thread = None
+
+    def step(self, i_iter):
+        if not self.enabled and self.memory is None:
+            return _NULL
+        return _Step(self, i_iter)
+
+    def phase(self, name):
+        if not self.enabled and self.memory is None:
+            return _NULL
+        return _Phase(self, name)
+
+    def _sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _patch(self):
+        self._thread = threading.get_ident()
+        for name in self.SYNC_METHODS:
+            original = getattr(torch.Tensor, name)
+            self._originals[name] = original
+            setattr(torch.Tensor, name, self._counted(original))
+
+    def _unpatch(self):
+        for name, original in self._originals.items():
+            setattr(torch.Tensor, name, original)
+        self._originals = {}
+
+    def _counted(self, fn):
+        def counted(tensor, *args, **kwargs):
+            if threading.get_ident() == self._thread:
+                self.calls += 1
+                if tensor.device.type != 'cpu':
+                    self.syncs += 1
+            return fn(tensor, *args, **kwargs)
+        return counted
+
+    def _start_trace(self, i_iter):
+        if self.trace is None and i_iter in self.trace_steps:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(activities=activities)
+            self.trace.__enter__()
+            self.trace_start = i_iter
+
+    def _stop_trace(self, i_iter):
+        if self.trace is not None and i_iter + 1 - self.trace_start >= self.trace_length:
+            self.trace.__exit__(None, None, None)
+            path = os.path.join(self.trace_dir, 'trace_{}-{}.json'.format(self.trace_start+1, i_iter+1))
+            self.trace.export_chrome_trace(path)
+            print('saved profiler trace {}'.format(path))
+            self.trace = None
+
+    def summary(self):
+        """Rolling per-phase table over the last `window` steps."""
+        if not self.totals:
+            return ''
+        total = np.mean(self.totals) * 1000.
+        lines = ['{:16s} {:>9s} {:>9s} {:>9s} {:>7s}'.format('phase', 'mean ms', 'p50 ms', 'max ms', '%step')]
+        for name, times in self.times.items():
+            times = np.array(times) * 1000.
+            lines.append('{:16s} {:9.2f} {:9.2f} {:9.2f} {:6.1f}%'.format(
+                name, times.mean(), np.median(times), times.max(), 100. * times.mean() / total))
+        lines.append('{:16s} {:9.2f} {:9.2f} {:9.2f}'.format(
+            'step', total, np.median(self.totals) * 1000., np.max(self.totals) * 1000.))
+        lines.append('per step: {:.1f} item()/cpu() calls, {:.1f} on device tensors (host-device syncs), '
+                     'last {} steps'.format(np.mean(self.call_counts), np.mean(self.sync_counts), len(self.totals)))
+        return '\n'.join(lines)
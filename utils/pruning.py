@@ -0,0 +1,160 @@
+import fcntl
+import json
+import os
+import time
+import numpy as np
+
+
+class ResultsStore(object):
+    """
+    Validation results of concurrent runs, one json record per line in a
+    local file. Appends take an exclusive lock, reads a shared one.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def append(self, record):
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                lines = f.readlines()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        # A run killed mid-write leaves at most a truncated last line
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+        return records
+
+
+def _curves(records):
+    """{run: {step: acc}} of the records."""
+    curves = {}
+    for r in records:
+        curves.setdefault(r['run'], {})[r['step']] = r['acc']
+    return curves
+
+
+class MedianStopping(object):
+    """
+    Stop when the running mean accuracy of this run up to the step is below
+    the median of the running means of the other runs at the same step.
+    """
+    def __init__(self, min_runs=3):
+        self.min_runs = min_runs
+
+    def __call__(self, run, step, curves):
+        def running_mean(curve):
+            return np.mean([acc for s, acc in curve.items() if s <= step])
+        others = [running_mean(c) for r, c in curves.items() if r != run and step in c]
+        if len(others) < self.min_runs:
+            return False, 'median: {} other runs at step {}, need {}'.format(len(others), step, self.min_runs)
+        mine, median = running_mean(curves[run]), np.median(others)
+        return mine < median, 'median: running mean {:.2f} vs median {:.2f} of {} runs'.format(mine, median, len(others))
+
+
+class SuccessiveHalving(object):
+    """
+    Asynchronous successive halving: at every rung step, continue only when
+    the accuracy of this run is in the top 1/eta of the runs that reached it.
+    """
+    def __init__(self, rungs=(5000, 10000, 20000), eta=3):
+        self.rungs = sorted(rungs)
+        self.eta = eta
+
+    def __call__(self, run, step, curves):
+        if step not in self.rungs:
+            return False, 'halving: {} is not a rung'.format(step)
+        accs = sorted([c[step] for c in curves.values() if step in c], reverse=True)
+        if len(accs) < self.eta:
+            return False, 'halving: {} runs at rung {}, need {}'.format(len(accs), step, self.eta)
+        keep = accs[:max(len(accs) // self.eta, 1)]
+        mine = curves[run][step]
+        return mine < keep[-1], 'halving: {:.2f} vs top-{} cutoff {:.2f} at rung {}'.format(
+            mine, len(keep), keep[-1], step)
+
+
+class Plateau(object):
+    """Stop when the best accuracy has not improved by min_delta over the last `patience` validations."""
+    def __init__(self, patience=5, min_delta=0.1):
+        self.patience = patience
+        self.min_delta = min_delta
+
+    def __call__(self, run, step, curves):
+        accs = [acc for _, acc in sorted(curves[run].items())]
+        if len(accs) <= self.patience:
+            return False, 'plateau: {} validations'.format(len(accs))
+        before = max(accs[:-self.patience])
+        recent = max(accs[-self.patience:])
+        return recent < before + self.min_delta, 'plateau: best {:.2f} over the last {} validations vs {:.2f} before'.format(
+            recent, self.patience, before)
+
+
+POLICIES = {
+    'median': MedianStopping,
+    'halving': SuccessiveHalving,
+    'plateau': Plateau,
+}
+
+
+class Pruner(object):
+    """
+    Called by Solver.train at every validation point: records the target
+    accuracy in the shared results file and asks the policy whether the run
+    should stop.
+    """
+    def __init__(self, policy, store, run, group, min_steps=0):
+        self.policy = policy
+        self.store = store
+        self.run = run
+        self.group = group
+        self.min_steps = min_steps
+        self.reason = None
+
+    def report(self, step, acc, final=False):
+        """Record the accuracy; True when the policy stops the run. The final validation of a run is only recorded."""
+        if self.policy is None:
+            return False
+        self.store.append({'run': self.run, 'group': self.group, 'step': step, 'acc': float(acc),
+                           'time': time.time()})
+        if final or step < self.min_steps:
+            return False
+        curves = _curves(r for r in self.store.read() if r['group'] == self.group)
+        stop, self.reason = self.policy(self.run, step, curves)
+        print('pruning ({}): {}'.format('stop' if stop else 'continue', self.reason))
+        return stop
+
+
+def build_pruner(config, exp_name):
+    """
+    Pruner from the exp_setting.pruning section; a no-op when it is missing or
+    policy is null. The run id is exp_name plus the launch time and pid, so a
+    relaunch under the same name starts a new curve in the results file.
+    """
+    run = '{}@{}.{}'.format(exp_name, time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+    pruning = config['exp_setting'].get('pruning') or {}
+    name = pruning.get('policy')
+    if name is None:
+        return Pruner(None, None, run, None)
+    if name not in POLICIES:
+        raise ValueError('unknown pruning policy {}, expected one of {}'.format(name, sorted(POLICIES)))
+    policy = POLICIES[name](**(pruning.get(name) or {}))
+    group = pruning.get('group') or '{}/{}'.format(config['data']['task'], config['data']['target'])
+    return Pruner(policy, ResultsStore(pruning['results_file']), run, group, pruning.get('min_steps', 0))
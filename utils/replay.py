@@ -0,0 +1,53 @@
+import torch
+
+
+class FeatureReplay(object):
+    """
+    Bounded ring buffer of recent detached adversarial features, per domain,
+    preallocated on the netDFeat device. push() stores the features of a
+    stacked domain batch (domain after domain, target last) with the step
+    they were computed at; sample() draws a batch with the same layout from
+    the entries at most max_staleness steps old, fresh and older mixed, so
+    that the domain labels of the regular D update apply unchanged.
+    """
+    def __init__(self, num_domain, feature_dim, size, max_staleness, device='cpu'):
+        self.num_domain = num_domain
+        self.size = size
+        self.max_staleness = max_staleness
+        self.features = torch.zeros(num_domain, size, feature_dim, device=device)
+        # Step of every slot, -1 while it is empty
+        self.steps = torch.full((num_domain, size), -1, dtype=torch.long, device=device)
+        self.position = 0
+
+    @torch.no_grad()
+    def push(self, features, i_iter):
+        features = features.view(self.num_domain, -1, features.size(1))
+        n = features.size(1)
+        assert n <= self.size, 'replay size {} is smaller than a per-domain batch of {}'.format(self.size, n)
+        index = (self.position + torch.arange(n, device=self.features.device)) % self.size
+        self.features.index_copy_(1, index, features.to(self.features.device))
+        self.steps[:, index] = i_iter
+        self.position = (self.position + n) % self.size
+
+    @torch.no_grad()
+    def sample(self, n, i_iter):
+        """[num_domain * n, feature_dim] features drawn uniformly from the valid slots of each domain."""
+        valid = (self.steps >= 0) & (self.steps >= i_iter - self.max_staleness)
+        # Every domain holds at least the batch pushed this step
+        index = torch.multinomial(valid.float(), n, replacement=True)
+        return torch.gather(self.features, 1, index.unsqueeze(2).expand(-1, -1, self.features.size(2))) \
+            .view(self.num_domain * n, -1)
+
+    def staleness(self, i_iter):
+        """Mean age in steps of the valid entries."""
+        valid = (self.steps >= 0) & (self.steps >= i_iter - self.max_staleness)
+        return (i_iter - self.steps[valid]).float().mean().item()
+
+
+def build_replay(config, num_domain, feature_dim, device='cpu'):
+    """FeatureReplay from train.replay; None when it is missing or disabled."""
+    settings = config['train'].get('replay') or {}
+    if not settings.get('enabled', False):
+        return None
+    return FeatureReplay(num_domain, feature_dim, settings.get('size', 1024), settings.get('max_staleness', 100),
+                         device=device)
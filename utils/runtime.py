@@ -0,0 +1,63 @@
+import glob
+import os
+import torch
+
+
+def parse_cpulist(cpulist):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def numa_nodes():
+    """
+    CPUs usable by this process grouped by NUMA node, from
+    /sys/devices/system/node. A single group when the topology is unknown.
+    """
+    usable = set(available_cpus())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist')):
+        with open(path, 'r') as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in usable]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(usable)]
+
+
+def apply_runtime(runtime):
+    """
+    Apply the exp_setting.runtime section of the config to this process:
+    torch intra/inter-op threads and the CPU affinity of the main process.
+    Unset (None) entries keep the torch/OS defaults.
+    """
+    if not runtime:
+        return
+    if runtime.get('main_cpus'):
+        os.sched_setaffinity(0, runtime['main_cpus'])
+    if runtime.get('num_threads'):
+        torch.set_num_threads(runtime['num_threads'])
+    if runtime.get('interop_threads'):
+        try:
+            torch.set_num_interop_threads(runtime['interop_threads'])
+        except RuntimeError:
+            # Only possible before the first inter-op parallel work
+            print('interop_threads: already initialized, keep {}'.format(torch.get_num_interop_threads()))
+
+
+def set_worker_affinity(cpus, worker_id):
+    """DataLoader worker_init_fn (with functools.partial) pinning workers to cpus."""
+    os.sched_setaffinity(0, cpus)
@@ -0,0 +1,115 @@
+import torch
+import torch.nn.functional as F
+
+
+def tile_starts(size, tile, stride):
+    """Start offsets of tiles of length `tile` every `stride`, the last one flush with the end."""
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    return starts + [size - tile]
+
+
+def window_weights(tile_h, tile_w, overlap, device='cpu'):
+    """
+    (tile_h, tile_w) blending weights: 1 in the interior, ramping linearly
+    down to 1/(overlap+1) over the `overlap` pixels next to each edge.
+    """
+    def ramp(n):
+        i = torch.arange(n, dtype=torch.float, device=device)
+        return torch.clamp(torch.min(i + 1, n - i) / (overlap + 1), max=1.)
+    return ramp(tile_h)[:, None] * ramp(tile_w)[None, :]
+
+
+class TiledInference(object):
+    """
+    Sliding-window inference of a model returning (n, c, h, w) logits (or a
+    tuple starting with them) on images too large for one forward pass.
+    Overlapping tiles of all images of a batch are run together, batch_tiles
+    at a time, and their logits are blended with window_weights. Rows are
+    finalized as soon as no later tile covers them, so the blended logits
+    held at any time are one tile high, whatever the image height.
+
+    Usage:
+        tiler = TiledInference(model, num_classes, tile_size=(512, 512), overlap=128)
+        hist = ConfusionMatrix(num_classes, device)
+        for images, labels in loader:
+            tiler.update(hist, images, labels)
+    """
+    def __init__(self, model, num_classes, tile_size=(512, 512), overlap=128, batch_tiles=4, device='cpu'):
+        if isinstance(tile_size, int):
+            tile_size = (tile_size, tile_size)
+        assert overlap < min(tile_size), 'overlap {} must be smaller than the tile {}'.format(overlap, tile_size)
+        self.model = model
+        self.num_classes = num_classes
+        self.tile_size = tuple(tile_size)
+        self.overlap = overlap
+        self.batch_tiles = batch_tiles
+        self.device = device
+
+    def _forward(self, tiles):
+        output = self.model(tiles)
+        if isinstance(output, tuple):
+            output = output[0]
+        if output.shape[-2:] != tiles.shape[-2:]:
+            # e.g. DeepLab logits at 1/8 of the input resolution
+            output = F.interpolate(output, size=tiles.shape[-2:], mode='bilinear', align_corners=False)
+        return output.float()
+
+    def bands(self, images):
+        """
+        Yield (y0, y1, logits) for consecutive row bands of the batch, with
+        logits of shape (n, num_classes, y1 - y0, w).
+        """
+        n, _, h, w = images.shape
+        tile_h, tile_w = min(self.tile_size[0], h), min(self.tile_size[1], w)
+        ys = tile_starts(h, tile_h, tile_h - self.overlap)
+        xs = tile_starts(w, tile_w, tile_w - self.overlap)
+        weight = window_weights(tile_h, tile_w, self.overlap, self.device)
+
+        # Blended rows [y, y + tile_h) of the current tile row. Everything above
+        # the next tile row is final once this one is done, so the rest moves up.
+        logits = torch.zeros(n, self.num_classes, tile_h, w, device=self.device)
+        weight_sum = torch.zeros(tile_h, w, device=self.device)
+        with torch.no_grad():
+            for r, y in enumerate(ys):
+                for x in xs:
+                    weight_sum[:, x: x + tile_w] += weight
+
+                # Tiles of this row across all images, batch_tiles per forward
+                positions = [(i, x) for i in range(n) for x in xs]
+                for start in range(0, len(positions), self.batch_tiles):
+                    chunk = positions[start: start + self.batch_tiles]
+                    tiles = torch.stack([images[i, :, y: y + tile_h, x: x + tile_w] for i, x in chunk])
+                    output = self._forward(tiles.to(self.device))
+                    output *= weight
+                    for (i, x), o in zip(chunk, output):
+                        logits[i, :, :, x: x + tile_w] += o
+
+                done = (ys[r + 1] if r + 1 < len(ys) else h) - y
+                yield y, y + done, logits[:, :, :done] / weight_sum[:done]
+                keep = tile_h - done
+                if keep > 0:
+                    logits[:, :, :keep] = logits[:, :, done:].clone()
+                    weight_sum[:keep] = weight_sum[done:].clone()
+                logits[:, :, keep:] = 0.
+                weight_sum[keep:] = 0.
+
+    def predict(self, images):
+        """(n, num_classes, h, w) logits of the whole batch; memory grows with the image."""
+        return torch.cat([band for _, _, band in self.bands(images)], dim=2)
+
+    def update(self, confusion, images, labels):
+        """Stream the predictions of a batch into a utils.loss.ConfusionMatrix band by band."""
+        for y0, y1, band in self.bands(images):
+            confusion.update(band.argmax(1), labels[:, y0: y1])
+
+
+def build_tiler(config, model, device='cpu'):
+    """TiledInference from the data.tiling section, None when it is missing or disabled."""
+    task = config['data']['task']
+    tiling = config['data'].get('tiling') or {}
+    if not tiling.get('enabled', False):
+        return None
+    return TiledInference(model, config['data']['num_classes'][task], tile_size=tiling['tile_size'],
+                          overlap=tiling['overlap'], batch_tiles=tiling.get('batch_tiles', 4), device=device)